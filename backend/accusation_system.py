@@ -1,12 +1,29 @@
+import asyncio
+import json
 import logging
+import weakref
 from typing import List, Dict, Optional
 from .models import Character, Accusation, Case
 from .ai_service import AIService
+from .config import GameConfig
+from .streaming import bounded_stream
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 全进程共享的投票并发上限，避免多场审判同时投票时压垮上游
+# 信号量绑定创建时的事件循环，因此在运行中的事件循环内按需创建，每个事件循环一个
+_global_vote_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _get_global_vote_semaphore() -> asyncio.Semaphore:
+    """获取当前事件循环的全局投票信号量"""
+    loop = asyncio.get_running_loop()
+    semaphore = _global_vote_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _global_vote_semaphores[loop] = asyncio.Semaphore(max(1, GameConfig.VOTE_GLOBAL_CONCURRENCY))
+    return semaphore
+
 class AccusationSystem:
     """指控和反驳系统"""
     
@@ -253,7 +270,7 @@ class AccusationSystem:
     我的反驳："""
             logger.info(f"生成反驳, 提示词: {prompt}")
             # 使用异步生成器正确地流式输出
-            async for chunk in self.ai_service.get_stream_response(prompt):
+            async for chunk in self.ai_service.get_stream_response(prompt, call_site="defense"):
                 yield chunk
                 
         except Exception as e:
@@ -301,7 +318,7 @@ class AccusationSystem:
 
         try:
             logger.info(f"生成证词, 提示词: {prompt}")
-            async for chunk in self.ai_service.get_stream_response(prompt):
+            async for chunk in self.ai_service.get_stream_response(prompt, call_site="testimony"):
                 yield chunk
         except Exception as e:
             logger.error(f"生成证人证词时出错 - 证人: {witness.name}, 错误: {str(e)}", exc_info=True)
@@ -371,7 +388,7 @@ class AccusationSystem:
 
         try:
             logger.info(f"生成投票，提示词：{prompt}")
-            async for chunk in self.ai_service.get_stream_response(prompt):
+            async for chunk in self.ai_service.get_stream_response(prompt, call_site="vote"):
                 if chunk:
                     yield chunk
         except Exception as e:
@@ -380,6 +397,144 @@ class AccusationSystem:
             async for chunk in self._generate_error_vote(voter, accusation):
                 yield chunk
 
+    def generate_vote_streams(self,
+                              voters: List[Character],
+                              accusation: 'Accusation',
+                              case: Case,
+                              conversation_history: Dict[str, List[Dict]] = None) -> list:
+        """为所有投票者创建受并发上限约束的投票流，可交给 multiplex_streams 并发消费"""
+        trial_semaphore = asyncio.Semaphore(max(1, GameConfig.VOTE_CONCURRENCY))
+        global_semaphore = _get_global_vote_semaphore()
+        return [
+            bounded_stream(
+                self.generate_vote_stream(voter, accusation, case, conversation_history),
+                trial_semaphore,
+                global_semaphore
+            )
+            for voter in voters
+        ]
+
+    def _build_juror_evidence(self, case: Case, voter: Character) -> str:
+        """批量投票中陪审员掌握的证据（精简形式）
+
+        逐人投票时会先调用AI分析证据，批量投票为了只调用一次模型，改为直接列出证据：
+        已公开的证据标注名称，私下知道的证据附上意义（描述已在公开的证据列表中）。
+        """
+        if not self.evidence_system:
+            return ""
+        revealed = [e.name for e in self.evidence_system.get_all_revealed_evidence(case)]
+        private = [
+            f"{e.name}（{e.significance}）" for e in self.evidence_system.get_character_known_evidence(voter, case)
+            if e.name not in self.evidence_system.revealed_evidence
+        ]
+        parts = []
+        if revealed:
+            parts.append(f"已公开的证据：{'、'.join(revealed)}")
+        if private:
+            parts.append(f"我私下知道的证据：{'；'.join(private)}")
+        return "\n".join(parts)
+
+    def _build_juror_section(self, voter: Character, case: Case, conversation_history: Dict[str, List[Dict]]) -> str:
+        """构建批量投票中单个陪审员的精简信息（与逐人投票的角色设定、秘密和证据一致）"""
+        section = f"""【陪审员：{voter.name}】
+{voter.age}岁，{voter.occupation}；性格：{voter.personality}
+背景：{voter.background}
+秘密：{voter.secret}
+我知道的信息：{"；".join(voter.knowledge)}
+{self._build_juror_evidence(case, voter)}
+立场：{"我是真凶，需要把注意力转移到其他人身上" if voter.is_guilty else "我是无辜的，会客观分析证据"}
+{self._build_conversation_context(voter, conversation_history)}"""
+        return "\n".join(line for line in section.strip().splitlines() if line.strip())
+
+    def _parse_batched_votes(self, response: str, voters: List[Character]) -> Dict[str, str]:
+        """解析批量投票结果，返回 投票者姓名 -> 投票文本（"投票：...\n理由：..."格式）"""
+        voter_names = {voter.name for voter in voters}
+        vote_texts = {}
+        
+        # 优先按JSON数组解析
+        start, end = response.find('['), response.rfind(']')
+        if start >= 0 and end > start:
+            try:
+                for item in json.loads(response[start:end + 1]):
+                    name = str(item.get("voter", "")).strip()
+                    if name in voter_names and name not in vote_texts:
+                        vote_texts[name] = f"投票：{item.get('vote', '')}\n理由：{item.get('reason', '')}"
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"批量投票JSON解析失败，尝试按行解析: {e}")
+        
+        # 备用：按"投票人：X｜投票：Y｜理由：Z"逐行解析
+        if not vote_texts:
+            for line in response.splitlines():
+                if "投票人：" not in line or "投票：" not in line:
+                    continue
+                name = line.split("投票人：", 1)[1].split("｜", 1)[0].strip()
+                if name in voter_names and name not in vote_texts:
+                    vote_texts[name] = line.split("｜", 1)[1].replace("｜", "\n").strip()
+        
+        return vote_texts
+
+    async def generate_batched_votes(self,
+                                     voters: List[Character],
+                                     accusation: 'Accusation',
+                                     case: Case,
+                                     conversation_history: Dict[str, List[Dict]] = None) -> Dict[str, str]:
+        """批量投票：共享的审判信息只发送一次，一次调用得到所有陪审员的投票
+        
+        返回 投票者姓名 -> 投票文本，可直接交给 add_vote_to_accusation 解析计票。
+        解析失败或遗漏的投票者使用默认投票。
+        """
+        testimonies_context = ""
+        for witness, testimony in accusation.witness_testimonies:
+            testimonies_context += f"{witness.name}的证词：{testimony}\n\n"
+        
+        juror_sections = "\n\n".join(self._build_juror_section(voter, case, conversation_history) for voter in voters)
+        voter_names = "、".join(voter.name for voter in voters)
+        
+        prompt = f"""你需要同时扮演陪审团中的每一位成员，分别对侦探的指控进行投票。每位陪审员只能依据自己知道的信息和公开的审判内容，独立做出符合自己性格和立场的判断。
+
+【案件情况】
+{case.description}
+受害者是{case.victim_name}，案发时间{case.time_of_crime}，地点在{case.crime_scene}。
+
+{self._build_basic_evidence_info(case)}【指控情况】
+侦探指控：{accusation.accused.name}是凶手
+指控理由：{accusation.accuser_reasoning}
+
+【被告辩护】
+{accusation.accused.name}的辩护：{accusation.accused_defense}
+
+【证据分析】
+{self._analyze_contradictions(accusation.accused, conversation_history)}
+
+【证人证词】
+{testimonies_context}
+【陪审员信息】
+{juror_sections}
+
+【投票要求】
+1. 每位陪审员投票：支持 或 反对
+2. 真凶应该支持对{accusation.accused.name}的指控以转移注意力；无辜者综合分析时间线、证词一致性、动机和物理证据
+3. 理由1-2句话，说明具体的矛盾点或证据，符合该陪审员的性格
+
+请只输出一个JSON数组，按顺序包含{voter_names}的投票，不要输出其他内容：
+[{{"voter": "姓名", "vote": "支持或反对", "reason": "理由"}}]"""
+
+        vote_texts = {}
+        try:
+            logger.info(f"生成批量投票 - 陪审员: {voter_names}, 提示长度: {len(prompt)}")
+            response = await self.ai_service.get_simple_response(prompt, call_site="batched_vote")
+            vote_texts = self._parse_batched_votes(response, voters)
+        except Exception as e:
+            logger.error(f"生成批量投票时出错 - 被告: {accusation.accused.name}, 错误: {str(e)}", exc_info=True)
+        
+        # 缺失的投票使用默认投票补齐
+        for voter in voters:
+            if voter.name not in vote_texts:
+                logger.warning(f"批量投票缺少投票者 {voter.name} 的结果，使用默认投票")
+                vote_texts[voter.name] = "".join([chunk async for chunk in self._generate_error_vote(voter, accusation)])
+        
+        return vote_texts
+
     def generate_accusation_result(self, accusation: 'Accusation') -> tuple:
         """完成指控的最终判决"""
         # 计算最终判决：需要过半数支持票才算定罪成功
@@ -407,17 +562,8 @@ class AccusationSystem:
                 return
             
             prefix = f"🎉 恭喜！侦探成功破案！\n\n【案件真相】\n"
-            full_solution = prefix + case.solution
-            
-            try:
-                import asyncio
-                for char in full_solution:
-                    yield char
-                    await asyncio.sleep(0.02)  # 控制输出速度，营造打字机效果
-            except Exception as e:
-                logger.error(f"输出案件真相时出错 - 案件: {case.title}, 错误: {str(e)}", exc_info=True)
-                # 如果流式输出失败，直接输出完整内容
-                yield full_solution
+            # 打字机效果由路由层的节奏控制器负责，这里直接输出完整内容
+            yield prefix + case.solution
         else:
             # 指控错误，不显示真相，只给出失败信息
             failure_message = f"""❌ 很遗憾，侦探指控错误。{accused.name}并不是真凶。
@@ -432,12 +578,4 @@ class AccusationSystem:
 推理之路从不平坦，
 每一次失败都是通往真相的垫脚石。"""
             
-            try:
-                import asyncio
-                for char in failure_message:
-                    yield char
-                    await asyncio.sleep(0.02)  # 控制输出速度，营造打字机效果
-            except Exception as e:
-                logger.error(f"输出失败信息时出错 - 案件: {case.title}, 错误: {str(e)}", exc_info=True)
-                # 如果流式输出失败，直接输出完整内容
-                yield failure_message
+            yield failure_message
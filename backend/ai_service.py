@@ -1,96 +1,506 @@
 import openai
+import httpx
 import logging
-from typing import Dict, List, AsyncGenerator
-from .config import GameConfig
 import asyncio
+import random
+from typing import Awaitable, Callable, Dict, List, AsyncGenerator, Optional, Tuple
+from .config import GameConfig
+from .llm_admission import LLMAdmissionController, llm_admission
+from .streaming import StreamBroadcast
+from .response_cache import ResponseCache, response_cache
+from .llm_endpoints import EndpointPool, LLMEndpoint, RetryBudget
+from .llm_errors import AIServiceUnavailable, CircuitOpenError
+from .llm_routing import LLMRoute, LLMRouter, llm_router
+from .llm_metrics import LLMCallTimer, LLMMetrics, llm_metrics
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 上游调用失败时返回的兜底回应，不写入缓存
+FALLBACK_RESPONSE = "抱歉，我现在无法回应..."
+SUGGESTION_FALLBACK_RESPONSE = "抱歉，我现在无法生成建议问题..."
+
+def _is_fallback(response: str) -> bool:
+    """回应是否以本地备用内容结尾（包括流式调用输出部分文本后出错、补发备用内容的情况）"""
+    return response.endswith(FALLBACK_RESPONSE) or response.endswith(SUGGESTION_FALLBACK_RESPONSE)
+
+# 可以重试的连接类错误
+RETRYABLE_ERRORS = (openai.APIConnectionError, httpx.TransportError)
+
+def _is_endpoint_failure(error: BaseException) -> bool:
+    """是否属于端点本身的故障（连接、超时、限流、5xx），只有这类错误计入熔断和健康评分
+    
+    请求本身有误的4xx（参数错误、鉴权失败、模型不存在等）换端点也无济于事，直接交给调用方处理。
+    """
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
 class AIService:
     """AI服务类，负责与大模型交互"""
     
-    def __init__(self):
+    def __init__(self, admission: Optional[LLMAdmissionController] = None,
+                 cache: Optional[ResponseCache] = None, router: Optional[LLMRouter] = None,
+                 metrics: Optional[LLMMetrics] = None):
         """初始化AI服务"""
         GameConfig.validate_config()
-        self.client = openai.OpenAI(
-            api_key=GameConfig.API_KEY,
-            base_url=GameConfig.BASE_URL
+        # 所有调用都先经过准入控制，按调用点的优先级排队
+        self.admission = admission or llm_admission
+        # 非流式调用的回应缓存，按调用点开启
+        self.cache = cache or response_cache
+        # 按调用点选择模型、温度、最大token数和停止序列
+        self.router = router or llm_router
+        # 每次上游调用的排队等待、首字延迟、总耗时和生成速度
+        self.metrics = metrics or llm_metrics
+        # 使用有界的异步连接池，所有请求复用同一组连接，不阻塞事件循环
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=GameConfig.AI_MAX_CONNECTIONS,
+                max_keepalive_connections=GameConfig.AI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GameConfig.AI_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(GameConfig.AI_REQUEST_TIMEOUT, connect=GameConfig.AI_CONNECT_TIMEOUT)
         )
+        # 上游端点池：所有端点共享同一个HTTP连接池
+        self.endpoints = EndpointPool.from_config(self.http_client)
+        # 连接类错误的重试受全局重试预算约束，避免故障期间重试放大流量
+        self.retry_budget = RetryBudget(GameConfig.AI_RETRY_BUDGET_RATIO, GameConfig.AI_RETRY_BUDGET_MAX)
+        # 进行中的相同请求合并为一次上游调用：非流式共享结果，流式共享同一个上游流
+        self._inflight_calls: Dict[Tuple, "_InflightCall"] = {}
+        self._inflight_streams: Dict[Tuple, StreamBroadcast] = {}
+        self.coalesced_requests = 0
+        # 调用方离开后被取消的上游流式调用数，以及这些调用已生成的token数（按片段数估算）
+        self.cancelled_calls = 0
+        self.cancelled_tokens = 0
+        # 对冲请求统计：发出的对冲次数，以及对冲请求先出字的次数
+        self.hedged_requests = 0
+        self.hedge_wins = 0
     
-    async def get_simple_response(self, prompt: str) -> str:
-        """获取简单的AI回应（非流式）"""
+    async def _coalesce(self, key: Tuple, request: Callable[[], Awaitable[str]]) -> str:
+        """合并进行中的相同非流式请求，所有调用方等待同一个上游调用的结果"""
+        if not GameConfig.AI_SINGLEFLIGHT:
+            return await request()
+        
+        inflight = self._inflight_calls.get(key)
+        if inflight is None:
+            inflight = _InflightCall(asyncio.create_task(request()))
+            self._inflight_calls[key] = inflight
+            inflight.task.add_done_callback(lambda _: self._forget(self._inflight_calls, key, inflight))
+        else:
+            self.coalesced_requests += 1
+        
+        inflight.waiters += 1
         try:
-            response = self.client.chat.completions.create(
-                model=GameConfig.MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=GameConfig.NARRATOR_TEMPERATURE,
-                max_tokens=500
-            )
-            
-            return response.choices[0].message.content.strip()
+            # shield保证某个调用方被取消时，不影响其他等待同一结果的调用方
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                inflight.task.cancel()
+    
+    async def _cached(self, call_site: str, key_parts: Tuple, request: Callable[[], Awaitable[str]]) -> str:
+        """对开启缓存的调用点先查缓存，未命中时调用上游并缓存成功的回应"""
+        if not self.cache.enabled_for(call_site):
+            return await request()
+        
+        key = self.cache.make_key(*key_parts)
+        cached = await self.cache.get(key, call_site)
+        if cached is not None:
+            return cached
+        
+        response = await request()
+        if response and not _is_fallback(response):
+            await self.cache.set(key, response)
+        return response
+    
+    @staticmethod
+    def _forget(inflight: Dict, key: Tuple, entry):
+        """请求结束后移除登记，之后的相同请求会重新调用上游"""
+        if inflight.get(key) is entry:
+            del inflight[key]
+    
+    async def aclose(self):
+        """关闭底层HTTP连接池"""
+        await self.endpoints.aclose()
+        await self.http_client.aclose()
+    
+    async def _with_retries(self, operation: Callable[[], Awaitable]):
+        """对连接类错误进行带随机抖动的指数退避重试，重试次数受重试预算约束"""
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await operation()
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > GameConfig.AI_RETRY_MAX_ATTEMPTS or not self.retry_budget.try_acquire():
+                    raise
+                delay = random.uniform(0, min(GameConfig.AI_RETRY_MAX_DELAY, GameConfig.AI_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                logger.warning(f"上游连接错误，{delay:.2f}秒后第{attempt}次重试 - 错误: {str(e)}")
+                await asyncio.sleep(delay)
+    
+    async def _create_completion(self, prompt: str, route: LLMRoute, timer: Optional[LLMCallTimer] = None) -> str:
+        """发起非流式调用，端点失败时自动转移到其他端点"""
+        tried: List[LLMEndpoint] = []
+        last_error: Optional[Exception] = None
+        while True:
+            endpoint = self.endpoints.pick(exclude=tried)
+            if endpoint is None:
+                if last_error is None:
+                    raise CircuitOpenError("所有上游端点均处于熔断状态")
+                raise last_error
+            tried.append(endpoint)
+            try:
+                response = await endpoint.client.chat.completions.create(
+                    model=endpoint.resolve_model(route.model),
+                    messages=[{"role": "user", "content": prompt}],
+                    **route.request_params()
+                )
+                endpoint.record_success()
+                content = response.choices[0].message.content.strip()
+                if timer is not None:
+                    # 非流式调用的首字即完整回应；上游未返回用量时按字符数估算token数
+                    usage = getattr(response, "usage", None)
+                    timer.model = endpoint.resolve_model(route.model)
+                    timer.first_token()
+                    timer.add_tokens(getattr(usage, "completion_tokens", None) or len(content))
+                return content
+            except Exception as e:
+                if not _is_endpoint_failure(e):
+                    raise
+                endpoint.record_failure()
+                last_error = e
+                logger.warning(f"上游端点调用失败，尝试转移到其他端点 - 端点: {endpoint.name}, 错误: {str(e)}")
+    
+    async def _start_stream(self, endpoint: LLMEndpoint, prompt: str, route: LLMRoute) -> "_StreamHandle":
+        """在指定端点发起流式调用，收到首个有内容的片段后返回"""
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        response = await endpoint.client.chat.completions.create(
+            model=endpoint.resolve_model(route.model),
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            **route.request_params()
+        )
+        chunks = _iter_content(response)
+        try:
+            first_text = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_text = ""
+        except BaseException:
+            await response.close()
+            raise
+        endpoint.record_success(ttft=loop.time() - started_at)
+        return _StreamHandle(endpoint, response, chunks, first_text)
+    
+    async def _open_stream(self, prompt: str, route: LLMRoute) -> "_StreamHandle":
+        """打开一个上游流
+        
+        首字超过对冲阈值仍未到达时，向另一个端点发出相同请求，取先出字的一方并取消另一方；
+        端点出错时自动转移到其他端点。
+        """
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        tried: List[LLMEndpoint] = []
+        pending: Dict[asyncio.Task, LLMEndpoint] = {}
+        hedge_delay = GameConfig.AI_HEDGE_TTFT_SECONDS
+        hedged = False
+        last_error: Optional[BaseException] = None
+        
+        def launch() -> bool:
+            endpoint = self.endpoints.pick(exclude=tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            task = asyncio.create_task(self._start_stream(endpoint, prompt, route))
+            pending[task] = endpoint
+            return True
+        
+        if not launch():
+            raise CircuitOpenError("所有上游端点均处于熔断状态")
+        try:
+            while pending:
+                can_hedge = not hedged and hedge_delay > 0 and len(tried) < len(self.endpoints)
+                done, _ = await asyncio.wait(
+                    pending.keys(), timeout=hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    self.hedged_requests += 1
+                    logger.info(f"首字超过{hedge_delay}秒未到达，发出对冲请求 - 端点: {pending[next(iter(pending))].name}")
+                    launch()
+                    continue
+                
+                winner: Optional[_StreamHandle] = None
+                for task in done:
+                    endpoint = pending.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        if not _is_endpoint_failure(error):
+                            raise error
+                        endpoint.record_failure()
+                        last_error = error
+                        logger.warning(f"上游端点流式调用失败 - 端点: {endpoint.name}, 错误: {str(error)}")
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await task.result().response.close()
+                if winner is not None:
+                    if winner.endpoint is not tried[0]:
+                        self.hedge_wins += 1
+                    # 落后的端点至少慢了这么久，计入其健康评分
+                    for endpoint in pending.values():
+                        endpoint.record_ttft(loop.time() - started_at)
+                    return winner
+                
+                # 所有进行中的请求都失败时转移到下一个端点
+                if not pending and not launch():
+                    break
+            raise last_error
+        finally:
+            # 取消落后的一方并关闭它已经打开的上游流
+            for task in pending:
+                task.cancel()
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, _StreamHandle):
+                    await result.response.close()
+    
+    async def get_simple_response(self, prompt: str, call_site: str = "default") -> str:
+        """获取简单的AI回应（非流式）
+        
+        未获准入或所有上游端点熔断时立即抛出AIServiceUnavailable，由调用方使用本地备用内容。
+        """
+        route = self.router.resolve(call_site, LLMRoute("main", GameConfig.NARRATOR_TEMPERATURE, 500))
+        key = ("simple",) + route.cache_key() + (prompt,)
+        return await self._cached(
+            call_site, route.cache_key() + (prompt,),
+            lambda: self._coalesce(key, lambda: self._request_simple_response(prompt, call_site, route))
+        )
+    
+    async def _request_simple_response(self, prompt: str, call_site: str, route: LLMRoute) -> str:
+        """向上游发起一次非流式调用"""
+        timer = self.metrics.start(call_site, route.model_name())
+        try:
+            async with self.admission.slot(call_site):
+                timer.admitted()
+                response = await self._with_retries(lambda: self._create_completion(prompt, route, timer))
+                timer.finish()
+                return response
+        except AIServiceUnavailable:
+            timer.finish("rejected")
+            raise
         except Exception as e:
+            timer.finish("error")
             logger.error(f"AI简单回应服务错误 - 提示长度: {len(prompt)}, 错误: {str(e)}", exc_info=True)
             if GameConfig.DEBUG_MODE:
                 print(f"AI服务错误: {e}")
-            return "抱歉，我现在无法回应..."
+            return FALLBACK_RESPONSE
+        finally:
+            # 调用方离开时任务被取消
+            timer.finish("cancelled")
+    
+    async def get_stream_response(self, prompt: str, call_site: str = "default") -> AsyncGenerator[str, None]:
+        """获取流式AI回应
+        
+        相同提示词的流式请求同时进行时共享同一个上游流，后加入的调用方会先收到已生成的部分。
+        """
+        route = self._stream_route(call_site)
+        if not GameConfig.AI_SINGLEFLIGHT:
+            async for chunk in self._request_stream_response(prompt, call_site, route):
+                yield chunk
+            return
+        
+        key = ("stream",) + route.cache_key() + (prompt,)
+        broadcast = self._inflight_streams.get(key)
+        if broadcast is None or broadcast.cancelled:
+            broadcast = StreamBroadcast(
+                self._request_stream_response(prompt, call_site, route),
+                on_done=lambda: self._forget(self._inflight_streams, key, broadcast)
+            )
+            self._inflight_streams[key] = broadcast
+        else:
+            self.coalesced_requests += 1
+        
+        async for chunk in broadcast.subscribe():
+            yield chunk
+    
+    def _stream_route(self, call_site: str) -> LLMRoute:
+        """流式调用的路由，未登记的调用点使用角色对话的默认参数"""
+        return self.router.resolve(call_site, LLMRoute("main", GameConfig.CHARACTER_TEMPERATURE, 500))
     
-    async def get_stream_response(self, prompt: str) -> AsyncGenerator[str, None]:
-        """获取流式AI回应"""
+    async def _request_stream_response(self, prompt: str, call_site: str, route: LLMRoute) -> AsyncGenerator[str, None]:
+        """向上游发起一次流式调用（整个流输出期间占用一个准入名额）
+        
+        调用方中途离开（客户端断开、任务被取消）时立即关闭上游连接，停止继续生成。
+        """
+        handle = None
+        received_chunks = 0
+        finished = False
+        timer = self.metrics.start(call_site, route.model_name(), streamed=True)
         try:
-            # 使用同步客户端但在异步上下文中运行
-            def _create_stream():
-                return self.client.chat.completions.create(
-                    model=GameConfig.MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=GameConfig.CHARACTER_TEMPERATURE,
-                    max_tokens=500,
-                    stream=True
-                )
-            
-            # 在线程池中运行同步调用
-            response = await asyncio.get_event_loop().run_in_executor(None, _create_stream)
-            
-            for chunk in response:
-                if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    yield content
-                    # 添加小延迟以确保流式效果
-                    await asyncio.sleep(0.02)
-                    
+            async with self.admission.slot(call_site):
+                timer.admitted()
+                handle = await self._with_retries(lambda: self._open_stream(prompt, route))
+                timer.model = handle.endpoint.resolve_model(route.model)
+                timer.first_token()
+                
+                if handle.first_text:
+                    received_chunks += 1
+                    yield handle.first_text
+                async for text in handle.chunks:
+                    received_chunks += 1
+                    yield text
+                finished = True
+                timer.add_tokens(received_chunks)
+                timer.finish()
+        
+        except AIServiceUnavailable:
+            timer.finish("rejected")
+            raise
         except Exception as e:
+            finished = True
+            timer.finish("error")
+            if handle is not None and _is_endpoint_failure(e):
+                # 已开始输出后中断的流同样计入端点的失败
+                handle.endpoint.record_failure()
             logger.error(f"AI流式回应服务错误 - 提示长度: {len(prompt)}, 错误: {str(e)}", exc_info=True)
             if GameConfig.DEBUG_MODE:
                 print(f"AI流式服务错误: {e}")
-            yield "抱歉，我现在无法回应..."
+            yield FALLBACK_RESPONSE
+        finally:
+            timer.finish("cancelled")
+            if handle is not None and not finished:
+                # 每个流式片段约等于一个token，用于统计被取消调用已消耗的token
+                self.cancelled_calls += 1
+                self.cancelled_tokens += received_chunks
+                logger.info(f"上游流式调用已取消 - 调用点: {call_site}, 已接收片段: {received_chunks}")
+                try:
+                    await handle.response.close()
+                except Exception:
+                    pass
+    
+    def get_stats(self) -> Dict:
+        """获取调用统计和各组件的运行状态"""
+        return {
+            "calls": self.metrics.get_stats(),
+            "admission": self.admission.get_stats(),
+            "cache": self.cache.get_stats(),
+            "endpoints": self.endpoints.get_stats(),
+            "retry_budget": self.retry_budget.get_stats(),
+            "routes": self.router.get_routes(),
+            "coalesced_requests": self.coalesced_requests,
+            "cancelled_calls": self.cancelled_calls,
+            "cancelled_tokens": self.cancelled_tokens,
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins
+        }
     
-    async def get_fast_response(self, prompt: str) -> str:
+    async def get_fast_response(self, prompt: str, call_site: str = "default") -> str:
         """获取快速回应（使用流式但返回完整结果）"""
+        return await self._cached(
+            call_site, self._stream_route(call_site).cache_key() + (prompt,),
+            lambda: self._collect_stream_response(prompt, call_site)
+        )
+    
+    async def _collect_stream_response(self, prompt: str, call_site: str) -> str:
+        """消费流式回应并拼接为完整结果"""
         try:
             full_response = ""
-            async for chunk in self.get_stream_response(prompt):
+            async for chunk in self.get_stream_response(prompt, call_site=call_site):
                 full_response += chunk
             return full_response.strip()
+        except AIServiceUnavailable:
+            raise
         except Exception as e:
             logger.error(f"AI快速回应服务错误 - 提示长度: {len(prompt)}, 错误: {str(e)}", exc_info=True)
             if GameConfig.DEBUG_MODE:
                 print(f"AI快速服务错误: {e}")
-            return "抱歉，我现在无法回应..."
+            return FALLBACK_RESPONSE
     
-    async def get_suggestion_response(self, prompt: str) -> str:
+    async def get_suggestion_response(self, prompt: str, call_site: str = "suggestion") -> str:
         """获取建议问题生成回应（使用专门的建议模型）"""
+        # 建议问题默认使用较低的温度以保证质量
+        route = self.router.resolve(call_site, LLMRoute("suggestion", 0.7, 300))
+        key = ("suggestion",) + route.cache_key() + (prompt,)
+        return await self._cached(
+            call_site, route.cache_key() + (prompt,),
+            lambda: self._coalesce(key, lambda: self._request_suggestion_response(prompt, call_site, route))
+        )
+    
+    async def _request_suggestion_response(self, prompt: str, call_site: str, route: LLMRoute) -> str:
+        """向上游发起一次建议问题生成调用"""
+        timer = self.metrics.start(call_site, route.model_name())
         try:
-            response = self.client.chat.completions.create(
-                model=GameConfig.SUGGESTION_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,  # 建议问题使用较低的温度以保证质量
-                max_tokens=300
-            )
-            
-            return response.choices[0].message.content.strip()
+            async with self.admission.slot(call_site):
+                timer.admitted()
+                response = await self._with_retries(lambda: self._create_completion(prompt, route, timer))
+                timer.finish()
+                return response
+        except AIServiceUnavailable:
+            timer.finish("rejected")
+            raise
         except Exception as e:
+            timer.finish("error")
             logger.error(f"AI建议问题生成服务错误 - 提示长度: {len(prompt)}, 错误: {str(e)}", exc_info=True)
             if GameConfig.DEBUG_MODE:
                 print(f"AI建议问题生成服务错误: {e}")
-            return "抱歉，我现在无法生成建议问题..."
\ No newline at end of file
+            return SUGGESTION_FALLBACK_RESPONSE
+        finally:
+            timer.finish("cancelled")
+
+async def _iter_content(response) -> AsyncGenerator[str, None]:
+    """从上游流中提取有内容的文本片段"""
+    async for chunk in response:
+        if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+class _StreamHandle:
+    """已收到首字的上游流"""
+    
+    def __init__(self, endpoint: LLMEndpoint, response, chunks: AsyncGenerator[str, None], first_text: str):
+        self.endpoint = endpoint
+        self.response = response
+        self.chunks = chunks
+        self.first_text = first_text
+
+class _InflightCall:
+    """一次进行中的非流式上游调用及等待它的调用方数量"""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class AIClientRegistry:
+    """进程级AI客户端注册表
+    
+    整个进程共享一个AIService（以及其HTTP连接池和TLS会话），
+    由应用生命周期统一创建和关闭，避免每个游戏会话各自建立连接池。
+    """
+    
+    def __init__(self):
+        self._service: Optional[AIService] = None
+    
+    def get_service(self) -> AIService:
+        """获取共享的AIService，首次调用时创建"""
+        if self._service is None:
+            self._service = AIService()
+            logger.info("共享AI服务已创建")
+        return self._service
+    
+    async def aclose(self):
+        """关闭共享的AIService及其连接池"""
+        if self._service is not None:
+            service, self._service = self._service, None
+            await service.aclose()
+            logger.info("共享AI服务已关闭")
+
+# 创建全局AI客户端注册表
+ai_client_registry = AIClientRegistry()
+
+def get_ai_service() -> AIService:
+    """获取共享的AI服务（可用于FastAPI依赖注入）"""
+    return ai_client_registry.get_service()
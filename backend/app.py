@@ -4,6 +4,7 @@ import logging
 from datetime import datetime
 from pathlib import Path
 import re
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
@@ -53,7 +54,7 @@ uvicorn_access_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 导入路由模块
-from backend.routes.game import game_router, cases_router
+from backend.routes.game import game_router, cases_router, get_game_sessions
 from backend.routes.history import history_router
 from backend.routes.admin import admin_router, admin_pages_router
 from backend.routes.common import common_router
@@ -61,8 +62,18 @@ from backend.routes.websocket import ws_router
 
 # 导入必要的模块用于版本和异常处理
 from backend.version import get_version, get_js_version
+from backend.ai_service import ai_client_registry
 
-app = FastAPI(title="侦探推理游戏API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理：启动游戏会话的后台清理任务，退出时停止清理并释放共享的AI连接池"""
+    game_sessions = get_game_sessions()
+    game_sessions.start_sweeper()
+    yield
+    await game_sessions.stop_sweeper()
+    await ai_client_registry.aclose()
+
+app = FastAPI(title="侦探推理游戏API", version="1.0.0", lifespan=lifespan)
 
 # 配置CORS
 app.add_middleware(
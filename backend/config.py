@@ -19,6 +19,18 @@ def _load_config_from_template():
     
     return defaults
 
+def _parse_mapping(value: str) -> dict:
+    """解析"键:数值,键:数值"格式的配置项"""
+    mapping = {}
+    for item in (value or "").split(','):
+        if ':' in item:
+            key, number = item.split(':', 1)
+            try:
+                mapping[key.strip()] = float(number.strip())
+            except ValueError:
+                continue
+    return mapping
+
 # 加载环境变量
 load_dotenv()
 
@@ -36,6 +48,97 @@ class GameConfig:
     # 建议问题生成模型配置（可选择更快的模型）
     SUGGESTION_MODEL = os.getenv("SUGGESTION_MODEL") or template_defaults.get("SUGGESTION_MODEL", MODEL)
     
+    # 快速模型配置（证据揭露判断、证据取舍、投票等分类式调用使用，默认与建议问题模型相同）
+    FAST_MODEL = os.getenv("FAST_MODEL") or template_defaults.get("FAST_MODEL", SUGGESTION_MODEL)
+    
+    # 调用点路由覆盖（JSON对象，按调用点覆盖 model/temperature/max_tokens/stop，model可写 main/fast/suggestion 或具体模型名）
+    # 例：{"evidence_reveal": {"model": "fast", "max_tokens": 20}, "vote": {"model": "main"}}
+    AI_ROUTES = os.getenv("AI_ROUTES") or template_defaults.get("AI_ROUTES", "")
+    
+    # AI连接池配置 - 单个进程内所有大模型请求共享的异步HTTP连接池
+    AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS") or template_defaults.get("AI_MAX_CONNECTIONS", "200"))
+    AI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS") or template_defaults.get("AI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+    AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY") or template_defaults.get("AI_KEEPALIVE_EXPIRY", "30"))
+    AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT") or template_defaults.get("AI_REQUEST_TIMEOUT", "60"))
+    AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT") or template_defaults.get("AI_CONNECT_TIMEOUT", "10"))
+    
+    # 多上游端点配置（JSON数组，留空则只使用上面的 BASE_URL/MODEL）
+    # 例：[{"name": "main", "base_url": "...", "api_key": "...", "model": "...", "suggestion_model": "...", "fast_model": "...", "weight": 3}]
+    AI_ENDPOINTS = os.getenv("AI_ENDPOINTS") or template_defaults.get("AI_ENDPOINTS", "")
+    # 对冲请求：流式调用超过该秒数仍未收到首字时，向另一个端点发出相同请求，取先出字的一方（0表示关闭）
+    AI_HEDGE_TTFT_SECONDS = float(os.getenv("AI_HEDGE_TTFT_SECONDS") or template_defaults.get("AI_HEDGE_TTFT_SECONDS", "4"))
+    # 端点熔断：连续失败次数阈值，以及熔断后多少秒放行一次探测请求
+    AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AI_CIRCUIT_FAILURE_THRESHOLD") or template_defaults.get("AI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    AI_CIRCUIT_RESET_SECONDS = float(os.getenv("AI_CIRCUIT_RESET_SECONDS") or template_defaults.get("AI_CIRCUIT_RESET_SECONDS", "30"))
+    # 连接类错误的重试：最多重试次数、退避基准和上限秒数（全抖动），以及重试预算（每个请求存入的令牌数和余额上限）
+    AI_RETRY_MAX_ATTEMPTS = int(os.getenv("AI_RETRY_MAX_ATTEMPTS") or template_defaults.get("AI_RETRY_MAX_ATTEMPTS", "2"))
+    AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY") or template_defaults.get("AI_RETRY_BASE_DELAY", "0.2"))
+    AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY") or template_defaults.get("AI_RETRY_MAX_DELAY", "2"))
+    AI_RETRY_BUDGET_RATIO = float(os.getenv("AI_RETRY_BUDGET_RATIO") or template_defaults.get("AI_RETRY_BUDGET_RATIO", "0.1"))
+    AI_RETRY_BUDGET_MAX = float(os.getenv("AI_RETRY_BUDGET_MAX") or template_defaults.get("AI_RETRY_BUDGET_MAX", "10"))
+    
+    # 大模型调用准入控制 - 按优先级分级排队：interactive（角色回答、辩护）> trial（证词、投票）> background（提示、推荐问题）
+    AI_ADMISSION_MAX_CONCURRENCY = int(os.getenv("AI_ADMISSION_MAX_CONCURRENCY") or template_defaults.get("AI_ADMISSION_MAX_CONCURRENCY", "100"))
+    # 各优先级同时进行的调用上限
+    AI_ADMISSION_CLASS_LIMITS = _parse_mapping(os.getenv("AI_ADMISSION_CLASS_LIMITS") or template_defaults.get(
+        "AI_ADMISSION_CLASS_LIMITS", "interactive:100,trial:60,background:10"))
+    # 各优先级排队长度上限，队列满时直接拒绝
+    AI_ADMISSION_QUEUE_SIZES = _parse_mapping(os.getenv("AI_ADMISSION_QUEUE_SIZES") or template_defaults.get(
+        "AI_ADMISSION_QUEUE_SIZES", "interactive:500,trial:300,background:20"))
+    # 排队等待的最长秒数，超时视为拒绝
+    AI_ADMISSION_QUEUE_TIMEOUT = float(os.getenv("AI_ADMISSION_QUEUE_TIMEOUT") or template_defaults.get("AI_ADMISSION_QUEUE_TIMEOUT", "30"))
+    
+    # 合并进行中的相同大模型请求（相同提示词只调用一次上游，结果或流分发给所有调用方）
+    AI_SINGLEFLIGHT = (os.getenv("AI_SINGLEFLIGHT") or template_defaults.get("AI_SINGLEFLIGHT", "true")).lower() == "true"
+    
+    # 大模型回应缓存（仅非流式调用）：开启缓存的调用点、内存条目上限、过期秒数、SQLite磁盘层路径（留空则不启用磁盘层）
+    AI_RESPONSE_CACHE_CALL_SITES = [site.strip() for site in (os.getenv("AI_RESPONSE_CACHE_CALL_SITES") or template_defaults.get(
+        "AI_RESPONSE_CACHE_CALL_SITES", "suggestion")).split(',') if site.strip()]
+    AI_RESPONSE_CACHE_SIZE = int(os.getenv("AI_RESPONSE_CACHE_SIZE") or template_defaults.get("AI_RESPONSE_CACHE_SIZE", "2000"))
+    AI_RESPONSE_CACHE_TTL = float(os.getenv("AI_RESPONSE_CACHE_TTL") or template_defaults.get("AI_RESPONSE_CACHE_TTL", "86400"))
+    AI_RESPONSE_CACHE_DB_PATH = os.getenv("AI_RESPONSE_CACHE_DB_PATH") or template_defaults.get("AI_RESPONSE_CACHE_DB_PATH", "")
+    
+    # 流式输出节奏配置
+    # off：不控制节奏（生产推荐）；server：服务端按速率输出
+    STREAM_PACING_MODE = (os.getenv("STREAM_PACING_MODE") or template_defaults.get("STREAM_PACING_MODE", "off")).lower()
+    # 各事件类型每秒输出的字符数
+    STREAM_PACING_RATES = _parse_mapping(os.getenv("STREAM_PACING_RATES") or template_defaults.get(
+        "STREAM_PACING_RATES", "chunk:40,defense_chunk:40,testimony_chunk:40,vote_chunk:40,solution_chunk:40"))
+    # 审判关键节点的停顿秒数
+    STREAM_PACING_PAUSES = _parse_mapping(os.getenv("STREAM_PACING_PAUSES") or template_defaults.get(
+        "STREAM_PACING_PAUSES", "vote_summary:1,verdict:1,correctness:1"))
+    # 流式片段合并：按接口配置时间窗口（毫秒）和字节上限，把细碎的上游片段合并成较少的SSE帧（0表示不合并），首帧总是立即发送
+    STREAM_COALESCE_WINDOW_MS = _parse_mapping(os.getenv("STREAM_COALESCE_WINDOW_MS") or template_defaults.get(
+        "STREAM_COALESCE_WINDOW_MS", "question:50,accusation:80"))
+    STREAM_COALESCE_MAX_BYTES = _parse_mapping(os.getenv("STREAM_COALESCE_MAX_BYTES") or template_defaults.get(
+        "STREAM_COALESCE_MAX_BYTES", "question:256,accusation:512"))
+    
+    # 证据处理决策缓存配置：是否在同一案件的不同会话之间复用，以及共享缓存的最大条目数
+    EVIDENCE_CONTEXT_SHARED_CACHE = (os.getenv("EVIDENCE_CONTEXT_SHARED_CACHE") or template_defaults.get("EVIDENCE_CONTEXT_SHARED_CACHE", "true")).lower() == "true"
+    EVIDENCE_CONTEXT_CACHE_SIZE = int(os.getenv("EVIDENCE_CONTEXT_CACHE_SIZE") or template_defaults.get("EVIDENCE_CONTEXT_CACHE_SIZE", "1000"))
+    
+    # 游戏会话存储配置：空闲过期时间（秒）、会话数上限和估算内存上限（字节，0表示不限制）、后台清理间隔（秒）
+    SESSION_TTL = float(os.getenv("SESSION_TTL") or template_defaults.get("SESSION_TTL", "1800"))
+    SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT") or template_defaults.get("SESSION_MAX_COUNT", "2000"))
+    SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES") or template_defaults.get("SESSION_MAX_BYTES", "0"))
+    SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL") or template_defaults.get("SESSION_SWEEP_INTERVAL", "60"))
+    # 会话状态存储后端：memory（进程内，只能单worker运行）/ database（保存在数据库中，多个worker共享）
+    SESSION_BACKEND = (os.getenv("SESSION_BACKEND") or template_defaults.get("SESSION_BACKEND", "memory")).lower()
+    
+    # 角色回答模式
+    # classic：证据取舍、角色回答、证据揭露分别调用模型；single_call：一次调用完成全部，回答末尾附带揭露尾注
+    ANSWER_MODE = (os.getenv("ANSWER_MODE") or template_defaults.get("ANSWER_MODE", "classic")).lower()
+    
+    # 审判流程配置
+    # 证人证词全部并发生成；ordered：按顺序逐个展示（后面的先缓冲），interleaved：交错展示
+    TRIAL_TESTIMONY_MODE = (os.getenv("TRIAL_TESTIMONY_MODE") or template_defaults.get("TRIAL_TESTIMONY_MODE", "ordered")).lower()
+    # 陪审团投票模式：per_voter（每人单独调用模型）/ batched（一次调用返回所有人的投票）
+    # batched 模式中每位陪审员的证据直接以精简列表提供，不再逐人调用模型分析证据，判断依据略少于 per_voter
+    JURY_MODE = (os.getenv("JURY_MODE") or template_defaults.get("JURY_MODE", "per_voter")).lower()
+    # 陪审团投票并发上限：单场审判内同时投票的人数，以及整个进程同时进行的投票数
+    VOTE_CONCURRENCY = int(os.getenv("VOTE_CONCURRENCY") or template_defaults.get("VOTE_CONCURRENCY", "5"))
+    VOTE_GLOBAL_CONCURRENCY = int(os.getenv("VOTE_GLOBAL_CONCURRENCY") or template_defaults.get("VOTE_GLOBAL_CONCURRENCY", "50"))
+    
     # 游戏设置
     GAME_LANGUAGE = os.getenv("LANGUAGE") or template_defaults.get("LANGUAGE", "chinese")
     DEBUG_MODE = (os.getenv("DEBUG_MODE") or template_defaults.get("DEBUG_MODE", "false")).lower() == "true"
@@ -52,6 +155,8 @@ class GameConfig:
     # 服务器配置
     HOST = os.getenv("HOST") or template_defaults.get("HOST", "localhost")
     PORT = int(os.getenv("PORT") or template_defaults.get("PORT", "8000"))
+    # uvicorn worker进程数，大于1时需要使用 database 会话存储后端
+    WORKERS = int(os.getenv("WORKERS") or template_defaults.get("WORKERS", "1"))
     
     # 数据库配置
     DB_HOST = os.getenv("DB_HOST") or template_defaults.get("DB_HOST", "localhost")
@@ -79,6 +184,13 @@ class GameConfig:
             'base_url': cls.BASE_URL,
             'model': cls.MODEL,
             'suggestion_model': cls.SUGGESTION_MODEL,
+            'fast_model': cls.FAST_MODEL,
+            'ai_max_connections': cls.AI_MAX_CONNECTIONS,
+            'ai_request_timeout': cls.AI_REQUEST_TIMEOUT,
+            'ai_admission_max_concurrency': cls.AI_ADMISSION_MAX_CONCURRENCY,
+            'stream_pacing_mode': cls.STREAM_PACING_MODE,
+            'answer_mode': cls.ANSWER_MODE,
+            'jury_mode': cls.JURY_MODE,
             'language': cls.GAME_LANGUAGE,
             'debug_mode': cls.DEBUG_MODE,
             'narrator_temp': cls.NARRATOR_TEMPERATURE,
@@ -2,6 +2,7 @@
 数据库连接和模型定义
 """
 from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, text
+from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timezone, timedelta
@@ -26,8 +27,8 @@ def get_app_time():
     """获取应用配置的时区时间"""
     return datetime.now(APP_TIMEZONE)
 
-# 数据库连接配置
-DATABASE_URL = (
+# 数据库连接配置（设置DATABASE_URL时直接使用，例如本地压测用 sqlite:///./loadtest.db）
+DATABASE_URL = os.getenv('DATABASE_URL') or (
     f"mysql+mysqlconnector://"
     f"{os.getenv('DB_USER', 'gameuser')}:"
     f"{os.getenv('DB_PASSWORD', 'password')}@"
@@ -40,22 +41,30 @@ DATABASE_URL = (
     f"&auth_plugin=mysql_native_password"
 )
 
-# 创建数据库引擎（优化配置）
-engine = create_engine(
-    DATABASE_URL, 
-    echo=False,
-    pool_size=10,           # 连接池大小
-    max_overflow=20,        # 超出连接池大小的最大连接数
-    pool_timeout=30,        # 获取连接的超时时间
-    pool_recycle=3600,      # 连接回收时间（1小时）
-    pool_pre_ping=True,     # 连接前检查连接状态
-    connect_args={
-        "connect_timeout": 60,
-        "autocommit": False,
-        "charset": "utf8mb4",
-        "auth_plugin": "mysql_native_password"
-    }
-)
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite连接会被多个线程使用
+    engine = create_engine(
+        DATABASE_URL,
+        echo=False,
+        connect_args={"check_same_thread": False}
+    )
+else:
+    # 创建数据库引擎（优化配置）
+    engine = create_engine(
+        DATABASE_URL, 
+        echo=False,
+        pool_size=10,           # 连接池大小
+        max_overflow=20,        # 超出连接池大小的最大连接数
+        pool_timeout=30,        # 获取连接的超时时间
+        pool_recycle=3600,      # 连接回收时间（1小时）
+        pool_pre_ping=True,     # 连接前检查连接状态
+        connect_args={
+            "connect_timeout": 60,
+            "autocommit": False,
+            "charset": "utf8mb4",
+            "auth_plugin": "mysql_native_password"
+        }
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -119,6 +128,15 @@ class GameEvaluation(Base):
     # 关联关系
     session = relationship("GameSession", back_populates="evaluation")
 
+class GameSessionState(Base):
+    """游戏会话状态表（多worker部署时共享进行中的游戏状态）"""
+    __tablename__ = "game_session_states"
+    
+    session_id = Column(String(255), primary_key=True)  # 会话ID
+    version = Column(Integer, nullable=False, default=1)  # 状态版本号，每次保存加1
+    snapshot = Column(Text().with_variant(LONGTEXT, "mysql"), nullable=False)  # 游戏状态快照（JSON格式）
+    updated_at = Column(Float, nullable=False, index=True)  # 最后访问时间（读取或保存，Unix时间戳）
+
 def create_tables():
     """创建数据库表"""
     Base.metadata.create_all(bind=engine)
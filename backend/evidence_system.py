@@ -1,6 +1,16 @@
-from typing import List, Dict, Optional, Set
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set, Tuple, FrozenSet
 from .models import Character, Evidence, Case, EvidenceType
-from .ai_service import AIService
+from .ai_service import AIService, FALLBACK_RESPONSE
+from .config import GameConfig
+
+logger = logging.getLogger(__name__)
+
+# 跨会话共享的证据处理决策缓存：(案件, 角色, 已公开证据) -> 证据上下文
+# 同一案件中角色设定和掌握的证据固定不变，不同会话可以复用同一份决策
+_shared_evidence_context_cache: "OrderedDict[Tuple[str, str, FrozenSet[str]], str]" = OrderedDict()
 
 class EvidenceSystem:
     """智能证据管理系统"""
@@ -9,11 +19,17 @@ class EvidenceSystem:
         self.ai_service = ai_service
         self.revealed_evidence: Set[str] = set()  # 已经被揭露的证据
         self.character_evidence_knowledge: Dict[str, Set[str]] = {}  # 每个角色知道的证据
+        self.evidence_context_cache: Dict[Tuple[str, str, FrozenSet[str]], str] = {}  # 本会话的证据处理决策缓存
+        self.voting_analysis_tasks: Dict[Tuple[str, str, FrozenSet[str]], asyncio.Task] = {}  # 投票证据分析任务及结果
     
     def initialize_case(self, case: Case):
         """初始化案件的证据系统"""
         self.revealed_evidence.clear()
         self.character_evidence_knowledge.clear()
+        self.evidence_context_cache.clear()
+        for task in self.voting_analysis_tasks.values():
+            task.cancel()
+        self.voting_analysis_tasks.clear()
         
         # 初始化每个角色的证据知识
         for character in case.characters:
@@ -35,6 +51,49 @@ class EvidenceSystem:
         
         return known_evidence
     
+    def _evidence_context_cache_key(self, character: Character, case: Case,
+                                    known_evidence: List[Evidence]) -> Tuple[str, str, FrozenSet[str]]:
+        """证据处理决策的缓存键：案件、角色以及该角色所知证据中已公开的部分"""
+        revealed = frozenset(e.name for e in known_evidence if e.name in self.revealed_evidence)
+        return (case.title, character.name, revealed)
+    
+    def _get_cached_evidence_context(self, key: Tuple[str, str, FrozenSet[str]]) -> Optional[str]:
+        """从会话缓存或跨会话缓存中读取证据处理决策"""
+        if key in self.evidence_context_cache:
+            return self.evidence_context_cache[key]
+        
+        if GameConfig.EVIDENCE_CONTEXT_SHARED_CACHE and key in _shared_evidence_context_cache:
+            _shared_evidence_context_cache.move_to_end(key)
+            context = _shared_evidence_context_cache[key]
+            self.evidence_context_cache[key] = context
+            return context
+        
+        return None
+    
+    def _store_evidence_context(self, key: Tuple[str, str, FrozenSet[str]], context: str):
+        """保存证据处理决策到缓存"""
+        self.evidence_context_cache[key] = context
+        
+        if GameConfig.EVIDENCE_CONTEXT_SHARED_CACHE:
+            _shared_evidence_context_cache[key] = context
+            _shared_evidence_context_cache.move_to_end(key)
+            while len(_shared_evidence_context_cache) > GameConfig.EVIDENCE_CONTEXT_CACHE_SIZE:
+                _shared_evidence_context_cache.popitem(last=False)
+    
+    def _mark_evidence_revealed(self, evidence_name: str):
+        """标记证据已公开，并使知道该证据的角色的决策缓存失效"""
+        self.revealed_evidence.add(evidence_name)
+        
+        affected = {name for name, known in self.character_evidence_knowledge.items() if evidence_name in known}
+        for key in [k for k in self.evidence_context_cache if k[1] in affected]:
+            del self.evidence_context_cache[key]
+        
+        # 投票证据分析按已公开证据集合缓存，旧集合的结果不会再被用到
+        # 只移除登记而不取消任务，正在等待结果的投票仍可拿到分析
+        revealed = frozenset(self.revealed_evidence)
+        for key in [k for k in self.voting_analysis_tasks if k[2] != revealed]:
+            del self.voting_analysis_tasks[key]
+    
     async def get_character_evidence_context(self, character: Character, case: Case) -> str:
         """获取角色的证据上下文信息（AI智能判断是否提及）"""
         known_evidence = self.get_character_known_evidence(character, case)
@@ -42,10 +101,17 @@ class EvidenceSystem:
         if not known_evidence:
             return "我没有掌握特殊的证据信息。"
         
+        # 证据处理决策只取决于角色设定和证据公开状态，命中缓存时无需再调用AI
+        cache_key = self._evidence_context_cache_key(character, case, known_evidence)
+        cached_context = self._get_cached_evidence_context(cache_key)
+        if cached_context is not None:
+            return cached_context
+        
         # 让AI判断角色会如何处理这些证据
         evidence_list = []
         for evidence in known_evidence:
-            evidence_list.append(f"- {evidence.name}：{evidence.description}（意义：{evidence.significance}）")
+            public_mark = "（已公开）" if evidence.name in self.revealed_evidence else ""
+            evidence_list.append(f"- {evidence.name}{public_mark}：{evidence.description}（意义：{evidence.significance}）")
         
         prompt = f"""你正在扮演{character.name}，需要决定如何处理你知道的证据信息。
 
@@ -69,14 +135,14 @@ class EvidenceSystem:
 证据名称：[会提及/会隐瞒] - 理由"""
 
         try:
-            response = await self.ai_service.get_fast_response(prompt)
+            response = await self.ai_service.get_fast_response(prompt, call_site="evidence_context")
             
             # 解析AI的回答，构建上下文
             context_parts = ["【我知道的证据信息】"]
             
             for line in response.strip().split('\n'):
                 if '：' in line and ('会提及' in line or '会隐瞒' in line):
-                    evidence_name = line.split('：')[0].strip()
+                    evidence_name = line.split('：')[0].replace('（已公开）', '').strip('- ').strip()
                     # 找到对应的证据
                     for evidence in known_evidence:
                         if evidence.name == evidence_name:
@@ -86,7 +152,11 @@ class EvidenceSystem:
                                 context_parts.append(f"- {evidence.name}：我知道但不会主动提及")
                             break
             
-            return "\n".join(context_parts)
+            context = "\n".join(context_parts)
+            # 只缓存成功解析出决策的结果，避免把AI服务的失败回应固化下来
+            if len(context_parts) > 1:
+                self._store_evidence_context(cache_key, context)
+            return context
             
         except Exception as e:
             # AI调用失败时的备用逻辑
@@ -101,14 +171,51 @@ class EvidenceSystem:
             
             return "\n".join(context_parts)
     
+    def get_inline_evidence_context(self, character: Character, case: Case) -> str:
+        """构建单次调用模式下的证据上下文（由角色回答时自行决定提及或隐瞒，不额外调用AI）"""
+        known_evidence = self.get_character_known_evidence(character, case)
+        
+        if not known_evidence:
+            return "我没有掌握特殊的证据信息。"
+        
+        context_parts = ["【我知道的证据信息】"]
+        for evidence in known_evidence:
+            public_mark = "（已公开）" if evidence.name in self.revealed_evidence else ""
+            context_parts.append(f"- {evidence.name}{public_mark}：{evidence.description}（意义：{evidence.significance}）")
+        
+        context_parts.append("【证据处理原则】")
+        if character.is_guilty:
+            context_parts.append("我是真凶，会隐瞒对我不利的证据，但不能表现得太明显；已公开的证据可以正常谈论。")
+        else:
+            context_parts.append("我是无辜的，被问到相关内容时通常会诚实地分享我知道的证据。")
+        
+        return "\n".join(context_parts)
+    
+    def get_unrevealed_evidence(self, character: Character, case: Case) -> List[Evidence]:
+        """获取角色知道但尚未公开的证据"""
+        known_evidence = self.get_character_known_evidence(character, case)
+        return [e for e in known_evidence if e.name not in self.revealed_evidence]
+    
+    def resolve_revealed_evidence(self, character: Character, case: Case, evidence_name: str) -> Optional[Evidence]:
+        """根据AI给出的证据名称确认揭露，名称必须是角色知道且尚未公开的证据"""
+        evidence_name = (evidence_name or "").strip()
+        if not evidence_name:
+            return None
+        
+        for evidence in self.get_unrevealed_evidence(character, case):
+            if evidence.name == evidence_name:
+                self._mark_evidence_revealed(evidence.name)
+                return evidence
+        
+        return None
+    
     async def try_reveal_evidence(self, 
                                 character: Character, 
                                 question: str, 
                                 case: Case) -> Optional[Evidence]:
         """尝试通过问题揭露新证据（AI智能判断）"""
         
-        known_evidence = self.get_character_known_evidence(character, case)
-        unrevealed_evidence = [e for e in known_evidence if e.name not in self.revealed_evidence]
+        unrevealed_evidence = self.get_unrevealed_evidence(character, case)
         
         if not unrevealed_evidence:
             return None
@@ -143,15 +250,12 @@ class EvidenceSystem:
 不揭露"""
 
         try:
-            response = await self.ai_service.get_fast_response(prompt)
+            response = await self.ai_service.get_fast_response(prompt, call_site="evidence_reveal")
             
             if response.strip().startswith("揭露："):
                 evidence_name = response.strip().replace("揭露：", "").strip()
                 # 找到对应的证据
-                for evidence in unrevealed_evidence:
-                    if evidence.name == evidence_name:
-                        self.revealed_evidence.add(evidence.name)
-                        return evidence
+                return self.resolve_revealed_evidence(character, case, evidence_name)
             
             return None
             
@@ -159,14 +263,11 @@ class EvidenceSystem:
             # AI调用失败时不揭露证据
             return None
     
-    async def get_evidence_for_voting(self, case: Case, character: Character) -> str:
-        """获取投票时角色应该考虑的证据信息（AI智能分析）"""
+    def _build_voting_evidence_list(self, case: Case, character: Character) -> List[str]:
+        """构建投票分析时角色需要考虑的证据列表"""
         known_evidence = self.get_character_known_evidence(character, case)
         revealed_evidence = self.get_all_revealed_evidence(case)
         
-        if not known_evidence and not revealed_evidence:
-            return "我没有掌握特殊的证据信息。"
-        
         # 构建证据列表
         all_relevant_evidence = []
         
@@ -179,10 +280,14 @@ class EvidenceSystem:
             if evidence.name not in self.revealed_evidence:
                 all_relevant_evidence.append(f"【我私下知道】{evidence.name}：{evidence.description}（意义：{evidence.significance}）")
         
-        if not all_relevant_evidence:
-            return "目前没有重要的证据信息。"
-        
-        # 让AI分析这些证据对投票的影响
+        return all_relevant_evidence
+    
+    def _voting_analysis_key(self, case: Case, character: Character) -> Tuple[str, str, FrozenSet[str]]:
+        """投票证据分析的缓存键：只取决于案件、投票者和已公开的证据"""
+        return (case.title, character.name, frozenset(self.revealed_evidence))
+    
+    async def _analyze_evidence_for_voting(self, character: Character, all_relevant_evidence: List[str]) -> str:
+        """调用AI分析证据对投票的影响"""
         prompt = f"""你正在扮演{character.name}，现在需要基于已知证据进行投票分析。
 
 【你的角色设定】
@@ -199,11 +304,63 @@ class EvidenceSystem:
 
 分析结果："""
 
+        response = await self.ai_service.get_fast_response(prompt, call_site="voting_analysis")
+        if response.strip().endswith(FALLBACK_RESPONSE):
+            # 备用内容不是有效的分析，按调用失败处理，不在本局中复用
+            raise RuntimeError("投票证据分析返回了备用内容")
+        return f"【我知道的关键证据分析】\n{response.strip()}"
+    
+    def _on_voting_analysis_done(self, key: Tuple[str, str, FrozenSet[str]], task: asyncio.Task):
+        """后台分析任务结束时读取异常（没有投票在等待时也不会出现未读取异常的警告），并丢弃失败的任务"""
+        if task.cancelled():
+            error = None
+        else:
+            error = task.exception()
+            if error is None:
+                return
+            logger.warning(f"投票证据分析失败 - 投票者: {key[1]}, 错误: {str(error)}")
+        if self.voting_analysis_tasks.get(key) is task:
+            del self.voting_analysis_tasks[key]
+    
+    def _schedule_voting_analysis(self, case: Case, character: Character) -> Optional[asyncio.Task]:
+        """在后台启动某个投票者的证据分析，已有相同输入的任务时直接复用"""
+        key = self._voting_analysis_key(case, character)
+        task = self.voting_analysis_tasks.get(key)
+        if task is not None:
+            return task
+        
+        all_relevant_evidence = self._build_voting_evidence_list(case, character)
+        if not all_relevant_evidence:
+            return None
+        
+        task = asyncio.create_task(self._analyze_evidence_for_voting(character, all_relevant_evidence))
+        task.add_done_callback(lambda done: self._on_voting_analysis_done(key, done))
+        self.voting_analysis_tasks[key] = task
+        return task
+    
+    def schedule_voting_analyses(self, case: Case, voters: List[Character]):
+        """提前为所有投票者启动证据分析（例如在指控开始时），到投票阶段时结果已就绪"""
+        for voter in voters:
+            self._schedule_voting_analysis(case, voter)
+    
+    async def get_evidence_for_voting(self, case: Case, character: Character) -> str:
+        """获取投票时角色应该考虑的证据信息（AI智能分析）"""
+        all_relevant_evidence = self._build_voting_evidence_list(case, character)
+        
+        if not all_relevant_evidence:
+            if not self.get_character_known_evidence(character, case) and not self.revealed_evidence:
+                return "我没有掌握特殊的证据信息。"
+            return "目前没有重要的证据信息。"
+        
+        # 优先使用预先启动或已完成的分析结果，同一会话再次指控时直接复用
+        task = self._schedule_voting_analysis(case, character)
         try:
-            response = await self.ai_service.get_fast_response(prompt)
-            return f"【我知道的关键证据分析】\n{response.strip()}"
-        except Exception as e:
-            # AI调用失败时返回基本信息
+            # shield保证投票流被取消时，共享的分析任务仍可被后续复用
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # AI调用失败（失败的任务已在结束回调中丢弃），返回基本信息
             evidence_parts = ["【我知道的关键证据】"]
             for evidence in all_relevant_evidence:
                 evidence_parts.append(evidence)
@@ -219,7 +376,7 @@ class EvidenceSystem:
     
     def force_reveal_evidence(self, evidence_name: str):
         """强制揭露某个证据（比如法医检验结果）"""
-        self.revealed_evidence.add(evidence_name)
+        self._mark_evidence_revealed(evidence_name)
     
     def get_evidence_summary_for_character(self, character: Character, case: Case) -> str:
         """获取角色视角下的证据总结"""
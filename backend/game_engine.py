@@ -1,18 +1,24 @@
 import asyncio
 from typing import List, Optional, Dict, Any
 
-from .ai_service import AIService
+from .ai_service import AIService, get_ai_service
+from .llm_errors import AIServiceUnavailable
 from .models import Case, Character, CharacterType
 from .case_data import load_cases
 from .accusation_system import AccusationSystem
 from .evidence_system import EvidenceSystem
 from .config import GameConfig
+from .streaming import TrailerSplitter
+
+# 单次调用模式下，角色回答末尾的证据揭露尾注标记
+EVIDENCE_TRAILER_MARKER = "<<<揭露："
 
 class DetectiveGameEngine:
     """侦探推理游戏引擎"""
     
-    def __init__(self):
-        self.ai_service = AIService()
+    def __init__(self, ai_service: Optional[AIService] = None):
+        # 默认使用进程级共享的AI服务，避免每个会话重复创建客户端和连接池
+        self.ai_service = ai_service or get_ai_service()
         self.evidence_system = EvidenceSystem(self.ai_service)
         self.accusation_system = AccusationSystem(self.ai_service, self.evidence_system)
         self.current_case: Optional[Case] = None
@@ -40,9 +46,52 @@ class DetectiveGameEngine:
         
         # 初始化证据系统
         self.evidence_system.initialize_case(self.current_case)
-
-    async def _get_character_response_stream(self, character: Character, question: str):
-        """获取角色的AI流式回应"""
+    
+    def to_snapshot(self) -> Dict[str, Any]:
+        """导出可序列化的游戏状态快照，用于在多个worker之间共享会话"""
+        case_index = next((i for i, case in enumerate(self.cases) if case is self.current_case), None)
+        if case_index is None:
+            case_index = next(i for i, case in enumerate(self.cases) if case.title == self.current_case.title)
+        
+        return {
+            "case_index": case_index,
+            "case_title": self.current_case.title,
+            "session_id": self.session_id,
+            "conversation_history": self.conversation_history,
+            "current_round": self.current_round,
+            "hints_used": self.hints_used,
+            "revealed_evidence": sorted(self.evidence_system.revealed_evidence),
+            "character_evidence_knowledge": {
+                name: sorted(evidence_names)
+                for name, evidence_names in self.evidence_system.character_evidence_knowledge.items()
+            }
+        }
+    
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any], ai_service: Optional[AIService] = None) -> "DetectiveGameEngine":
+        """从状态快照恢复游戏引擎"""
+        engine = cls(ai_service=ai_service)
+        case_index = snapshot["case_index"]
+        if case_index >= len(engine.cases) or engine.cases[case_index].title != snapshot["case_title"]:
+            # 案例库顺序变化时按标题查找
+            case_index = next((i for i, case in enumerate(engine.cases) if case.title == snapshot["case_title"]), None)
+            if case_index is None:
+                raise ValueError(f"案例不存在: {snapshot['case_title']}")
+        
+        engine.current_case = engine.cases[case_index]
+        engine.session_id = snapshot.get("session_id")
+        engine.conversation_history = snapshot["conversation_history"]
+        engine.current_round = snapshot["current_round"]
+        engine.hints_used = snapshot["hints_used"]
+        engine.evidence_system.revealed_evidence = set(snapshot["revealed_evidence"])
+        engine.evidence_system.character_evidence_knowledge = {
+            name: set(evidence_names) for name, evidence_names in snapshot["character_evidence_knowledge"].items()
+        }
+        return engine
+
+    def _build_character_prompt(self, character: Character, question: str,
+                                evidence_context: str, reveal_instruction: str = "") -> str:
+        """构建角色回答的提示词"""
         conversation_context = ""
         if character.name in self.conversation_history:
             recent_conversations = self.conversation_history[character.name][-3:]
@@ -60,10 +109,7 @@ class DetectiveGameEngine:
 - 受害者：{self.current_case.victim_name}
         """
         
-        # 获取角色的证据上下文
-        evidence_context = await self.evidence_system.get_character_evidence_context(character, self.current_case)
-        
-        prompt = f"""你正在扮演案件中的角色{character.name}，需要根据角色设定自然地回答侦探的问题。
+        return f"""你正在扮演案件中的角色{character.name}，需要根据角色设定自然地回答侦探的问题。
 
 【角色设定】
 我是{character.name}，{character.age}岁，{character.occupation}。
@@ -101,11 +147,125 @@ class DetectiveGameEngine:
 8. 如果侦探说"我确定XX是凶手"，我不会轻易附和，需要侦探提供充分的证据和理由
 9. 我只会陈述我知道的事实，不会主动指认任何人为凶手
 10. 如果侦探的指控缺乏证据，我会质疑或保持中立态度
-
+{reveal_instruction}
 侦探问：{question}
 我回答："""
 
-        return self.ai_service.get_stream_response(prompt)
+    async def _get_character_response_stream(self, character: Character, question: str):
+        """获取角色的AI流式回应"""
+        # 获取角色的证据上下文
+        evidence_context = await self.evidence_system.get_character_evidence_context(character, self.current_case)
+        
+        prompt = self._build_character_prompt(character, question, evidence_context)
+        return self._stream_character_answer(prompt)
+    
+    async def _stream_character_answer(self, prompt: str):
+        """角色回答流；服务暂不可用（未获准入、上游熔断）时立即回复道歉，不中断问答流程"""
+        try:
+            async for chunk in self.ai_service.get_stream_response(prompt, call_site="character_answer"):
+                yield chunk
+        except AIServiceUnavailable:
+            yield "抱歉，我现在无法回应..."
+    
+    def _build_reveal_instruction(self, character: Character) -> str:
+        """构建单次调用模式下要求模型输出证据揭露尾注的说明"""
+        unrevealed_evidence = self.evidence_system.get_unrevealed_evidence(character, self.current_case)
+        if not unrevealed_evidence:
+            return ""
+        
+        evidence_names = "、".join(e.name for e in unrevealed_evidence)
+        return f"""
+【证据揭露标记】
+我尚未公开的证据有：{evidence_names}
+回答完毕后另起一行输出标记（侦探看不到这一行）：
+- 如果我的回答明确透露了其中某个证据，输出：{EVIDENCE_TRAILER_MARKER}证据名称>>>
+- 如果没有透露任何证据，输出：{EVIDENCE_TRAILER_MARKER}无>>>
+"""
+    
+    async def ask_character_stream(self, character: Character, question: str):
+        """向角色提问，流式产出事件
+        
+        事件为 (类型, 数据) 元组：
+        - ("chunk", 文本)：展示给玩家的回答片段
+        - ("response_complete", 完整回答)：回答结束
+        - ("evidence", Evidence)：本轮揭露的新证据
+        """
+        if GameConfig.ANSWER_MODE == "single_call":
+            async for event in self._ask_character_single_call(character, question):
+                yield event
+            return
+        
+        # 证据揭露判断只依赖问题和角色未公开的证据，与回答内容无关，
+        # 因此在收到问题时立即与回答并行执行，结果一出来就推送
+        reveal_task = asyncio.create_task(
+            self.evidence_system.try_reveal_evidence(character, question, self.current_case)
+        )
+        next_chunk = None
+        try:
+            response_stream = await self._get_character_response_stream(character, question)
+            stream_iter = response_stream.__aiter__()
+            next_chunk = asyncio.ensure_future(stream_iter.__anext__())
+            response_text = ""
+            
+            while True:
+                waiting = {next_chunk} if reveal_task is None else {next_chunk, reveal_task}
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                
+                if reveal_task is not None and reveal_task in done:
+                    revealed_evidence = reveal_task.result()
+                    reveal_task = None
+                    if revealed_evidence:
+                        yield "evidence", revealed_evidence
+                
+                if next_chunk in done:
+                    try:
+                        chunk = next_chunk.result()
+                    except StopAsyncIteration:
+                        next_chunk = None
+                        break
+                    response_text += chunk
+                    yield "chunk", chunk
+                    next_chunk = asyncio.ensure_future(stream_iter.__anext__())
+            
+            yield "response_complete", response_text
+            
+            if reveal_task is not None:
+                revealed_evidence = await reveal_task
+                reveal_task = None
+                if revealed_evidence:
+                    yield "evidence", revealed_evidence
+        finally:
+            # 客户端中途断开等情况下，取消尚未完成的后台任务
+            for task in (reveal_task, next_chunk):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    async def _ask_character_single_call(self, character: Character, question: str):
+        """单次调用模式：一次模型调用同时完成证据取舍、角色回答和证据揭露判断"""
+        evidence_context = self.evidence_system.get_inline_evidence_context(character, self.current_case)
+        reveal_instruction = self._build_reveal_instruction(character)
+        prompt = self._build_character_prompt(character, question, evidence_context, reveal_instruction)
+        
+        splitter = TrailerSplitter(EVIDENCE_TRAILER_MARKER)
+        response_text = ""
+        async for chunk in self._stream_character_answer(prompt):
+            visible = splitter.feed(chunk)
+            if visible:
+                response_text += visible
+                yield "chunk", visible
+        
+        visible = splitter.finish()
+        if visible:
+            response_text += visible
+            yield "chunk", visible
+        yield "response_complete", response_text.rstrip()
+        
+        if splitter.trailer and splitter.trailer != "无":
+            revealed_evidence = self.evidence_system.resolve_revealed_evidence(
+                character, self.current_case, splitter.trailer
+            )
+            if revealed_evidence:
+                yield "evidence", revealed_evidence
     
     async def _generate_suggested_questions(self, character: Character) -> List[str]:
         """生成推荐问题"""
@@ -208,7 +368,7 @@ class DetectiveGameEngine:
 请直接输出3个问题，每行一个，不要编号。如果发现矛盾，请在问题前加上"🔍矛盾："："""
 
         try:
-            response = await self.ai_service.get_suggestion_response(prompt)
+            response = await self.ai_service.get_suggestion_response(prompt, call_site="suggestion")
             questions = [q.strip() for q in response.strip().split('\n') if q.strip()]
             return questions[:3] if len(questions) >= 3 else questions
         except Exception as e:
@@ -291,7 +451,7 @@ class DetectiveGameEngine:
 请给出一个简洁但有针对性的提示（不超过50字），帮助玩家推进调查："""
 
         try:
-            response = await self.ai_service.get_fast_response(prompt)
+            response = await self.ai_service.get_fast_response(prompt, call_site="hint")
             return response.strip()
         except Exception as e:
             return "重新审视每个人的动机，谁最有理由伤害受害者？"
\ No newline at end of file
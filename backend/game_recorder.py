@@ -55,6 +55,20 @@ class GameRecorder:
             # total_rounds 已经在 record_conversation 中实时更新，这里不需要再设置
             db.commit()
     
+    def end_abandoned_sessions(self, db: Session, session_ids: List[str]) -> int:
+        """记录被淘汰（玩家离开后未结束）的会话的结束时间
+        
+        只写入 end_time，is_completed 保持为False：统计中 is_completed 表示玩家完成了审判，中途放弃的会话不计入完成率和成功率。
+        已经结束的会话保持原结果。
+        """
+        count = db.query(GameSession).filter(
+            GameSession.session_id.in_(session_ids),
+            GameSession.is_completed == False,
+            GameSession.end_time.is_(None)
+        ).update({"end_time": get_app_time()}, synchronize_session=False)
+        db.commit()
+        return count
+    
     def record_conversation(self, db: Session, session_id: str, speaker_type: str,
                           speaker_name: Optional[str], message_type: str, content: str,
                           extra_data: Optional[Dict] = None) -> int:
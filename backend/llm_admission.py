@@ -0,0 +1,215 @@
+"""
+大模型调用准入控制
+所有AIService调用在发出前都要在这里取得许可，按优先级排队，
+保证上游限流时玩家正在进行的问答优先得到处理。
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from .config import GameConfig
+from .llm_errors import AIServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+# 优先级从高到低
+PRIORITY_CLASSES = ("interactive", "trial", "background")
+
+# 调用点 -> 优先级
+CALL_SITE_PRIORITIES = {
+    # 玩家正在等待的回答
+    "character_answer": "interactive",
+    "evidence_context": "interactive",
+    "evidence_reveal": "interactive",
+    "defense": "interactive",
+    # 审判流程
+    "testimony": "trial",
+    "vote": "trial",
+    "batched_vote": "trial",
+    "voting_analysis": "trial",
+    # 可以丢弃的辅助内容
+    "hint": "background",
+    "suggestion": "background",
+}
+
+# 未登记的调用点使用的优先级
+DEFAULT_PRIORITY = "trial"
+
+# 系统繁忙时可以直接丢弃请求的优先级
+SHEDDABLE_CLASSES = ("background",)
+
+class LLMAdmissionRejected(AIServiceUnavailable):
+    """调用未获准入（队列已满、排队超时或被丢弃），调用方应使用本地备用内容"""
+
+    def __init__(self, call_site: str, priority: str, reason: str):
+        super().__init__(f"大模型调用未获准入 - 调用点: {call_site}, 优先级: {priority}, 原因: {reason}")
+        self.call_site = call_site
+        self.priority = priority
+        self.reason = reason
+
+class _PriorityClass:
+    """单个优先级的排队和计数状态"""
+
+    def __init__(self, name: str, rank: int, max_concurrency: int, max_queue: int, sheddable: bool):
+        self.name = name
+        self.rank = rank
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.sheddable = sheddable
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+class LLMAdmissionController:
+    """按优先级分级的大模型调用准入控制器
+
+    - 全局并发上限之下，每个优先级还有各自的并发上限
+    - 有空位时总是先放行优先级高的排队请求
+    - 每个优先级的排队长度有上限，排队超时视为拒绝
+    - 可丢弃的优先级（background）在有更高优先级请求排队时直接拒绝，不占用任何名额
+    """
+
+    def __init__(self, max_concurrency: int, class_limits: Dict[str, float],
+                 queue_sizes: Dict[str, float], queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.classes: Dict[str, _PriorityClass] = {}
+        for rank, name in enumerate(PRIORITY_CLASSES):
+            self.classes[name] = _PriorityClass(
+                name=name,
+                rank=rank,
+                max_concurrency=int(class_limits.get(name, max_concurrency)),
+                max_queue=int(queue_sizes.get(name, 100)),
+                sheddable=name in SHEDDABLE_CLASSES
+            )
+
+    @classmethod
+    def from_config(cls) -> "LLMAdmissionController":
+        """根据游戏配置创建准入控制器"""
+        return cls(
+            max_concurrency=GameConfig.AI_ADMISSION_MAX_CONCURRENCY,
+            class_limits=GameConfig.AI_ADMISSION_CLASS_LIMITS,
+            queue_sizes=GameConfig.AI_ADMISSION_QUEUE_SIZES,
+            queue_timeout=GameConfig.AI_ADMISSION_QUEUE_TIMEOUT
+        )
+
+    def priority_of(self, call_site: str) -> str:
+        """获取调用点对应的优先级"""
+        return CALL_SITE_PRIORITIES.get(call_site, DEFAULT_PRIORITY)
+
+    def _higher_priority_waiting(self, priority_class: _PriorityClass) -> bool:
+        return any(c.waiters for c in self.classes.values() if c.rank < priority_class.rank)
+
+    def _can_admit(self, priority_class: _PriorityClass) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        if priority_class.active >= priority_class.max_concurrency:
+            return False
+        # 有更高优先级的请求在排队时，空出的名额留给它们
+        return not self._higher_priority_waiting(priority_class)
+
+    def _admit(self, priority_class: _PriorityClass):
+        self.active += 1
+        priority_class.active += 1
+        priority_class.admitted += 1
+
+    def _reject(self, priority_class: _PriorityClass, call_site: str, reason: str) -> LLMAdmissionRejected:
+        priority_class.rejected += 1
+        logger.warning(f"大模型调用被拒绝 - 调用点: {call_site}, 优先级: {priority_class.name}, 原因: {reason}")
+        return LLMAdmissionRejected(call_site, priority_class.name, reason)
+
+    def _wake_waiters(self):
+        """按优先级从高到低放行排队的请求"""
+        for priority_class in sorted(self.classes.values(), key=lambda c: c.rank):
+            while priority_class.waiters and self.active < self.max_concurrency \
+                    and priority_class.active < priority_class.max_concurrency:
+                waiter = priority_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._admit(priority_class)
+                waiter.set_result(None)
+            if priority_class.waiters and self.active >= self.max_concurrency:
+                # 全局名额已满，更低优先级的请求继续等待
+                return
+
+    async def acquire(self, call_site: str) -> str:
+        """为一次调用申请准入，返回所属优先级；无法准入时抛出LLMAdmissionRejected"""
+        priority_class = self.classes[self.priority_of(call_site)]
+
+        if not priority_class.waiters and self._can_admit(priority_class):
+            self._admit(priority_class)
+            return priority_class.name
+
+        if priority_class.sheddable and (self._higher_priority_waiting(priority_class)
+                                         or self.active >= self.max_concurrency):
+            # 系统繁忙时直接丢弃辅助请求，绝不与玩家的回答争抢名额
+            raise self._reject(priority_class, call_site, "系统繁忙，已丢弃")
+
+        if len(priority_class.waiters) >= priority_class.max_queue:
+            raise self._reject(priority_class, call_site, "排队已满")
+
+        waiter = asyncio.get_running_loop().create_future()
+        priority_class.waiters.append(waiter)
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except BaseException:
+            # 排队期间被取消：已获准入则归还名额，否则退出队列
+            if waiter.done() and not waiter.cancelled():
+                self.release(priority_class.name)
+            else:
+                self._discard_waiter(priority_class, waiter)
+            raise
+
+        if not done:
+            self._discard_waiter(priority_class, waiter)
+            raise self._reject(priority_class, call_site, "排队超时")
+        return priority_class.name
+
+    def _discard_waiter(self, priority_class: _PriorityClass, waiter: asyncio.Future):
+        waiter.cancel()
+        try:
+            priority_class.waiters.remove(waiter)
+        except ValueError:
+            pass
+        # 排在后面的低优先级请求可能因此可以放行
+        self._wake_waiters()
+
+    def release(self, priority: str):
+        """归还一个调用名额"""
+        priority_class = self.classes[priority]
+        self.active = max(0, self.active - 1)
+        priority_class.active = max(0, priority_class.active - 1)
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self, call_site: str):
+        """在调用期间占用一个名额（流式调用需要在整个流结束后才释放）"""
+        priority = await self.acquire(call_site)
+        try:
+            yield priority
+        finally:
+            self.release(priority)
+
+    def get_stats(self) -> Dict:
+        """获取各优先级的运行状态"""
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "classes": {
+                name: {
+                    "active": c.active,
+                    "waiting": len(c.waiters),
+                    "max_concurrency": c.max_concurrency,
+                    "max_queue": c.max_queue,
+                    "admitted": c.admitted,
+                    "rejected": c.rejected
+                } for name, c in self.classes.items()
+            }
+        }
+
+# 创建全局准入控制器
+llm_admission = LLMAdmissionController.from_config()
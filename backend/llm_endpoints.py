@@ -0,0 +1,246 @@
+"""
+大模型上游端点池
+支持配置多个OpenAI兼容的上游端点（带权重），根据健康评分选择端点，
+并提供故障转移时排除已尝试端点的选择逻辑。
+每个端点带有熔断器，连接类错误的重试受全局重试预算约束。
+"""
+import json
+import logging
+import random
+import time
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+import openai
+
+from .config import GameConfig
+
+logger = logging.getLogger(__name__)
+
+# 健康评分使用的指数滑动平均系数
+HEALTH_EWMA_ALPHA = 0.2
+
+class CircuitBreaker:
+    """端点熔断器
+
+    连续失败达到阈值后熔断（open），期间不再向该端点发送请求；
+    冷却时间过后进入半开（half_open）状态，只放行一个探测请求，
+    探测成功则恢复（closed），失败则重新熔断。
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+        self.open_count = 0
+
+    def allows_request(self) -> bool:
+        """当前是否可以向该端点发送请求（不改变状态）"""
+        now = time.monotonic()
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return now - self.opened_at >= self.reset_timeout
+        # 半开状态只允许一个探测请求；探测请求迟迟没有结果时允许重新探测
+        return self.probe_started_at is None or now - self.probe_started_at >= self.reset_timeout
+
+    def before_request(self):
+        """请求发出前调用，冷却结束的熔断器在这里进入半开状态"""
+        if self.state == "open":
+            self.state = "half_open"
+            logger.info("端点熔断冷却结束，发送探测请求")
+        if self.state == "half_open":
+            self.probe_started_at = time.monotonic()
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("端点探测成功，熔断恢复")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.open_count += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probe_started_at = None
+
+class RetryBudget:
+    """全局重试预算
+
+    每个请求存入ratio个令牌，每次重试消耗一个令牌，余额不超过max_balance。
+    上游大面积故障时重试很快耗尽预算，避免重试放大流量。
+    """
+
+    def __init__(self, ratio: float, max_balance: float):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_request(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """申请一次重试，预算不足时返回False"""
+        if self.balance >= 1:
+            self.balance -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def get_stats(self) -> Dict:
+        return {"balance": round(self.balance, 2), "retries": self.retries, "exhausted": self.exhausted}
+
+class LLMEndpoint:
+    """单个上游端点及其健康状态"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str,
+                 suggestion_model: Optional[str] = None, fast_model: Optional[str] = None, weight: float = 1.0,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.suggestion_model = suggestion_model or model
+        self.fast_model = fast_model or self.suggestion_model
+        self.weight = max(0.0, weight)
+        # 重试由AIService按重试预算统一控制，关闭客户端自带的重试
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        self.breaker = CircuitBreaker(GameConfig.AI_CIRCUIT_FAILURE_THRESHOLD, GameConfig.AI_CIRCUIT_RESET_SECONDS)
+        # 健康状态：首字延迟和错误率的滑动平均
+        self.ttft_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_failure_at: Optional[float] = None
+
+    def resolve_model(self, model: str) -> str:
+        """把路由中的模型档位解析为该端点上的模型名称"""
+        if model == "main":
+            return self.model
+        if model == "fast":
+            return self.fast_model
+        if model == "suggestion":
+            return self.suggestion_model
+        return model
+
+    def health_score(self) -> float:
+        """健康评分：权重越高、错误率越低、首字越快，评分越高"""
+        latency_factor = 1.0 / (1.0 + (self.ttft_ewma or 0.0))
+        return self.weight * (1.0 - self.error_ewma) ** 2 * latency_factor
+
+    def record_success(self, ttft: Optional[float] = None):
+        """记录一次成功调用（流式调用附带首字延迟）"""
+        self.requests += 1
+        self.error_ewma *= (1 - HEALTH_EWMA_ALPHA)
+        self.breaker.record_success()
+        if ttft is not None:
+            self.record_ttft(ttft)
+
+    def record_ttft(self, ttft: float):
+        """记录首字延迟（对冲请求中落后被取消的一方记录已等待的时长）"""
+        if self.ttft_ewma is None:
+            self.ttft_ewma = ttft
+        else:
+            self.ttft_ewma = (1 - HEALTH_EWMA_ALPHA) * self.ttft_ewma + HEALTH_EWMA_ALPHA * ttft
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        self.requests += 1
+        self.failures += 1
+        self.last_failure_at = time.time()
+        self.error_ewma = (1 - HEALTH_EWMA_ALPHA) * self.error_ewma + HEALTH_EWMA_ALPHA
+        self.breaker.record_failure()
+
+    def get_stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "model": self.model,
+            "weight": self.weight,
+            "health_score": round(self.health_score(), 4),
+            "ttft_ewma": round(self.ttft_ewma, 3) if self.ttft_ewma is not None else None,
+            "error_rate": round(self.error_ewma, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit_state": self.breaker.state,
+            "circuit_open_count": self.breaker.open_count
+        }
+
+class EndpointPool:
+    """上游端点池：按 权重×健康评分 加权随机选择端点"""
+
+    def __init__(self, endpoints: List[LLMEndpoint]):
+        if not endpoints:
+            raise ValueError("至少需要配置一个大模型上游端点")
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_config(cls, http_client: Optional[httpx.AsyncClient] = None) -> "EndpointPool":
+        """根据游戏配置创建端点池
+
+        AI_ENDPOINTS为JSON数组时使用其中的端点，否则使用单个 BASE_URL/MODEL 端点。
+        """
+        endpoints = []
+        for i, item in enumerate(_load_endpoint_config()):
+            endpoints.append(LLMEndpoint(
+                name=item.get("name") or f"endpoint-{i + 1}",
+                base_url=item.get("base_url") or GameConfig.BASE_URL,
+                api_key=item.get("api_key") or GameConfig.API_KEY,
+                model=item.get("model") or GameConfig.MODEL,
+                suggestion_model=item.get("suggestion_model") or item.get("model") or GameConfig.SUGGESTION_MODEL,
+                fast_model=item.get("fast_model") or item.get("suggestion_model") or item.get("model") or GameConfig.FAST_MODEL,
+                weight=float(item.get("weight", 1.0)),
+                http_client=http_client
+            ))
+        return cls(endpoints)
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def pick(self, exclude: Iterable[LLMEndpoint] = ()) -> Optional[LLMEndpoint]:
+        """选择一个端点，exclude中的端点和熔断中的端点不参与选择；没有可选端点时返回None"""
+        excluded = set(id(e) for e in exclude)
+        candidates = [e for e in self.endpoints
+                      if id(e) not in excluded and e.weight > 0 and e.breaker.allows_request()]
+        if not candidates:
+            return None
+
+        scores = [e.health_score() for e in candidates]
+        if sum(scores) <= 0:
+            # 所有端点都不健康时按权重选择，仍然给它们恢复的机会
+            scores = [e.weight for e in candidates]
+        endpoint = random.choices(candidates, weights=scores, k=1)[0]
+        endpoint.breaker.before_request()
+        return endpoint
+
+    def all_open(self) -> bool:
+        """是否所有端点都处于熔断中"""
+        return not any(e.breaker.allows_request() for e in self.endpoints if e.weight > 0)
+
+    async def aclose(self):
+        """关闭所有端点的客户端"""
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+    def get_stats(self) -> List[Dict]:
+        return [e.get_stats() for e in self.endpoints]
+
+def _load_endpoint_config() -> List[Dict]:
+    """读取AI_ENDPOINTS配置，格式错误或未配置时退回单端点"""
+    if GameConfig.AI_ENDPOINTS:
+        try:
+            items = json.loads(GameConfig.AI_ENDPOINTS)
+            if isinstance(items, list) and items:
+                return [item for item in items if isinstance(item, dict)]
+        except json.JSONDecodeError as e:
+            logger.error(f"AI_ENDPOINTS配置格式错误，使用单个上游端点 - 错误: {str(e)}")
+    return [{"name": "default"}]
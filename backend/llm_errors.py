@@ -0,0 +1,14 @@
+"""
+大模型调用相关异常
+"""
+
+class AIServiceUnavailable(Exception):
+    """大模型服务暂不可用（未获准入、所有上游端点熔断等）
+
+    AIService遇到这类情况会立即抛出而不是等待超时，调用方应直接使用本地备用内容。
+    """
+    pass
+
+class CircuitOpenError(AIServiceUnavailable):
+    """所有可用的上游端点都处于熔断状态"""
+    pass
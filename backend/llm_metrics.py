@@ -0,0 +1,179 @@
+"""
+大模型调用耗时统计
+按 调用点×模型 记录每次上游调用的排队等待、首字延迟、总耗时、输出token数和生成速度，
+保存在进程内的直方图中，供后台管理接口查看延迟预算消耗在哪个调用点上。
+"""
+import bisect
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+# 时长类指标的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+# 输出token数的桶上界
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+# 生成速度的桶上界（token/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+# 调用结果：ok 正常完成，error 上游出错（返回了兜底回应），cancelled 调用方中途离开，rejected 未获准入或熔断
+CALL_STATUSES = ("ok", "error", "cancelled", "rejected")
+
+class Histogram:
+    """固定桶直方图，百分位数在桶内线性插值估算"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # 最后一个桶收集超过最大上界的观测值
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """估算百分位数（q取0~1）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                # 估算值不超出实际观测到的范围
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+    def get_stats(self) -> Dict:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 3) if value is not None else None
+
+        return {
+            "count": self.count,
+            "mean": rounded(self.total / self.count) if self.count else None,
+            "min": rounded(self.min),
+            "max": rounded(self.max),
+            "p50": rounded(self.percentile(0.5)),
+            "p90": rounded(self.percentile(0.9)),
+            "p99": rounded(self.percentile(0.99)),
+            "buckets": {
+                **{f"le_{b}": c for b, c in zip(self.buckets, self.counts)},
+                "inf": self.counts[-1]
+            }
+        }
+
+class _CallSiteMetrics:
+    """单个 调用点×模型 的统计"""
+
+    def __init__(self):
+        self.statuses = {status: 0 for status in CALL_STATUSES}
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.ttft = Histogram(LATENCY_BUCKETS)
+        self.duration = Histogram(LATENCY_BUCKETS)
+        self.output_tokens = Histogram(TOKEN_BUCKETS)
+        self.tokens_per_second = Histogram(RATE_BUCKETS)
+
+    def get_stats(self) -> Dict:
+        return {
+            "calls": self.statuses,
+            "queue_wait": self.queue_wait.get_stats(),
+            "ttft": self.ttft.get_stats(),
+            "duration": self.duration.get_stats(),
+            "output_tokens": self.output_tokens.get_stats(),
+            "tokens_per_second": self.tokens_per_second.get_stats()
+        }
+
+class LLMCallTimer:
+    """一次上游调用的计时
+
+    所有时长都从调用发起（申请准入之前）开始计算，即调用方实际感受到的延迟；
+    排队等待单独记录，两者相减即为上游本身的耗时。
+    """
+
+    def __init__(self, metrics: "LLMMetrics", call_site: str, model: str, streamed: bool):
+        self.metrics = metrics
+        self.call_site = call_site
+        self.model = model
+        self.streamed = streamed
+        self.started_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.output_tokens = 0
+        self.finished = False
+
+    def admitted(self):
+        """取得准入名额"""
+        self.admitted_at = time.monotonic()
+
+    def first_token(self):
+        """收到首个有内容的片段（非流式调用在收到完整回应时调用）"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def add_tokens(self, count: int):
+        self.output_tokens += count
+
+    def finish(self, status: str = "ok"):
+        """结束计时并写入统计，重复调用只记录第一次"""
+        if self.finished:
+            return
+        self.finished = True
+        self.metrics.record(self, status, time.monotonic())
+
+class LLMMetrics:
+    """进程内的大模型调用统计"""
+
+    def __init__(self):
+        self._sites: Dict[Tuple[str, str], _CallSiteMetrics] = {}
+        self.since = time.time()
+
+    def start(self, call_site: str, model: str, streamed: bool = False) -> LLMCallTimer:
+        """开始记录一次调用"""
+        return LLMCallTimer(self, call_site, model, streamed)
+
+    def record(self, timer: LLMCallTimer, status: str, finished_at: float):
+        site = self._sites.get((timer.call_site, timer.model))
+        if site is None:
+            site = self._sites[(timer.call_site, timer.model)] = _CallSiteMetrics()
+        site.statuses[status] = site.statuses.get(status, 0) + 1
+
+        if timer.admitted_at is not None:
+            site.queue_wait.observe(timer.admitted_at - timer.started_at)
+        # 耗时分布只统计正常完成的调用，失败和取消的调用只计数
+        if status != "ok":
+            return
+        site.duration.observe(finished_at - timer.started_at)
+        if timer.first_token_at is not None:
+            site.ttft.observe(timer.first_token_at - timer.started_at)
+        site.output_tokens.observe(timer.output_tokens)
+
+        # 生成速度：流式调用按首字之后的生成时间计算，非流式调用按准入之后的上游耗时计算
+        if timer.streamed and timer.first_token_at is not None and timer.output_tokens > 1:
+            generation_time = finished_at - timer.first_token_at
+        else:
+            generation_time = finished_at - (timer.admitted_at or timer.started_at)
+        if timer.output_tokens and generation_time > 0:
+            site.tokens_per_second.observe(timer.output_tokens / generation_time)
+
+    def reset(self):
+        """清空所有统计"""
+        self._sites.clear()
+        self.since = time.time()
+
+    def get_stats(self) -> Dict:
+        """按调用点汇总的统计，同一调用点下按模型区分"""
+        call_sites: Dict[str, Dict[str, Dict]] = {}
+        for (call_site, model), site in sorted(self._sites.items()):
+            call_sites.setdefault(call_site, {})[model] = site.get_stats()
+        return {"since": self.since, "call_sites": call_sites}
+
+# 创建全局调用统计
+llm_metrics = LLMMetrics()
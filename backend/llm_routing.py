@@ -0,0 +1,106 @@
+"""
+大模型调用路由表
+按调用点决定使用的模型、温度、最大token数和停止序列。
+分类式的短调用（证据揭露判断、证据取舍、投票）使用快速小模型和紧凑的预算，
+角色对话等需要表现力的调用继续使用主模型。
+"""
+import json
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+from .config import GameConfig
+
+logger = logging.getLogger(__name__)
+
+# 模型档位：main 主模型，fast 快速模型，suggestion 建议问题模型；其他值视为具体的模型名称
+MODEL_TIERS = ("main", "fast", "suggestion")
+
+@dataclass(frozen=True)
+class LLMRoute:
+    """单个调用点的模型调用参数"""
+    model: str
+    temperature: float
+    max_tokens: int
+    stop: Optional[List[str]] = field(default=None, hash=False)
+
+    def request_params(self) -> Dict:
+        """生成除model和messages以外的请求参数"""
+        params = {"temperature": self.temperature, "max_tokens": self.max_tokens}
+        if self.stop:
+            params["stop"] = list(self.stop)
+        return params
+
+    def model_name(self) -> str:
+        """模型档位对应的配置模型名称（用于缓存键，端点上的实际模型名由端点解析）"""
+        if self.model == "main":
+            return GameConfig.MODEL
+        if self.model == "fast":
+            return GameConfig.FAST_MODEL
+        if self.model == "suggestion":
+            return GameConfig.SUGGESTION_MODEL
+        return self.model
+
+    def cache_key(self) -> tuple:
+        """用于缓存和请求合并的参数部分"""
+        return (self.model_name(), self.temperature, self.max_tokens, tuple(self.stop or ()))
+
+def _default_routes() -> Dict[str, LLMRoute]:
+    """默认路由表"""
+    return {
+        # 角色对话和审判发言：主模型，保持表现力
+        "character_answer": LLMRoute("main", GameConfig.CHARACTER_TEMPERATURE, 500),
+        "defense": LLMRoute("main", GameConfig.CHARACTER_TEMPERATURE, 400),
+        "testimony": LLMRoute("main", GameConfig.CHARACTER_TEMPERATURE, 400),
+        "batched_vote": LLMRoute("main", GameConfig.NARRATOR_TEMPERATURE, 800),
+        "hint": LLMRoute("main", GameConfig.NARRATOR_TEMPERATURE, 150),
+        # 分类式调用：快速模型，低温度，紧凑的token预算
+        "evidence_reveal": LLMRoute("fast", 0.0, 30, ["\n"]),
+        "evidence_context": LLMRoute("fast", 0.3, 300),
+        "vote": LLMRoute("fast", 0.5, 200),
+        "voting_analysis": LLMRoute("fast", 0.5, 300),
+        # 建议问题：专门的建议模型
+        "suggestion": LLMRoute("suggestion", 0.7, 300),
+    }
+
+def _load_route_overrides(routes: Dict[str, LLMRoute]) -> Dict[str, LLMRoute]:
+    """用AI_ROUTES配置覆盖默认路由，只需写出要修改的字段"""
+    if not GameConfig.AI_ROUTES:
+        return routes
+    try:
+        overrides = json.loads(GameConfig.AI_ROUTES)
+    except json.JSONDecodeError as e:
+        logger.error(f"AI_ROUTES配置格式错误，使用默认路由表 - 错误: {str(e)}")
+        return routes
+
+    for call_site, values in overrides.items():
+        if not isinstance(values, dict):
+            continue
+        base = routes.get(call_site) or LLMRoute("main", GameConfig.NARRATOR_TEMPERATURE, 500)
+        fields = {k: values[k] for k in ("model", "temperature", "max_tokens", "stop") if k in values}
+        routes[call_site] = replace(base, **fields)
+    return routes
+
+class LLMRouter:
+    """调用点路由表"""
+
+    def __init__(self, routes: Dict[str, LLMRoute]):
+        self.routes = routes
+
+    @classmethod
+    def from_config(cls) -> "LLMRouter":
+        """根据游戏配置创建路由表"""
+        return cls(_load_route_overrides(_default_routes()))
+
+    def resolve(self, call_site: str, default: LLMRoute) -> LLMRoute:
+        """获取调用点的路由，未登记的调用点使用调用方法的默认参数"""
+        return self.routes.get(call_site, default)
+
+    def get_routes(self) -> Dict[str, Dict]:
+        return {
+            name: {"model": r.model, "temperature": r.temperature, "max_tokens": r.max_tokens, "stop": r.stop}
+            for name, r in self.routes.items()
+        }
+
+# 创建全局路由表
+llm_router = LLMRouter.from_config()
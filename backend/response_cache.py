@@ -0,0 +1,181 @@
+"""
+大模型回应缓存
+缓存非流式调用的完整回应：进程内LRU（条目数和过期时间双重限制），
+以及可选的SQLite磁盘层（服务重启后仍然有效）。
+按调用点开启，只缓存提示词在不同会话之间会重复的调用。
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from .config import GameConfig
+
+logger = logging.getLogger(__name__)
+
+class _DiskCache:
+    """SQLite磁盘缓存层"""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+                "cache_key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # 启动时清理已过期的条目
+            self._conn.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (time.time() - ttl,))
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time() - self.ttl:
+                self._conn.execute("DELETE FROM llm_response_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, response: str, created_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (cache_key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, created_at)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response_cache")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResponseCache:
+    """大模型回应缓存
+
+    缓存键由模型、温度、最大token数、停止序列和提示词哈希组成。
+    先查内存层，未命中再查磁盘层（命中后回填内存层）。
+    """
+
+    def __init__(self, call_sites: Iterable[str], max_entries: int = 2000, ttl: float = 86400,
+                 disk_path: Optional[str] = None):
+        self.call_sites = set(call_sites)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._disk: Optional[_DiskCache] = None
+        if disk_path:
+            try:
+                self._disk = _DiskCache(disk_path, ttl)
+            except Exception as e:
+                logger.error(f"回应缓存磁盘层初始化失败，仅使用内存缓存 - 路径: {disk_path}, 错误: {str(e)}")
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_config(cls) -> "ResponseCache":
+        """根据游戏配置创建回应缓存"""
+        return cls(
+            call_sites=GameConfig.AI_RESPONSE_CACHE_CALL_SITES,
+            max_entries=GameConfig.AI_RESPONSE_CACHE_SIZE,
+            ttl=GameConfig.AI_RESPONSE_CACHE_TTL,
+            disk_path=GameConfig.AI_RESPONSE_CACHE_DB_PATH
+        )
+
+    def enabled_for(self, call_site: str) -> bool:
+        """该调用点是否开启了缓存"""
+        return call_site in self.call_sites
+
+    @staticmethod
+    def make_key(model: str, temperature: float, max_tokens: int, stop: Tuple[str, ...], prompt: str) -> str:
+        """生成缓存键"""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        stop_part = hashlib.sha256("\x00".join(stop).encode("utf-8")).hexdigest()[:8] if stop else ""
+        return f"{model}|{temperature}|{max_tokens}|{stop_part}|{prompt_hash}"
+
+    def _count(self, call_site: str, field: str):
+        site_stats = self.stats.setdefault(call_site, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        site_stats[field] += 1
+
+    def _store_memory(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str, call_site: str) -> Optional[str]:
+        """查询缓存，未命中返回None"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[1] >= time.time() - self.ttl:
+                self._memory.move_to_end(key)
+                self._count(call_site, "memory_hits")
+                return entry[0]
+            del self._memory[key]
+
+        if self._disk is not None:
+            try:
+                entry = await asyncio.to_thread(self._disk.get, key)
+            except Exception as e:
+                logger.error(f"读取回应缓存磁盘层失败 - 错误: {str(e)}")
+                entry = None
+            if entry is not None:
+                self._store_memory(key, entry[0], entry[1])
+                self._count(call_site, "disk_hits")
+                return entry[0]
+
+        self._count(call_site, "misses")
+        return None
+
+    async def set(self, key: str, response: str):
+        """写入缓存"""
+        created_at = time.time()
+        self._store_memory(key, response, created_at)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, response, created_at)
+            except Exception as e:
+                logger.error(f"写入回应缓存磁盘层失败 - 错误: {str(e)}")
+
+    def clear(self):
+        """清空缓存（包括磁盘层）"""
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def close(self):
+        """关闭磁盘层连接"""
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def get_stats(self) -> Dict:
+        """获取缓存命中统计"""
+        total_hits = sum(s["memory_hits"] + s["disk_hits"] for s in self.stats.values())
+        total_misses = sum(s["misses"] for s in self.stats.values())
+        lookups = total_hits + total_misses
+        return {
+            "enabled_call_sites": sorted(self.call_sites),
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._disk is not None,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_rate": round(total_hits / lookups, 4) if lookups else 0.0,
+            "call_sites": self.stats
+        }
+
+# 创建全局回应缓存
+response_cache = ResponseCache.from_config()
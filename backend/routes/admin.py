@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from backend.database import get_db, GameSession, GameEvaluation
 from backend.admin_auth import admin_auth
 from backend.statistics_service import statistics_service
+from backend.ai_service import AIService, get_ai_service
 
 logger = logging.getLogger(__name__)
 
@@ -117,6 +118,33 @@ async def get_admin_statistics(
         logger.error(f"获取统计数据失败: {e}")
         raise HTTPException(status_code=500, detail=f"获取统计数据失败: {str(e)}")
 
+@admin_router.get("/llm-metrics")
+async def get_admin_llm_metrics(
+    token: str = Depends(verify_admin_auth),
+    ai_service: AIService = Depends(get_ai_service)
+):
+    """获取大模型调用统计（按调用点的排队等待、首字延迟、总耗时、输出token数和生成速度）"""
+    logger.info("获取大模型调用统计")
+    return ai_service.get_stats()
+
+@admin_router.post("/llm-metrics/reset")
+async def reset_admin_llm_metrics(
+    token: str = Depends(verify_admin_auth),
+    ai_service: AIService = Depends(get_ai_service)
+):
+    """清空大模型调用统计"""
+    ai_service.metrics.reset()
+    logger.info("大模型调用统计已清空")
+    return {"success": True, "message": "统计已清空"}
+
+@admin_router.get("/session-store")
+async def get_admin_session_store(token: str = Depends(verify_admin_auth)):
+    """获取内存中游戏会话的统计（当前会话数、估算内存、各原因的淘汰次数）"""
+    from backend.routes.game import get_game_sessions
+    
+    logger.info("获取游戏会话存储统计")
+    return await get_game_sessions().get_stats()
+
 @admin_router.get("/sessions")
 async def get_admin_sessions(
     limit: int = 50,
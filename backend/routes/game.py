@@ -12,11 +12,14 @@ from sqlalchemy.orm import Session
 
 # 导入游戏相关模块
 from backend.game_engine import DetectiveGameEngine
+from backend.ai_service import AIService, get_ai_service
 from backend.models import Character, Case, Accusation, CharacterType, CaseCategory, CaseDifficulty
 from backend.case_data import load_cases
 from backend.config import GameConfig
 from backend.database import get_db
 from backend.game_recorder import game_recorder
+from backend.session_store import create_session_store
+from backend.streaming import StreamPacer, multiplex_streams, stop_on_disconnect, coalesce_chunks, coalesce_settings
 
 logger = logging.getLogger(__name__)
 
@@ -32,8 +35,6 @@ cases_router = APIRouter(
     tags=["cases"]
 )
 
-# 游戏会话管理
-game_sessions: Dict[str, DetectiveGameEngine] = {}
 
 # API数据模型
 class GameSessionResponse(BaseModel):
@@ -87,6 +88,27 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+def _record_evicted_sessions(session_ids: List[str]):
+    """在数据库中记录被淘汰会话的结束时间"""
+    db = next(get_db())
+    try:
+        ended = game_recorder.end_abandoned_sessions(db, session_ids)
+        logger.info(f"已记录 {ended} 个被淘汰的游戏会话的结束时间")
+    finally:
+        db.close()
+
+async def _on_sessions_evicted(session_ids: List[str]):
+    """会话被淘汰时在事件循环中断开WebSocket连接记录，数据库记录放到线程中执行"""
+    for session_id in session_ids:
+        manager.disconnect(session_id)
+    await asyncio.to_thread(_record_evicted_sessions, session_ids)
+
+# 同一会话的其他请求已先修改游戏状态，本次修改未能保存时返回给玩家的提示
+SESSION_CONFLICT_MESSAGE = "游戏进度已在其他页面或请求中更新，本次操作未能保存，请刷新页面后重试"
+
+# 游戏会话管理：空闲过期和超过上限的会话会被淘汰；修改游戏状态后需调用 save() 写回（多worker部署时共享）
+game_sessions = create_session_store(on_evict=_on_sessions_evicted)
+
 def _get_client_ip(request: Request) -> str:
     """获取客户端IP地址"""
     # 检查X-Forwarded-For头（适用于代理服务器）
@@ -195,7 +217,8 @@ async def get_categories():
 
 # 游戏核心接口
 @game_router.post("/start")
-async def start_game(request: StartGameRequest, req: Request, db: Session = Depends(get_db)):
+async def start_game(request: StartGameRequest, req: Request, db: Session = Depends(get_db),
+                     ai_service: AIService = Depends(get_ai_service)):
     """
     开始新游戏API
     
@@ -217,7 +240,7 @@ async def start_game(request: StartGameRequest, req: Request, db: Session = Depe
         
         # 创建游戏引擎实例
         logger.info("正在创建游戏引擎实例...")
-        game_engine = DetectiveGameEngine()
+        game_engine = DetectiveGameEngine(ai_service=ai_service)
         logger.info(f"游戏引擎创建成功，可用案例数: {len(game_engine.cases)}")
         
         # 验证案例索引
@@ -243,8 +266,8 @@ async def start_game(request: StartGameRequest, req: Request, db: Session = Depe
         
         # 保存会话
         logger.info("保存游戏会话...")
-        game_sessions[session_id] = game_engine
-        logger.info(f"游戏会话保存成功，当前会话数: {len(game_sessions)}")
+        await game_sessions.add(session_id, game_engine)
+        logger.info(f"游戏会话保存成功 - 会话ID: {session_id}")
         
         # 记录到数据库
         try:
@@ -261,6 +284,7 @@ async def start_game(request: StartGameRequest, req: Request, db: Session = Depe
                 game_version=game_version
             )
             game_engine.session_id = session_id
+            await game_sessions.save(session_id, game_engine)
             logger.info(f"游戏会话记录到数据库成功 - 会话ID: {session_id}")
         except Exception as db_error:
             logger.warning(f"数据库记录失败，但游戏继续进行 - 会话ID: {session_id}, 错误: {str(db_error)}")
@@ -317,11 +341,10 @@ async def get_game_state(session_id: str):
     
     获取指定会话的当前游戏状态信息
     """
-    if session_id not in game_sessions:
+    game = await game_sessions.load(session_id)
+    if game is None:
         raise HTTPException(status_code=404, detail="游戏会话不存在")
     
-    game = game_sessions[session_id]
-    
     return {
         "session_id": session_id,
         "current_round": game.current_round,
@@ -333,7 +356,7 @@ async def get_game_state(session_id: str):
     }
 
 @game_router.post("/question/stream")
-async def ask_question_stream(request: QuestionRequest):
+async def ask_question_stream(request: QuestionRequest, req: Request):
     """
     角色提问API（流式响应）
     
@@ -342,11 +365,10 @@ async def ask_question_stream(request: QuestionRequest):
     try:
         logger.info(f"收到流式提问请求 - 会话ID: {request.session_id}, 角色: {request.character_name}, 问题长度: {len(request.question)}")
         
-        if request.session_id not in game_sessions:
-            logger.error(f"游戏会话不存在 - 会话ID: {request.session_id}, 当前会话数: {len(game_sessions)}")
+        game = await game_sessions.load(request.session_id)
+        if game is None:
+            logger.error(f"游戏会话不存在 - 会话ID: {request.session_id}")
             raise HTTPException(status_code=404, detail="游戏会话不存在")
-        
-        game = game_sessions[request.session_id]
         logger.info(f"找到游戏会话 - 当前轮次: {game.current_round}/{game.max_rounds}")
         
         if game.current_round >= game.max_rounds:
@@ -377,59 +399,64 @@ async def ask_question_stream(request: QuestionRequest):
     logger.info(f"开始生成角色回应 - 会话ID: {request.session_id}, 角色: {character.name}, 问题: {request.question[:50]}...")
     
     async def generate_response():
+        pacer = StreamPacer.from_config('question')
+        round_before = game.current_round
+        saved = False
         try:
             # 发送开始标记
             yield f"data: {json.dumps({'type': 'start', 'character_name': character.name})}\n\n"
             
-            # 获取AI回应流
-            response_stream = await game._get_character_response_stream(character, request.question)
-            
             # 收集完整响应用于保存
             response_text = ""
+            revealed_evidence = None
             
-            # 流式发送响应
-            async for chunk in response_stream:
-                response_text += chunk
-                chunk_data = json.dumps({'type': 'chunk', 'content': chunk})
-                yield f"data: {chunk_data}\n\n"
-            
-            # 先发送对话完成标记
-            yield f"data: {json.dumps({'type': 'response_complete'})}\n\n"
-            
-            # 记录对话
-            conversation_record = {
-                "question": request.question,
-                "response": response_text,
-                "timestamp": datetime.now().isoformat(),
-                "round": game.current_round + 1
-            }
-            
-            game.conversation_history[character.name].append(conversation_record)
-            
-            # 限制对话历史长度
-            _trim_conversation_history(game.conversation_history, character.name)
-            
-            game.current_round += 1
-            
-            logger.info(f"对话记录完成 - 会话ID: {request.session_id}, 角色: {character.name}, 轮次: {game.current_round}")
-            
-            # 异步检查是否会揭露新证据
-            revealed_evidence = await game.evidence_system.try_reveal_evidence(
-                character, request.question, game.current_case
+            # 流式发送响应（证据揭露方式由引擎的回答模式决定），细碎的回答片段合并后再发送
+            window, max_bytes = coalesce_settings('question')
+            answer_events = coalesce_chunks(
+                game.ask_character_stream(character, request.question), window, max_bytes, chunk_event="chunk"
             )
-            
-            # 如果揭露了新证据，发送证据事件
-            if revealed_evidence:
-                evidence_data = {
-                    "type": "evidence_revealed",
-                    "evidence": {
-                        "name": revealed_evidence.name,
-                        "description": revealed_evidence.description,
-                        "significance": revealed_evidence.significance,
-                        "evidence_type": revealed_evidence.evidence_type.value
+            async for event_type, payload in answer_events:
+                if event_type == "chunk":
+                    async for piece in pacer.pace('chunk', payload):
+                        chunk_data = json.dumps({'type': 'chunk', 'content': piece})
+                        yield f"data: {chunk_data}\n\n"
+                
+                elif event_type == "response_complete":
+                    response_text = payload
+                    
+                    # 先发送对话完成标记
+                    yield f"data: {json.dumps({'type': 'response_complete'})}\n\n"
+                    
+                    # 记录对话
+                    conversation_record = {
+                        "question": request.question,
+                        "response": response_text,
+                        "timestamp": datetime.now().isoformat(),
+                        "round": game.current_round + 1
+                    }
+                    
+                    game.conversation_history[character.name].append(conversation_record)
+                    
+                    # 限制对话历史长度
+                    _trim_conversation_history(game.conversation_history, character.name)
+                    
+                    game.current_round += 1
+                    
+                    logger.info(f"对话记录完成 - 会话ID: {request.session_id}, 角色: {character.name}, 轮次: {game.current_round}")
+                
+                elif event_type == "evidence":
+                    # 如果揭露了新证据，发送证据事件
+                    revealed_evidence = payload
+                    evidence_data = {
+                        "type": "evidence_revealed",
+                        "evidence": {
+                            "name": revealed_evidence.name,
+                            "description": revealed_evidence.description,
+                            "significance": revealed_evidence.significance,
+                            "evidence_type": revealed_evidence.evidence_type.value
+                        }
                     }
-                }
-                yield f"data: {json.dumps(evidence_data)}\n\n"
+                    yield f"data: {json.dumps(evidence_data)}\n\n"
             
             # 记录到数据库
             try:
@@ -462,6 +489,14 @@ async def ask_question_stream(request: QuestionRequest):
             except Exception as db_error:
                 logger.warning(f"对话数据库记录失败 - 会话ID: {request.session_id}, 错误: {db_error}")
             
+            # 保存本轮问答后的游戏状态；同一会话的其他请求已先保存时本轮不会写入，需要通知玩家
+            if game.current_round != round_before:
+                saved = True
+                if not await game_sessions.save(request.session_id, game):
+                    logger.warning(f"本轮问答未能保存 - 会话ID: {request.session_id}, 轮次: {game.current_round}")
+                    yield f"data: {json.dumps({'type': 'error', 'code': 'session_conflict', 'message': SESSION_CONFLICT_MESSAGE})}\n\n"
+                    return
+            
             # 发送最终完成标记
             result = {
                 "type": "complete",
@@ -475,9 +510,14 @@ async def ask_question_stream(request: QuestionRequest):
         except Exception as e:
             logger.error(f"流式响应生成错误 - 会话ID: {request.session_id}, 错误: {str(e)}")
             yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+        finally:
+            # 玩家中途离开时同样保存已记录的回答
+            if not saved and game.current_round != round_before:
+                await game_sessions.save(request.session_id, game)
     
+    # 玩家关闭页面时立即停止生成，关闭上游大模型流
     return StreamingResponse(
-        generate_response(),
+        stop_on_disconnect(req, generate_response()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -494,17 +534,18 @@ async def get_hint(request: HintRequest):
     
     为玩家提供智能提示，帮助推进游戏进度
     """
-    if request.session_id not in game_sessions:
+    game = await game_sessions.load(request.session_id)
+    if game is None:
         raise HTTPException(status_code=404, detail="游戏会话不存在")
     
-    game = game_sessions[request.session_id]
-    
     if game.hints_used >= game.max_hints:
         raise HTTPException(status_code=400, detail="提示次数已用完")
     
     try:
         hint = await game._generate_intelligent_hint()
         game.hints_used += 1
+        if not await game_sessions.save(request.session_id, game):
+            raise HTTPException(status_code=409, detail=SESSION_CONFLICT_MESSAGE)
         
         return {
             "hint": hint,
@@ -512,13 +553,20 @@ async def get_hint(request: HintRequest):
             "hints_remaining": game.max_hints - game.hints_used
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"生成提示时出错 - 会话: {request.session_id}, 错误: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"生成提示时出错: {str(e)}")
 
 
+async def _batched_vote_stream(batched_votes: asyncio.Future, voter_name: str):
+    """把批量投票结果包装成单个投票者的流，所有投票者共享同一次模型调用"""
+    vote_texts = await batched_votes
+    yield vote_texts[voter_name]
+
 @game_router.post("/accusation/stream")
-async def make_accusation_stream(request: AccusationRequest):
+async def make_accusation_stream(request: AccusationRequest, req: Request):
     """
     提交指控API（流式审判）
     
@@ -527,11 +575,10 @@ async def make_accusation_stream(request: AccusationRequest):
     try:
         logger.info(f"收到指控请求 - 会话ID: {request.session_id}, 被指控者: {request.accused_name}, 理由长度: {len(request.reasoning)}")
         
-        if request.session_id not in game_sessions:
-            logger.error(f"游戏会话不存在 - 会话ID: {request.session_id}, 当前会话数: {len(game_sessions)}")
+        game = await game_sessions.load(request.session_id)
+        if game is None:
+            logger.error(f"游戏会话不存在 - 会话ID: {request.session_id}")
             raise HTTPException(status_code=404, detail="游戏会话不存在")
-        
-        game = game_sessions[request.session_id]
         logger.info(f"找到游戏会话 - 案例: {game.current_case.title if game.current_case else 'None'}")
         
         # 找到被指控的角色
@@ -556,6 +603,9 @@ async def make_accusation_stream(request: AccusationRequest):
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
     
     async def generate_trial_stream():
+        pacer = StreamPacer.from_config('accusation')
+        # 细碎的上游片段合并后再发送
+        window, max_bytes = coalesce_settings('accusation')
         try:
             logger.info(f"开始生成审判流程 - 会话ID: {request.session_id}, 被指控者: {accused.name}")
             
@@ -567,6 +617,11 @@ async def make_accusation_stream(request: AccusationRequest):
                 vote_summary={"support": 0, "oppose": 0, "total": 0}
             )
             
+            witnesses = game.accusation_system._get_witnesses(game.current_case, accused.name)
+            if GameConfig.JURY_MODE != "batched":
+                # 投票者的证据分析不依赖辩护和证词，在辩护流式输出时提前在后台计算
+                game.evidence_system.schedule_voting_analyses(game.current_case, witnesses)
+            
             # 发送开始标记
             yield f"data: {json.dumps({'type': 'start', 'accused_name': accused.name})}\n\n"
 
@@ -574,66 +629,88 @@ async def make_accusation_stream(request: AccusationRequest):
             yield f"data: {json.dumps({'type': 'step', 'step': 'defense', 'title': '被告辩护'})}\n\n"
             
             # 获取被告辩护（流式）
-            defense_stream = game.accusation_system.generate_defense_stream(
+            defense_stream = coalesce_chunks(game.accusation_system.generate_defense_stream(
                 accused, request.reasoning, game.current_case, game.conversation_history
-            )
+            ), window, max_bytes)
             
             defense_text = ""
             async for chunk in defense_stream:
                 defense_text += chunk
-                yield f"data: {json.dumps({'type': 'defense_chunk', 'content': chunk})}\n\n"
-                await asyncio.sleep(0.03)
+                async for piece in pacer.pace('defense_chunk', chunk):
+                    yield f"data: {json.dumps({'type': 'defense_chunk', 'content': piece})}\n\n"
             
+            accusation.accused_defense = defense_text
             yield f"data: {json.dumps({'type': 'defense_complete', 'defense': defense_text})}\n\n"
             
             # 步骤2: 证人证词
             yield f"data: {json.dumps({'type': 'step', 'step': 'testimonies', 'title': '证人证词'})}\n\n"
             
             witness_testimonies = []
-            witnesses = game.accusation_system._get_witnesses(game.current_case, accused.name)
-            
-            for i, witness in enumerate(witnesses):
-                yield f"data: {json.dumps({'type': 'witness_start', 'witness_name': witness.name, 'index': i})}\n\n"
-                
-                # 获取证人证词（流式）
-                testimony_stream = game.accusation_system.generate_witness_testimony_stream(
+
+            # 所有证人的证词同时生成（流式），按配置顺序输出或交错输出
+            testimony_streams = [
+                coalesce_chunks(game.accusation_system.generate_witness_testimony_stream(
                     witness, accused, request.reasoning, game.current_case, game.conversation_history
-                )
+                ), window, max_bytes)
+                for witness in witnesses
+            ]
+            testimony_texts = ["" for _ in witnesses]
+            ordered = GameConfig.TRIAL_TESTIMONY_MODE != "interleaved"
+            
+            async for event, i, chunk in multiplex_streams(testimony_streams, ordered=ordered):
+                witness = witnesses[i]
                 
-                testimony_text = ""
-                async for chunk in testimony_stream:
-                    testimony_text += chunk
-                    yield f"data: {json.dumps({'type': 'testimony_chunk', 'witness_name': witness.name, 'content': chunk})}\n\n"
-                    await asyncio.sleep(0.03)
+                if event == "start":
+                    yield f"data: {json.dumps({'type': 'witness_start', 'witness_name': witness.name, 'index': i})}\n\n"
                 
-                witness_testimonies.append({
-                    "witness_name": witness.name,
-                    "testimony": testimony_text
-                })
+                elif event == "chunk":
+                    testimony_texts[i] += chunk
+                    async for piece in pacer.pace('testimony_chunk', chunk, i):
+                        yield f"data: {json.dumps({'type': 'testimony_chunk', 'witness_name': witness.name, 'content': piece})}\n\n"
                 
-                yield f"data: {json.dumps({'type': 'witness_complete', 'witness_name': witness.name, 'testimony': testimony_text})}\n\n"
+                elif event == "end":
+                    testimony_text = testimony_texts[i]
+                    witness_testimonies.append({
+                        "witness_name": witness.name,
+                        "testimony": testimony_text
+                    })
+                    accusation.witness_testimonies.append((witness, testimony_text))
+                    
+                    yield f"data: {json.dumps({'type': 'witness_complete', 'witness_name': witness.name, 'testimony': testimony_text})}\n\n"
             
             # 步骤3: 投票过程
             yield f"data: {json.dumps({'type': 'step', 'step': 'voting', 'title': '陪审团投票'})}\n\n"
             
-            for i, voter in enumerate(witnesses):
-                yield f"data: {json.dumps({'type': 'vote_start', 'voter_name': voter.name, 'index': i})}\n\n"
-                
-                # 获取投票和理由（流式）
-                vote_stream = game.accusation_system.generate_vote_stream(
-                    voter, accusation, game.current_case, game.conversation_history
+            if GameConfig.JURY_MODE == "batched":
+                # 批量投票：一次调用得到所有投票，再逐个展示
+                batched_votes = asyncio.ensure_future(game.accusation_system.generate_batched_votes(
+                    witnesses, accusation, game.current_case, game.conversation_history
+                ))
+                vote_streams = [_batched_vote_stream(batched_votes, voter.name) for voter in witnesses]
+            else:
+                # 所有投票者并发分析（受单场审判和全局并发上限约束），按顺序逐个展示
+                vote_streams = game.accusation_system.generate_vote_streams(
+                    witnesses, accusation, game.current_case, game.conversation_history
                 )
+            vote_streams = [coalesce_chunks(stream, window, max_bytes) for stream in vote_streams]
+            vote_texts = ["" for _ in witnesses]
+            
+            async for event, i, chunk in multiplex_streams(vote_streams, ordered=True):
+                voter = witnesses[i]
                 
-                vote_data = ""
-                async for chunk in vote_stream:
-                    vote_data += chunk
-                    yield f"data: {json.dumps({'type': 'vote_chunk', 'voter_name': voter.name, 'content': chunk})}\n\n"
-                    await asyncio.sleep(0.03)
+                if event == "start":
+                    yield f"data: {json.dumps({'type': 'vote_start', 'voter_name': voter.name, 'index': i})}\n\n"
                 
-                # 解析投票结果并添加到指控对象中
-                vote_info = game.accusation_system.add_vote_to_accusation(accusation, voter, vote_data)
+                elif event == "chunk":
+                    vote_texts[i] += chunk
+                    async for piece in pacer.pace('vote_chunk', chunk, i):
+                        yield f"data: {json.dumps({'type': 'vote_chunk', 'voter_name': voter.name, 'content': piece})}\n\n"
                 
-                yield f"data: {json.dumps({'type': 'vote_complete', 'voter_name': vote_info['voter_name'], 'vote': vote_info['vote'], 'reason': vote_info['reason']})}\n\n"
+                elif event == "end":
+                    # 解析投票结果并添加到指控对象中
+                    vote_info = game.accusation_system.add_vote_to_accusation(accusation, voter, vote_texts[i])
+                    
+                    yield f"data: {json.dumps({'type': 'vote_complete', 'voter_name': vote_info['voter_name'], 'vote': vote_info['vote'], 'reason': vote_info['reason']})}\n\n"
             
             # 步骤4: 最终判决
             yield f"data: {json.dumps({'type': 'step', 'step': 'verdict', 'title': '最终判决'})}\n\n"
@@ -642,13 +719,13 @@ async def make_accusation_stream(request: AccusationRequest):
             final_verdict, is_correct = game.accusation_system.generate_accusation_result(accusation)
             
             yield f"data: {json.dumps({'type': 'vote_summary', 'vote_summary': accusation.vote_summary})}\n\n"
-            await asyncio.sleep(1)
+            await pacer.pause('vote_summary')
             
             yield f"data: {json.dumps({'type': 'verdict', 'final_verdict': final_verdict})}\n\n"
-            await asyncio.sleep(1)
+            await pacer.pause('verdict')
             
             yield f"data: {json.dumps({'type': 'correctness', 'is_correct': is_correct})}\n\n"
-            await asyncio.sleep(1)
+            await pacer.pause('correctness')
             
             # 步骤5: 案件真相
             solution_text = ""
@@ -658,8 +735,8 @@ async def make_accusation_stream(request: AccusationRequest):
             
             async for chunk in solution_stream:
                 solution_text += chunk
-                yield f"data: {json.dumps({'type': 'solution_chunk', 'content': chunk})}\n\n"
-                await asyncio.sleep(0.03)
+                async for piece in pacer.pace('solution_chunk', chunk):
+                    yield f"data: {json.dumps({'type': 'solution_chunk', 'content': piece})}\n\n"
 
             # 记录审判过程到数据库
             try:
@@ -706,8 +783,9 @@ async def make_accusation_stream(request: AccusationRequest):
             logger.error(f"流式审判过程中出错 - 会话: {request.session_id}, 被告: {accused.name}, 错误: {str(e)}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'message': f'审判过程出错: {str(e)}'})}\n\n"
     
+    # 玩家关闭页面时立即停止审判流程，关闭所有上游大模型流
     return StreamingResponse(
-        generate_trial_stream(),
+        stop_on_disconnect(req, generate_trial_stream()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -724,18 +802,17 @@ async def end_game(session_id: str):
     
     手动结束指定的游戏会话，清理相关资源
     """
-    if session_id in game_sessions:
+    if await game_sessions.remove(session_id):
         logger.info(f"结束游戏会话 - 会话ID: {session_id}")
-        del game_sessions[session_id]
         manager.disconnect(session_id)
         return {"message": "游戏会话已结束"}
     else:
         logger.warning(f"尝试结束不存在的游戏会话 - 会话ID: {session_id}")
         raise HTTPException(status_code=404, detail="游戏会话不存在")
 
-# 获取游戏会话字典的函数，供其他模块使用
+# 获取游戏会话存储的函数，供其他模块使用
 def get_game_sessions():
-    """获取游戏会话字典"""
+    """获取游戏会话存储（支持字典式访问）"""
     return game_sessions
 
 # 获取连接管理器的函数，供其他模块使用
@@ -58,7 +58,7 @@ async def submit_game_evaluation(request: GameEvaluationRequest, db: Session = D
     try:
         # 结束游戏会话（如果还没结束）
         game_sessions = get_game_sessions()
-        if request.session_id in game_sessions:
+        if await game_sessions.load(request.session_id) is not None:
             try:
                 game_recorder.end_game_session(db, request.session_id, is_solved=False)
             except Exception as e:
@@ -36,8 +36,8 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             if message["type"] == "ping":
                 await manager.send_message(session_id, {"type": "pong"})
             elif message["type"] == "get_suggested_questions":
-                if session_id in game_sessions:
-                    game = game_sessions[session_id]
+                game = await game_sessions.load(session_id)
+                if game is not None:
                     character_name = message.get("character_name")
                     character = None
                     for char in game.current_case.characters:
@@ -0,0 +1,516 @@
+"""
+游戏会话存储
+保存进行中的游戏引擎实例，支持空闲过期（TTL）、按会话数或估算内存上限的LRU淘汰，
+以及定期清理的后台任务。玩家直接关闭页面时不会调用结束接口，没有淘汰机制时会话会一直占用内存。
+被淘汰的会话在数据库中记录结束时间（不计为完成的游戏）。
+
+两种后端：
+- memory：游戏引擎只保存在当前进程中，服务只能以单个worker运行
+- database：游戏状态快照保存在数据库中，多个worker（或多台机器）共享，每个进程只缓存最近用到的游戏引擎
+
+路由通过异步接口访问会话：每个请求调用一次 load()，修改游戏状态后调用 save(session_id, game)。
+"""
+import asyncio
+import json
+import logging
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .config import GameConfig
+from .database import SessionLocal, GameSessionState
+
+logger = logging.getLogger(__name__)
+
+# 淘汰原因：ttl 空闲过期，max_sessions 超过会话数上限，max_bytes 超过内存上限
+EVICTION_REASONS = ("ttl", "max_sessions", "max_bytes")
+
+# 单个会话的固定开销估算（引擎、证据系统、审判系统等对象本身，不含对话文本）
+SESSION_BASE_BYTES = 32 * 1024
+
+def estimate_session_bytes(game) -> int:
+    """估算单个游戏会话占用的内存（固定开销 + 对话历史和证据缓存中的文本）"""
+    size = SESSION_BASE_BYTES
+    for history in (getattr(game, "conversation_history", None) or {}).values():
+        for entry in history:
+            size += sum(sys.getsizeof(value) for value in entry.values() if isinstance(value, str))
+    evidence_system = getattr(game, "evidence_system", None)
+    if evidence_system is not None:
+        size += sum(sys.getsizeof(context) for context in evidence_system.evidence_context_cache.values())
+    return size
+
+class _SessionEntry:
+    """会话条目：游戏引擎和最近访问时间"""
+
+    __slots__ = ("game", "created_at", "last_access")
+
+    def __init__(self, game, now: float):
+        self.game = game
+        self.created_at = now
+        self.last_access = now
+
+class GameSessionStore:
+    """游戏会话存储（进程内后端）
+
+    按访问顺序保存会话（最近访问的在末尾），读取会话即视为一次访问。
+    进程内后端中游戏引擎本身就是状态，save() 无需额外写入。
+    """
+
+    backend_name = "memory"
+    # 会话状态是否在多个进程之间共享
+    shared = False
+
+    def __init__(self, ttl: float = 1800, max_sessions: int = 0, max_bytes: int = 0,
+                 sweep_interval: float = 60, on_evict: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self._clock = clock
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self._pending_tasks: set = set()
+        self.evictions: Dict[str, int] = {reason: 0 for reason in EVICTION_REASONS}
+        self.sweeps = 0
+        self.last_sweep_seconds = 0.0
+        self.peak_sessions = 0
+
+    @classmethod
+    def from_config(cls, on_evict: Optional[Callable[[List[str]], Awaitable[None]]] = None) -> "GameSessionStore":
+        """根据游戏配置创建会话存储"""
+        return cls(
+            ttl=GameConfig.SESSION_TTL,
+            max_sessions=GameConfig.SESSION_MAX_COUNT,
+            max_bytes=GameConfig.SESSION_MAX_BYTES,
+            sweep_interval=GameConfig.SESSION_SWEEP_INTERVAL,
+            on_evict=on_evict
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _touch(self, session_id: str, entry: _SessionEntry):
+        entry.last_access = self._clock()
+        self._sessions.move_to_end(session_id)
+
+    def _put(self, session_id: str, game):
+        self._sessions[session_id] = _SessionEntry(game, self._clock())
+        self._sessions.move_to_end(session_id)
+        self.peak_sessions = max(self.peak_sessions, len(self._sessions))
+        self._enforce_limits()
+
+    async def load(self, session_id: str):
+        """获取会话的游戏引擎，不存在或已过期时返回None"""
+        entry = self._sessions.get(session_id)
+        if entry is None or self._expired(entry, self._clock()):
+            return None
+        self._touch(session_id, entry)
+        return entry.game
+
+    async def add(self, session_id: str, game):
+        """保存新创建的会话"""
+        self._put(session_id, game)
+
+    async def save(self, session_id: str, game) -> bool:
+        """保存路由修改后的游戏状态，返回是否写入成功"""
+        return True
+
+    async def remove(self, session_id: str) -> bool:
+        """移除会话，返回会话是否存在"""
+        return self._sessions.pop(session_id, None) is not None
+
+    def _expired(self, entry: _SessionEntry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.last_access > self.ttl
+
+    def _evict(self, session_ids: List[str], reason: str):
+        """移除会话并通知回调（在数据库中记录结束时间等）"""
+        if not session_ids:
+            return
+        for session_id in session_ids:
+            self._sessions.pop(session_id, None)
+        self.evictions[reason] += len(session_ids)
+        logger.info(f"淘汰游戏会话 - 原因: {reason}, 数量: {len(session_ids)}, 剩余会话数: {len(self._sessions)}")
+        if self.on_evict is not None:
+            self._run_callback(session_ids)
+
+    def _run_callback(self, session_ids: List[str]):
+        """在事件循环中执行异步的淘汰回调（回调中的数据库操作由回调自行放到线程中），不阻塞请求"""
+        async def run():
+            try:
+                await self.on_evict(session_ids)
+            except Exception as e:
+                logger.error(f"会话淘汰回调失败 - 错误: {str(e)}")
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            asyncio.run(run())
+            return
+
+        task = loop.create_task(run())
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+
+    def estimated_bytes(self) -> int:
+        """所有会话的估算内存总量"""
+        return sum(estimate_session_bytes(entry.game) for entry in self._sessions.values())
+
+    def _enforce_limits(self):
+        """超过会话数或内存上限时，从最久未访问的会话开始淘汰"""
+        if self.max_sessions > 0 and len(self._sessions) > self.max_sessions:
+            overflow = len(self._sessions) - self.max_sessions
+            self._evict(list(self._sessions)[:overflow], "max_sessions")
+
+        if self.max_bytes > 0:
+            sizes: List[Tuple[str, int]] = [
+                (session_id, estimate_session_bytes(entry.game)) for session_id, entry in self._sessions.items()
+            ]
+            total = sum(size for _, size in sizes)
+            victims = []
+            # 至少保留最近访问的一个会话（通常是刚创建的）
+            for session_id, size in sizes[:-1]:
+                if total <= self.max_bytes:
+                    break
+                victims.append(session_id)
+                total -= size
+            self._evict(victims, "max_bytes")
+
+    def sweep(self) -> int:
+        """清理空闲过期的会话并重新检查上限，返回淘汰的会话数"""
+        started = time.perf_counter()
+        before = sum(self.evictions.values())
+        now = self._clock()
+        expired = []
+        # 按访问顺序排列，遇到第一个未过期的会话即可停止
+        for session_id, entry in self._sessions.items():
+            if not self._expired(entry, now):
+                break
+            expired.append(session_id)
+        self._evict(expired, "ttl")
+        self._enforce_limits()
+        self.sweeps += 1
+        self.last_sweep_seconds = time.perf_counter() - started
+        return sum(self.evictions.values()) - before
+
+    async def _run_sweep(self):
+        self.sweep()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self._run_sweep()
+            except Exception as e:
+                logger.error(f"清理游戏会话失败 - 错误: {str(e)}")
+
+    def start_sweeper(self):
+        """启动后台清理任务（需要在事件循环中调用）"""
+        if self.sweep_interval > 0 and (self._sweeper is None or self._sweeper.done()):
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def stop_sweeper(self):
+        """停止后台清理任务，并等待进行中的淘汰回调完成"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        if self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
+
+    async def get_stats(self) -> Dict:
+        """获取会话存储统计"""
+        now = self._clock()
+        idle = [now - entry.last_access for entry in self._sessions.values()]
+        return {
+            "backend": self.backend_name,
+            "sessions": len(self._sessions),
+            "peak_sessions": self.peak_sessions,
+            "estimated_bytes": self.estimated_bytes(),
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "oldest_idle_seconds": round(max(idle), 1) if idle else 0.0,
+            "evictions": dict(self.evictions),
+            "sweeps": self.sweeps,
+            "last_sweep_seconds": round(self.last_sweep_seconds, 6)
+        }
+
+class DatabaseGameSessionStore(GameSessionStore):
+    """游戏会话存储（数据库后端）
+
+    游戏状态快照（DetectiveGameEngine.to_snapshot）保存在 game_session_states 表中，每次保存版本号加1。
+    每个游戏引擎对象记录它对应的版本号：读取时与数据库中的版本号一致则直接使用本进程缓存的引擎，
+    否则（其他worker修改过该会话）从快照恢复；保存时只在数据库中的版本号仍等于该引擎的版本号时写入，
+    不覆盖其他worker的修改。
+    会话数和内存上限只限制本进程的缓存，超出时丢弃缓存而不结束游戏；
+    空闲过期按最后访问（读取或保存）时间判断，由各进程的后台清理任务删除并在数据库中记录结束时间。
+    数据库访问都放到线程中执行，不阻塞事件循环。
+    """
+
+    backend_name = "database"
+    shared = True
+
+    def __init__(self, ttl: float = 1800, max_sessions: int = 0, max_bytes: int = 0,
+                 sweep_interval: float = 60, on_evict: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+                 clock: Callable[[], float] = time.monotonic, session_factory: Callable = SessionLocal,
+                 engine_factory: Optional[Callable[[Dict], object]] = None, wall_clock: Callable[[], float] = time.time):
+        super().__init__(ttl, max_sessions, max_bytes, sweep_interval, on_evict, clock)
+        self._session_factory = session_factory
+        self._engine_factory = engine_factory
+        self._wall_clock = wall_clock
+        # 游戏引擎 -> 它对应的状态版本号（引擎不再被引用时自动移除）
+        self._versions: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        # 会话ID -> [读取锁, 等待者数量]，同一会话同时读取时只恢复一个游戏引擎
+        self._load_locks: Dict[str, list] = {}
+        self.cache_hits = 0
+        self.cache_loads = 0
+        self.save_conflicts = 0
+        self.cache_evictions: Dict[str, int] = {reason: 0 for reason in EVICTION_REASONS}
+
+    def _restore(self, snapshot: Dict):
+        if self._engine_factory is not None:
+            return self._engine_factory(snapshot)
+        from .game_engine import DetectiveGameEngine
+        return DetectiveGameEngine.from_snapshot(snapshot)
+
+    def _live(self, query):
+        """过滤掉空闲过期的会话"""
+        if self.ttl > 0:
+            query = query.filter(GameSessionState.updated_at >= self._wall_clock() - self.ttl)
+        return query
+
+    def _cached_version(self, session_id: str) -> Optional[int]:
+        entry = self._sessions.get(session_id)
+        return self._versions.get(entry.game) if entry is not None else None
+
+    def _fetch(self, session_id: str, cached_version: Optional[int]) -> Optional[Tuple[int, Optional[str]]]:
+        """读取会话的版本号，与本进程缓存的版本号不同时一并读取快照（在线程中执行）
+
+        读取也算一次访问：距上次访问超过 ttl 的十分之一（最多60秒）时刷新 updated_at，
+        只通过WebSocket或状态查询使用的会话不会在使用中过期。
+        """
+        db = self._session_factory()
+        try:
+            row = self._live(db.query(GameSessionState.version, GameSessionState.updated_at).filter(
+                GameSessionState.session_id == session_id
+            )).first()
+            if row is None:
+                return None
+            version, updated_at = row
+            now = self._wall_clock()
+            if self.ttl > 0 and now - updated_at >= min(60.0, self.ttl / 10):
+                db.query(GameSessionState).filter(GameSessionState.session_id == session_id).update(
+                    {"updated_at": now}, synchronize_session=False
+                )
+                db.commit()
+            if version == cached_version:
+                return version, None
+            row = db.query(GameSessionState.version, GameSessionState.snapshot).filter(
+                GameSessionState.session_id == session_id
+            ).first()
+            return (row[0], row[1]) if row else None
+        finally:
+            db.close()
+
+    async def load(self, session_id: str):
+        """同一会话的并发读取串行执行，后到的请求直接使用先到的请求恢复的游戏引擎"""
+        lock_entry = self._load_locks.get(session_id)
+        if lock_entry is None:
+            lock_entry = self._load_locks[session_id] = [asyncio.Lock(), 0]
+        lock_entry[1] += 1
+        try:
+            async with lock_entry[0]:
+                return await self._load(session_id)
+        finally:
+            lock_entry[1] -= 1
+            if lock_entry[1] == 0:
+                self._load_locks.pop(session_id, None)
+
+    async def _load(self, session_id: str):
+        cached_version = self._cached_version(session_id)
+        result = await asyncio.to_thread(self._fetch, session_id, cached_version)
+        if result is not None and result[1] is None and self._cached_version(session_id) != result[0]:
+            # 查询期间本进程的缓存被替换或丢弃，重新读取快照
+            result = await asyncio.to_thread(self._fetch, session_id, None)
+        if result is None:
+            self._sessions.pop(session_id, None)
+            return None
+
+        version, snapshot = result
+        if snapshot is None:
+            entry = self._sessions[session_id]
+            self._touch(session_id, entry)
+            self.cache_hits += 1
+            return entry.game
+
+        game = self._restore(json.loads(snapshot))
+        self._versions[game] = version
+        self.cache_loads += 1
+        self._put(session_id, game)
+        return game
+
+    def _insert(self, session_id: str, snapshot: str):
+        db = self._session_factory()
+        try:
+            db.merge(GameSessionState(session_id=session_id, version=1, snapshot=snapshot,
+                                      updated_at=self._wall_clock()))
+            db.commit()
+        finally:
+            db.close()
+
+    async def add(self, session_id: str, game):
+        snapshot = json.dumps(game.to_snapshot(), ensure_ascii=False)
+        await asyncio.to_thread(self._insert, session_id, snapshot)
+        self._versions[game] = 1
+        self._put(session_id, game)
+
+    def _write(self, session_id: str, snapshot: str, expected_version: int) -> str:
+        """按版本号条件写入快照，返回 saved / conflict / missing（在线程中执行）"""
+        db = self._session_factory()
+        try:
+            updated = db.query(GameSessionState).filter(
+                GameSessionState.session_id == session_id,
+                GameSessionState.version == expected_version
+            ).update({
+                "snapshot": snapshot,
+                "updated_at": self._wall_clock(),
+                "version": expected_version + 1
+            }, synchronize_session=False)
+            db.commit()
+            if updated:
+                return "saved"
+            row = db.query(GameSessionState.version).filter(GameSessionState.session_id == session_id).first()
+            return "conflict" if row else "missing"
+        finally:
+            db.close()
+
+    async def save(self, session_id: str, game) -> bool:
+        """把路由修改过的游戏引擎写回数据库
+
+        其他worker在此期间已经保存过该会话（同一会话的请求被并发处理）时拒绝本次写入，
+        并丢弃本进程中过时的缓存，下次读取时从最新快照恢复。会话已被删除或过期时不再写回。
+        """
+        expected_version = self._versions.get(game)
+        if expected_version is None:
+            logger.warning(f"保存游戏会话失败，游戏引擎不是从会话存储中读取的 - 会话ID: {session_id}")
+            return False
+
+        snapshot = json.dumps(game.to_snapshot(), ensure_ascii=False)
+        outcome = await asyncio.to_thread(self._write, session_id, snapshot, expected_version)
+        entry = self._sessions.get(session_id)
+        if outcome == "saved":
+            self._versions[game] = expected_version + 1
+            if entry is None or entry.game is not game:
+                # 本进程的缓存已被丢弃（或是更早的版本），以刚保存的游戏引擎为准
+                self._put(session_id, game)
+            return True
+
+        if entry is not None and entry.game is game:
+            self._sessions.pop(session_id, None)
+        if outcome == "conflict":
+            self.save_conflicts += 1
+            logger.warning(f"游戏会话已被其他进程修改，本次修改未保存 - 会话ID: {session_id}, 版本: {expected_version}")
+        else:
+            logger.warning(f"保存游戏会话失败，会话已结束或过期 - 会话ID: {session_id}")
+        return False
+
+    def _delete(self, session_id: str) -> bool:
+        db = self._session_factory()
+        try:
+            deleted = db.query(GameSessionState).filter(
+                GameSessionState.session_id == session_id
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted > 0
+        finally:
+            db.close()
+
+    async def remove(self, session_id: str) -> bool:
+        self._sessions.pop(session_id, None)
+        return await asyncio.to_thread(self._delete, session_id)
+
+    def _evict(self, session_ids: List[str], reason: str):
+        """超过本进程的缓存上限时只丢弃缓存，游戏状态仍保存在数据库中"""
+        for session_id in session_ids:
+            self._sessions.pop(session_id, None)
+        self.cache_evictions[reason] += len(session_ids)
+
+    def _delete_expired(self) -> List[str]:
+        """删除空闲过期的会话状态，返回被删除的会话ID（在线程中执行）"""
+        if self.ttl <= 0:
+            return []
+        cutoff = self._wall_clock() - self.ttl
+        expired = []
+        db = self._session_factory()
+        try:
+            candidates = [row[0] for row in db.query(GameSessionState.session_id).filter(
+                GameSessionState.updated_at < cutoff
+            ).limit(500).all()]
+            # 多个worker同时清理时，只由成功删除的一方处理
+            for session_id in candidates:
+                if db.query(GameSessionState).filter(
+                    GameSessionState.session_id == session_id,
+                    GameSessionState.updated_at < cutoff
+                ).delete(synchronize_session=False):
+                    expired.append(session_id)
+            db.commit()
+        finally:
+            db.close()
+        return expired
+
+    def _handle_expired(self, expired: List[str], started: float) -> int:
+        for session_id in expired:
+            self._sessions.pop(session_id, None)
+        if expired:
+            self.evictions["ttl"] += len(expired)
+            logger.info(f"淘汰游戏会话 - 原因: ttl, 数量: {len(expired)}")
+            if self.on_evict is not None:
+                self._run_callback(expired)
+        self.sweeps += 1
+        self.last_sweep_seconds = time.perf_counter() - started
+        return len(expired)
+
+    def sweep(self) -> int:
+        """删除空闲过期的会话状态，并在数据库中记录结束时间"""
+        started = time.perf_counter()
+        return self._handle_expired(self._delete_expired(), started)
+
+    async def _run_sweep(self):
+        started = time.perf_counter()
+        self._handle_expired(await asyncio.to_thread(self._delete_expired), started)
+
+    def _count_live(self) -> int:
+        db = self._session_factory()
+        try:
+            return self._live(db.query(GameSessionState)).count()
+        finally:
+            db.close()
+
+    async def get_stats(self) -> Dict:
+        stats = await super().get_stats()
+        stats.update({
+            "sessions": await asyncio.to_thread(self._count_live),
+            "cached_sessions": len(self._sessions),
+            "cache_hits": self.cache_hits,
+            "cache_loads": self.cache_loads,
+            "cache_evictions": dict(self.cache_evictions),
+            "save_conflicts": self.save_conflicts
+        })
+        return stats
+
+def create_session_store(on_evict: Optional[Callable[[List[str]], Awaitable[None]]] = None) -> GameSessionStore:
+    """根据配置的会话存储后端创建会话存储"""
+    if GameConfig.SESSION_BACKEND == "database":
+        return DatabaseGameSessionStore.from_config(on_evict=on_evict)
+    if GameConfig.SESSION_BACKEND != "memory":
+        logger.warning(f"未知的会话存储后端 {GameConfig.SESSION_BACKEND}，使用进程内存储")
+    return GameSessionStore.from_config(on_evict=on_evict)
@@ -0,0 +1,466 @@
+"""
+流式输出工具
+负责SSE流式响应的节奏控制等通用逻辑
+"""
+import asyncio
+import logging
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .config import GameConfig
+
+logger = logging.getLogger(__name__)
+
+class StreamPacer:
+    """服务端流式节奏控制器
+
+    按事件类型限制每秒输出的字符数，营造打字机效果。
+    节奏基于截止时间计算：只有当上一段文字还没"打完"时才会等待，
+    上游本身比节奏慢时不会额外增加任何延迟。
+    每个流（事件类型 + 流序号）有各自的打字机，并发生成的证词、投票互不排队。
+
+    支持两种模式：
+    - off：不做任何节奏控制，收到即发送（生产环境推荐）
+    - server：在服务端按配置速率控制输出节奏
+    """
+
+    MODES = ("off", "server")
+
+    def __init__(self, mode: str = "off", rates: Optional[Dict[str, float]] = None,
+                 pauses: Optional[Dict[str, float]] = None, piece_seconds: float = 0.05,
+                 max_piece_bytes: int = 0):
+        self.mode = mode if mode in self.MODES else "off"
+        self.rates = rates or {}  # 事件类型 -> 每秒字符数
+        self.pauses = pauses or {}  # 事件类型 -> 停顿秒数
+        self.piece_seconds = piece_seconds  # 未开启片段合并时，长文本拆分后每段的目标时长
+        self.max_piece_bytes = max_piece_bytes  # 开启片段合并时单帧的字节上限，不超过的帧整帧输出
+        self._cursors: Dict[Tuple[str, Optional[int]], float] = {}  # 流 -> 打字机空闲的时间点
+
+    @classmethod
+    def from_config(cls, endpoint: Optional[str] = None) -> "StreamPacer":
+        """根据游戏配置创建节奏控制器，指定流式接口时沿用该接口的片段合并字节上限"""
+        return cls(
+            mode=GameConfig.STREAM_PACING_MODE,
+            rates=GameConfig.STREAM_PACING_RATES,
+            pauses=GameConfig.STREAM_PACING_PAUSES,
+            max_piece_bytes=coalesce_settings(endpoint)[1] if endpoint else 0
+        )
+
+    @property
+    def is_server_paced(self) -> bool:
+        return self.mode == "server"
+
+    async def _wait_for_turn(self, event_type: str, length: int, stream: Optional[int] = None):
+        """等待该流的打字机空闲，并预约本段文字的输出时长"""
+        cps = self.rates.get(event_type)
+        if not cps or length <= 0:
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        key = (event_type, stream)
+        start = max(now, self._cursors.get(key, 0.0))
+        self._cursors[key] = start + length / cps
+        delay = start - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def pace(self, event_type: str, text: str, stream: Optional[int] = None) -> AsyncGenerator[str, None]:
+        """按节奏输出一段文本，stream 区分同一事件类型下并发的多个流（如各证人的证词）
+
+        非server模式下原样输出。server模式下：
+        - 开启片段合并时，合并后的帧整帧输出，下一帧按本帧长度延后；只有超过字节上限的帧才拆分
+        - 未开启片段合并时，过长的文本会被拆成小段逐段输出
+        """
+        if not text:
+            return
+
+        cps = self.rates.get(event_type)
+        if not self.is_server_paced or not cps:
+            yield text
+            return
+
+        if self.max_piece_bytes > 0:
+            if len(text.encode("utf-8")) <= self.max_piece_bytes:
+                await self._wait_for_turn(event_type, len(text), stream)
+                yield text
+                return
+            # 按最坏情况（每个字符3字节）换算，保证拆分后的每段都不超过字节上限
+            piece_size = max(1, self.max_piece_bytes // 3)
+        else:
+            piece_size = max(1, int(cps * self.piece_seconds))
+        for i in range(0, len(text), piece_size):
+            piece = text[i:i + piece_size]
+            await self._wait_for_turn(event_type, len(piece), stream)
+            yield piece
+
+    async def pause(self, event_type: str):
+        """在关键节点停顿（例如宣布判决前），仅server模式生效"""
+        if not self.is_server_paced:
+            return
+
+        seconds = self.pauses.get(event_type, 0)
+        if seconds > 0:
+            # 停顿前先等待已预约的文字输出完毕
+            loop = asyncio.get_running_loop()
+            remaining = max(0.0, max(self._cursors.values(), default=0.0) - loop.time())
+            await asyncio.sleep(remaining + seconds)
+            self._cursors.clear()
+
+class TrailerSplitter:
+    """从流式文本中剥离结构化尾注
+
+    模型在回答末尾输出形如"<<<揭露：证据名称>>>"的尾注，
+    本类在流式过程中扣留可能属于尾注的文本，只把正文交给玩家，
+    流结束后可通过 trailer 属性取得尾注内容。
+    """
+
+    def __init__(self, marker: str, terminator: str = ">>>"):
+        self.marker = marker
+        self.terminator = terminator
+        self.trailer: Optional[str] = None
+        self._buffer = ""
+        self._in_trailer = False
+
+    def feed(self, text: str) -> str:
+        """输入一段流式文本，返回可以立即展示的正文部分"""
+        if self._in_trailer:
+            self._buffer += text
+            return ""
+
+        self._buffer += text
+        index = self._buffer.find(self.marker)
+        if index >= 0:
+            visible = self._buffer[:index]
+            self._buffer = self._buffer[index + len(self.marker):]
+            self._in_trailer = True
+            return visible
+
+        # 扣留末尾可能是标记前缀的部分，其余立即输出
+        hold = 0
+        for size in range(min(len(self.marker) - 1, len(self._buffer)), 0, -1):
+            if self.marker.startswith(self._buffer[-size:]):
+                hold = size
+                break
+        visible = self._buffer[:len(self._buffer) - hold]
+        self._buffer = self._buffer[len(self._buffer) - hold:]
+        return visible
+
+    def finish(self) -> str:
+        """流结束时调用，返回剩余的正文并解析尾注"""
+        if not self._in_trailer:
+            visible, self._buffer = self._buffer, ""
+            return visible
+
+        self.trailer = self._buffer.split(self.terminator, 1)[0].strip()
+        self._buffer = ""
+        return ""
+
+
+async def multiplex_streams(streams: List[AsyncIterator[str]],
+                            ordered: bool = True) -> AsyncGenerator[Tuple[str, int, Optional[str]], None]:
+    """并发消费多个文本流，并以事件形式合并输出
+
+    所有流同时开始生成。产出 (事件, 流序号, 文本) 元组，事件为 start/chunk/end：
+    - ordered=True：按流的顺序逐个输出，当前流实时输出，后面的流先缓冲，轮到时立即补发
+    - ordered=False：各流的片段按到达顺序交错输出
+
+    某个流抛出异常时，异常会在轮到该流输出时重新抛出。
+    """
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in streams]
+    merged: asyncio.Queue = asyncio.Queue()
+
+    async def _pump(index: int, stream: AsyncIterator[str]):
+        target = queues[index] if ordered else merged
+        try:
+            await target.put(("start", index, None))
+            async for chunk in stream:
+                await target.put(("chunk", index, chunk))
+            await target.put(("end", index, None))
+        except Exception as e:
+            await target.put(("error", index, e))
+
+    tasks = [asyncio.create_task(_pump(i, stream)) for i, stream in enumerate(streams)]
+    try:
+        if ordered:
+            for queue in queues:
+                while True:
+                    event, index, payload = await queue.get()
+                    if event == "error":
+                        raise payload
+                    yield event, index, payload
+                    if event == "end":
+                        break
+        else:
+            finished = 0
+            while finished < len(streams):
+                event, index, payload = await merged.get()
+                if event == "error":
+                    raise payload
+                yield event, index, payload
+                if event == "end":
+                    finished += 1
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in streams:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+
+
+async def bounded_stream(stream: AsyncIterator[str], *semaphores: asyncio.Semaphore) -> AsyncGenerator[str, None]:
+    """在获得全部信号量后才开始消费流，用于限制同时进行的上游调用数"""
+    acquired = []
+    try:
+        for semaphore in semaphores:
+            await semaphore.acquire()
+            acquired.append(semaphore)
+        async for chunk in stream:
+            yield chunk
+    finally:
+        for semaphore in reversed(acquired):
+            semaphore.release()
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class BroadcastCancelled(Exception):
+    """共享的上游流在所有订阅者离开后已被取消，不能再订阅"""
+    pass
+
+
+class StreamBroadcast:
+    """把一个上游文本流分发给多个消费者
+
+    上游只被消费一次；每个订阅者都会先收到已产生的全部片段，再实时收到后续片段。
+    所有订阅者都离开且上游尚未结束时，上游会被取消：取消的同时调用 on_done（调用方据此移除登记，
+    之后的相同请求会重新调用上游），之后再订阅会抛出 BroadcastCancelled，而不是收到被截断的流。
+    """
+
+    def __init__(self, source: AsyncIterator[str], on_done: Optional[Callable[[], None]] = None):
+        self._source = source
+        self._on_done = on_done
+        self._chunks: List[str] = []
+        self._error: Optional[BaseException] = None
+        self._done = False
+        self._cancelled = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _finish(self):
+        """只调用一次 on_done"""
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done()
+
+    async def _pump(self):
+        try:
+            async for chunk in self._source:
+                self._chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self._error = BroadcastCancelled()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            self._finish()
+
+    def _cancel(self):
+        self._cancelled = True
+        self._error = BroadcastCancelled()
+        self._finish()
+        self._task.cancel()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """订阅上游流，首个订阅者会启动上游"""
+        if self._cancelled:
+            raise BroadcastCancelled()
+        self._subscribers += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+        index = 0
+        try:
+            while True:
+                while index < len(self._chunks):
+                    chunk = self._chunks[index]
+                    index += 1
+                    yield chunk
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                await self._changed.wait()
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self._done:
+                self._cancel()
+
+
+async def stop_on_disconnect(request, events: AsyncIterator[str],
+                             poll_interval: float = 0.5) -> AsyncGenerator[str, None]:
+    """客户端断开连接时立即停止事件流
+
+    等待下一个事件期间定期检查连接状态，发现断开后取消正在进行的生成，
+    并关闭事件流，使其内部的上游大模型流随之关闭。
+    """
+    loop = asyncio.get_running_loop()
+    next_check = loop.time() + poll_interval
+    iterator = events.__aiter__()
+    next_event: Optional[asyncio.Future] = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(iterator.__anext__())
+            while True:
+                done, _ = await asyncio.wait({next_event}, timeout=max(0.0, next_check - loop.time()))
+                # 无论事件是否频繁，都按固定间隔检查连接状态
+                if loop.time() >= next_check:
+                    next_check = loop.time() + poll_interval
+                    if await request.is_disconnected():
+                        logger.info(f"客户端已断开，停止流式响应 - 路径: {request.url.path}")
+                        return
+                if done:
+                    break
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            next_event = None
+            yield event
+    finally:
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+            await asyncio.gather(next_event, return_exceptions=True)
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
+
+
+# 只配置了字节上限、没有配置时间窗口时使用的窗口秒数，保证上游停顿时累积的文本仍会及时输出
+DEFAULT_COALESCE_WINDOW = 0.05
+
+
+def coalesce_settings(endpoint: str) -> Tuple[float, int]:
+    """获取某个流式接口的合并参数：(时间窗口秒数, 字节上限)"""
+    window_ms = GameConfig.STREAM_COALESCE_WINDOW_MS.get(endpoint, 0)
+    max_bytes = int(GameConfig.STREAM_COALESCE_MAX_BYTES.get(endpoint, 0))
+    return window_ms / 1000.0, max_bytes
+
+
+async def coalesce_chunks(source: AsyncIterator, window: float, max_bytes: int,
+                          chunk_event: Optional[str] = None) -> AsyncGenerator:
+    """把上游的细碎文本片段合并成较大的片段，减少SSE帧数
+
+    第一个片段立即输出，保证首帧延迟；之后的片段在时间窗口内累积，
+    达到字节上限或窗口到期时合并输出。上游停顿时窗口到期也会输出，不会扣留文本；
+    只设置了字节上限（window为0）时使用 DEFAULT_COALESCE_WINDOW 作为窗口。
+    - chunk_event为空时，source产出的是文本片段
+    - chunk_event不为空时，source产出 (事件类型, 数据) 元组，只合并该类型的文本事件，
+      其他事件会先输出已累积的文本再原样输出，保持顺序
+    """
+    if window <= 0 and max_bytes <= 0:
+        async for item in source:
+            yield item
+        return
+    if window <= 0:
+        window = DEFAULT_COALESCE_WINDOW
+
+    def text_of(item) -> Optional[str]:
+        if chunk_event is None:
+            return item
+        if isinstance(item, tuple) and item[0] == chunk_event:
+            return item[1]
+        return None
+
+    def wrap(text: str):
+        return text if chunk_event is None else (chunk_event, text)
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+
+    async def _pump():
+        try:
+            async for item in source:
+                await queue.put((item, None))
+            await queue.put((end, None))
+        except Exception as e:
+            await queue.put((end, e))
+
+    pump = asyncio.create_task(_pump())
+    buffer: List[str] = []
+    buffered_bytes = 0
+    deadline: Optional[float] = None
+    first = True
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                item, error = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item, error = None, None
+
+            text = text_of(item) if item is not None and item is not end else None
+            if text is not None and first:
+                first = False
+                yield item
+                continue
+            if text is not None:
+                buffer.append(text)
+                buffered_bytes += len(text.encode("utf-8"))
+                if deadline is None:
+                    deadline = loop.time() + window
+
+            # 窗口到期、超过字节上限、遇到其他事件或流结束时输出累积的文本
+            if buffer and (item is None or text is None or (max_bytes > 0 and buffered_bytes >= max_bytes)
+                           or (deadline is not None and loop.time() >= deadline)):
+                yield wrap("".join(buffer))
+                buffer = []
+                buffered_bytes = 0
+                deadline = None
+
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            if item is not None and text is None:
+                yield item
+    finally:
+        if not pump.done():
+            pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -1656,7 +1656,10 @@ class DetectiveGameApp {
                                         this.finalizeResponse(question, responseText, data);
                                         return; // 完成后退出
                                     case 'error':
-                                        throw new Error(data.message);
+                                        // 服务端报告的错误（例如本轮问答因会话冲突未能保存），直接提示玩家
+                                        responseContainer.innerHTML = '<div class="error-message">回答失败，请重试</div>';
+                                        this.showMessage('错误', data.message);
+                                        return;
                                 }
                             }
                         } catch (e) {
@@ -2232,6 +2235,14 @@ class DetectiveGameApp {
                     testimoniesContainer = DOMHelper.$('#content-testimonies');
                 }
                 
+                // 按服务端给出的序号登记证人，证词交错到达时也能对应到正确的容器
+                if (!trialData.witnessIndexMap) {
+                    trialData.witnessIndexMap = {};
+                    trialData.witnessCounter = 0;
+                }
+                trialData.witnessIndexMap[data.witness_name] = data.index;
+                trialData.witnessCounter = Math.max(trialData.witnessCounter, data.index + 1);
+                
                 const witnessDiv = DOMHelper.createElement('div', { className: 'witness-testimony' });
                 witnessDiv.id = `witness-${data.index}`;
                 witnessDiv.innerHTML = `
@@ -1036,6 +1036,11 @@ class MobileDetectiveApp {
                             } else if (data.type === 'evidence_revealed') {
                                 this.addEvidence(data.evidence);
                                 evidenceRevealed.push(data.evidence);
+                            } else if (data.type === 'error') {
+                                // 服务端报告的错误（例如本轮问答因会话冲突未能保存）
+                                this.isCharacterSpeaking = false;
+                                this.updateSendButtonState();
+                                this.showToast(data.message, 'error');
                             } else if (data.type === 'complete') {
                                 this.completeResponse(responseContainer, fullResponse);
                                 this.updateGameStats();
@@ -1587,12 +1592,17 @@ class MobileDetectiveApp {
                     <div class="testimony-content" id="mobile-testimony-${currentWitnessIndex}"></div>
                 `);
                 testimoniesContainer.appendChild(witnessDiv);
+                // 记录证人对应的容器序号，证词交错到达时按姓名定位
+                if (!trialData.witnessSlots) trialData.witnessSlots = {};
+                trialData.witnessSlots[data.witness_name] = currentWitnessIndex;
                 trialData.witnessCount++;
                 // 新证人添加，会自动触发滚动
                 break;
                 
             case 'testimony_chunk':
-                const currentTestimonyIndex = trialData.witnessCount - 1;
+                const currentTestimonyIndex = (trialData.witnessSlots && data.witness_name in trialData.witnessSlots)
+                    ? trialData.witnessSlots[data.witness_name]
+                    : trialData.witnessCount - 1;
                 this._appendToTrialContent(`mobile-testimony-${currentTestimonyIndex}`, data.content);
                 break;
                 
@@ -1602,7 +1612,9 @@ class MobileDetectiveApp {
                     witness_name: data.witness_name,
                     testimony: data.testimony
                 });
-                const finalTestimonyIndex = trialData.testimonies.length - 1;
+                const finalTestimonyIndex = (trialData.witnessSlots && data.witness_name in trialData.witnessSlots)
+                    ? trialData.witnessSlots[data.witness_name]
+                    : trialData.testimonies.length - 1;
                 this._finalizeTrialStep(`mobile-testimony-${finalTestimonyIndex}`);
                 break;
                 
@@ -143,6 +143,12 @@ def main():
         from backend.config import GameConfig
         host = GameConfig.HOST
         port = GameConfig.PORT
+        workers = max(GameConfig.WORKERS, 1)
+        
+        # 进程内会话存储的游戏状态无法在worker之间共享
+        if workers > 1 and GameConfig.SESSION_BACKEND != "database":
+            logger.warning(f"⚠️  WORKERS={workers} 需要设置 SESSION_BACKEND=database，当前仅以单个worker运行")
+            workers = 1
         
         # 检查端口是否被占用
         import socket
@@ -170,14 +176,17 @@ def main():
         logger.info(f"📍 本地地址: http://localhost:{port}")
         logger.info(f"📍 网络地址: http://{host}:{port}")
         logger.info(f"📋 API文档: http://localhost:{port}/docs")
+        logger.info(f"⚙️  worker进程数: {workers}")
         logger.info("🛑 按 Ctrl+C 停止服务器")
         logger.info("="*50)
         
         # 配置uvicorn使用我们的日志配置
+        # 多个worker时uvicorn需要以导入路径的形式加载应用，每个worker进程各自导入
         uvicorn.run(
-            app, 
+            "backend.app:app" if workers > 1 else app, 
             host=host, 
             port=port,
+            workers=workers,
             reload=False,  # 生产环境建议关闭
             log_config=None,  # 禁用uvicorn的默认日志配置
             access_log=True
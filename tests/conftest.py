@@ -0,0 +1,13 @@
+"""
+测试公共配置
+backend.database 在导入时按 DATABASE_URL 创建数据库引擎，测试中默认使用内存SQLite，不依赖MySQL。
+"""
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
@@ -0,0 +1,108 @@
+"""大模型调用准入控制：优先级放行、丢弃、排队上限和排队超时"""
+import asyncio
+
+import pytest
+
+from backend.llm_admission import LLMAdmissionController, LLMAdmissionRejected
+
+
+def make_controller(max_concurrency=1, queue_timeout=1.0, queue_sizes=None):
+    return LLMAdmissionController(
+        max_concurrency=max_concurrency,
+        class_limits={},
+        queue_sizes=queue_sizes or {"interactive": 10, "trial": 10, "background": 10},
+        queue_timeout=queue_timeout
+    )
+
+
+def test_admits_immediately_when_capacity_is_free():
+    async def main():
+        controller = make_controller(max_concurrency=2)
+        assert await controller.acquire("character_answer") == "interactive"
+        assert await controller.acquire("vote") == "trial"
+        assert controller.active == 2
+        controller.release("interactive")
+        controller.release("trial")
+        assert controller.active == 0
+
+    asyncio.run(main())
+
+
+def test_background_requests_are_shed_when_busy():
+    async def main():
+        controller = make_controller(max_concurrency=1)
+        await controller.acquire("character_answer")
+        with pytest.raises(LLMAdmissionRejected) as info:
+            await controller.acquire("suggestion")
+        assert info.value.priority == "background"
+        assert controller.classes["background"].rejected == 1
+        # 被丢弃的请求不占用名额，也不进入队列
+        assert controller.active == 1
+        assert not controller.classes["background"].waiters
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_rejects_and_leaves_the_queue():
+    async def main():
+        controller = make_controller(max_concurrency=1, queue_timeout=0.05)
+        await controller.acquire("vote")
+        with pytest.raises(LLMAdmissionRejected) as info:
+            await controller.acquire("vote")
+        assert "超时" in info.value.reason
+        assert not controller.classes["trial"].waiters
+        assert controller.active == 1
+
+    asyncio.run(main())
+
+
+def test_full_queue_rejects_immediately():
+    async def main():
+        controller = make_controller(max_concurrency=1, queue_sizes={"trial": 1})
+        await controller.acquire("vote")
+        waiting = asyncio.create_task(controller.acquire("vote"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMAdmissionRejected) as info:
+            await controller.acquire("vote")
+        assert "已满" in info.value.reason
+        controller.release("trial")
+        assert await waiting == "trial"
+
+    asyncio.run(main())
+
+
+def test_released_slot_goes_to_the_highest_priority_waiter():
+    async def main():
+        controller = make_controller(max_concurrency=1)
+        await controller.acquire("vote")
+        order = []
+
+        async def call(call_site):
+            priority = await controller.acquire(call_site)
+            order.append(call_site)
+            controller.release(priority)
+
+        trial = asyncio.create_task(call("testimony"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call("character_answer"))
+        await asyncio.sleep(0)
+        controller.release("trial")
+        await asyncio.gather(trial, interactive)
+        assert order == ["character_answer", "testimony"]
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def main():
+        controller = make_controller(max_concurrency=1)
+        await controller.acquire("vote")
+        waiting = asyncio.create_task(controller.acquire("vote"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        controller.release("trial")
+        assert controller.active == 0
+        assert not controller.classes["trial"].waiters
+
+    asyncio.run(main())
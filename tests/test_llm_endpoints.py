@@ -0,0 +1,92 @@
+"""端点熔断器和全局重试预算"""
+from backend import llm_endpoints
+from backend.llm_endpoints import CircuitBreaker, RetryBudget
+
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(monkeypatch, threshold=3, reset_timeout=30):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_endpoints.time, "monotonic", clock)
+    return CircuitBreaker(threshold, reset_timeout), clock
+
+
+def test_breaker_opens_after_consecutive_failures(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allows_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allows_request()
+    assert breaker.open_count == 1
+
+
+def test_success_resets_the_failure_count(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_a_single_probe(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allows_request()
+    breaker.before_request()
+    assert breaker.state == "half_open"
+    # 探测请求进行中，不再放行其他请求
+    assert not breaker.allows_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allows_request()
+
+
+def test_failed_probe_reopens_the_breaker(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.open_count == 2
+    assert not breaker.allows_request()
+
+
+def test_stuck_probe_is_retried_after_the_reset_timeout(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.before_request()
+    clock.now += 30
+    assert breaker.allows_request()
+
+
+def test_retry_budget_is_spent_and_refilled_by_requests():
+    budget = RetryBudget(ratio=0.5, max_balance=2)
+    assert budget.try_acquire() and budget.try_acquire()
+    assert not budget.try_acquire()
+    assert budget.exhausted == 1
+    budget.record_request()
+    assert not budget.try_acquire()
+    budget.record_request()
+    assert budget.try_acquire()
+    assert budget.retries == 3
+
+
+def test_retry_budget_balance_is_capped():
+    budget = RetryBudget(ratio=1, max_balance=2)
+    for _ in range(10):
+        budget.record_request()
+    assert budget.balance == 2
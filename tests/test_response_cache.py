@@ -0,0 +1,97 @@
+"""大模型回应缓存：过期时间、LRU淘汰和SQLite磁盘层"""
+import asyncio
+
+from backend import response_cache as response_cache_module
+from backend.response_cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def use_clock(monkeypatch, now=1000.0) -> FakeClock:
+    clock = FakeClock(now)
+    monkeypatch.setattr(response_cache_module.time, "time", clock)
+    return clock
+
+
+def test_hit_and_miss_are_counted_per_call_site(monkeypatch):
+    use_clock(monkeypatch)
+
+    async def main():
+        cache = ResponseCache(["suggestion"], max_entries=10, ttl=60)
+        assert cache.enabled_for("suggestion") and not cache.enabled_for("vote")
+        assert await cache.get("k", "suggestion") is None
+        await cache.set("k", "回答")
+        assert await cache.get("k", "suggestion") == "回答"
+        assert cache.stats["suggestion"] == {"memory_hits": 1, "disk_hits": 0, "misses": 1}
+
+    asyncio.run(main())
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = use_clock(monkeypatch)
+
+    async def main():
+        cache = ResponseCache(["suggestion"], max_entries=10, ttl=60)
+        await cache.set("k", "回答")
+        clock.now += 59
+        assert await cache.get("k", "suggestion") == "回答"
+        clock.now += 2
+        assert await cache.get("k", "suggestion") is None
+        assert cache.get_stats()["memory_entries"] == 0
+
+    asyncio.run(main())
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    use_clock(monkeypatch)
+
+    async def main():
+        cache = ResponseCache(["suggestion"], max_entries=2, ttl=60)
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        assert await cache.get("a", "suggestion") == "A"
+        await cache.set("c", "C")
+        assert await cache.get("b", "suggestion") is None
+        assert await cache.get("a", "suggestion") == "A"
+        assert await cache.get("c", "suggestion") == "C"
+
+    asyncio.run(main())
+
+
+def test_disk_tier_survives_a_new_instance_and_refills_memory(monkeypatch, tmp_path):
+    clock = use_clock(monkeypatch)
+    path = str(tmp_path / "cache.db")
+
+    async def main():
+        first = ResponseCache(["suggestion"], max_entries=10, ttl=60, disk_path=path)
+        await first.set("k", "回答")
+        first.close()
+
+        second = ResponseCache(["suggestion"], max_entries=10, ttl=60, disk_path=path)
+        assert await second.get("k", "suggestion") == "回答"
+        assert await second.get("k", "suggestion") == "回答"
+        assert second.stats["suggestion"]["disk_hits"] == 1
+        assert second.stats["suggestion"]["memory_hits"] == 1
+        second.close()
+
+        # 磁盘层同样按写入时间过期
+        clock.now += 61
+        third = ResponseCache(["suggestion"], max_entries=10, ttl=60, disk_path=path)
+        assert await third.get("k", "suggestion") is None
+        third.close()
+
+    asyncio.run(main())
+
+
+def test_keys_differ_by_route_parameters():
+    base = ResponseCache.make_key("m", 0.7, 300, (), "提示词")
+    assert base == ResponseCache.make_key("m", 0.7, 300, (), "提示词")
+    assert base != ResponseCache.make_key("m", 0.2, 300, (), "提示词")
+    assert base != ResponseCache.make_key("m", 0.7, 300, ("\n",), "提示词")
+    assert base != ResponseCache.make_key("other", 0.7, 300, (), "提示词")
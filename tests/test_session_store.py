@@ -0,0 +1,177 @@
+"""游戏会话存储：进程内后端的淘汰，以及数据库后端的版本冲突、并发读取和空闲过期"""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base, GameSessionState
+from backend.session_store import DatabaseGameSessionStore, GameSessionStore
+
+
+class FakeGame:
+    """只包含快照所需字段的游戏引擎替身"""
+
+    def __init__(self, snapshot=None):
+        self.progress = (snapshot or {}).get("progress", 0)
+        self.conversation_history = {}
+
+    def to_snapshot(self):
+        return {"progress": self.progress}
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sessions.db'}")
+    Base.metadata.create_all(bind=engine, tables=[GameSessionState.__table__])
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def make_store(session_factory, **kwargs):
+    return DatabaseGameSessionStore(session_factory=session_factory, engine_factory=FakeGame, **kwargs)
+
+
+# 进程内后端
+
+def test_memory_store_evicts_least_recently_used_and_notifies():
+    evicted = []
+
+    async def on_evict(session_ids):
+        evicted.extend(session_ids)
+
+    async def main():
+        store = GameSessionStore(max_sessions=2, on_evict=on_evict)
+        await store.add("a", FakeGame())
+        await store.add("b", FakeGame())
+        assert await store.load("a") is not None
+        await store.add("c", FakeGame())
+        await store.stop_sweeper()
+        assert await store.load("b") is None
+        assert evicted == ["b"]
+        assert store.evictions["max_sessions"] == 1
+
+    asyncio.run(main())
+
+
+def test_memory_store_sweeps_idle_sessions():
+    clock = FakeClock()
+
+    async def main():
+        store = GameSessionStore(ttl=60, clock=clock)
+        await store.add("a", FakeGame())
+        clock.now += 61
+        assert await store.load("a") is None
+        assert store.sweep() == 1
+        assert await store.remove("a") is False
+
+    asyncio.run(main())
+
+
+# 数据库后端
+
+def test_stale_save_is_rejected_instead_of_overwriting(session_factory):
+    async def main():
+        worker_a = make_store(session_factory)
+        worker_b = make_store(session_factory)
+        await worker_a.add("s", FakeGame())
+
+        game_a = await worker_a.load("s")
+        game_b = await worker_b.load("s")
+        game_b.progress = 2
+        assert await worker_b.save("s", game_b)
+
+        game_a.progress = 1
+        assert not await worker_a.save("s", game_a)
+        assert worker_a.save_conflicts == 1
+
+        # 冲突后重新读取得到另一个worker保存的状态
+        reloaded = await worker_a.load("s")
+        assert reloaded is not game_a
+        assert reloaded.progress == 2
+
+    asyncio.run(main())
+
+
+def test_save_writes_the_given_engine_after_cache_eviction(session_factory):
+    async def main():
+        store = make_store(session_factory, max_sessions=1)
+        game = FakeGame()
+        await store.add("s", game)
+        await store.add("other", FakeGame())
+        assert "s" not in store._sessions
+
+        game.progress = 3
+        assert await store.save("s", game)
+        assert (await make_store(session_factory).load("s")).progress == 3
+
+    asyncio.run(main())
+
+
+def test_unchanged_session_is_served_from_the_cache(session_factory):
+    async def main():
+        store = make_store(session_factory)
+        game = FakeGame()
+        await store.add("s", game)
+        assert await store.load("s") is game
+        assert store.cache_hits == 1 and store.cache_loads == 0
+
+    asyncio.run(main())
+
+
+def test_concurrent_loads_share_one_engine(session_factory):
+    async def main():
+        await make_store(session_factory).add("s", FakeGame())
+        store = make_store(session_factory)
+        games = await asyncio.gather(*[store.load("s") for _ in range(5)])
+        assert all(game is games[0] for game in games)
+        assert store.cache_loads == 1
+        assert not store._load_locks
+
+    asyncio.run(main())
+
+
+def test_save_after_remove_reports_missing(session_factory):
+    async def main():
+        store = make_store(session_factory)
+        game = FakeGame()
+        await store.add("s", game)
+        assert await store.remove("s")
+        assert await store.load("s") is None
+        assert not await store.save("s", game)
+        assert store.save_conflicts == 0
+
+    asyncio.run(main())
+
+
+def test_reads_keep_a_session_alive_and_idle_ones_are_swept(session_factory):
+    wall_clock = FakeClock()
+    evicted = []
+
+    async def on_evict(session_ids):
+        evicted.extend(session_ids)
+
+    async def main():
+        store = make_store(session_factory, ttl=100, wall_clock=wall_clock, on_evict=on_evict)
+        await store.add("s", FakeGame())
+        for _ in range(5):
+            wall_clock.now += 60
+            assert await store.load("s") is not None
+            await store._run_sweep()
+        assert evicted == []
+
+        wall_clock.now += 101
+        await store._run_sweep()
+        await store.stop_sweeper()
+        assert evicted == ["s"]
+        assert await store.load("s") is None
+
+    asyncio.run(main())
@@ -0,0 +1,259 @@
+"""流式工具：广播订阅、多路合并、并发上限、片段合并、尾注剥离和节奏控制"""
+import asyncio
+
+import pytest
+
+from backend.streaming import (
+    BroadcastCancelled, StreamBroadcast, StreamPacer, TrailerSplitter,
+    bounded_stream, coalesce_chunks, multiplex_streams
+)
+
+
+async def timed_source(items, delay=0.0, error=None):
+    """按固定间隔产出片段，可选在结束时抛出异常"""
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+    if error is not None:
+        raise error
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+# StreamBroadcast
+
+def test_broadcast_late_subscriber_replays_earlier_chunks():
+    async def main():
+        broadcast = StreamBroadcast(timed_source(["a", "b", "c"], delay=0.01))
+        first = broadcast.subscribe()
+        assert await first.__anext__() == "a"
+        second = asyncio.create_task(collect(broadcast.subscribe()))
+        rest = await collect(first)
+        assert ["a"] + rest == ["a", "b", "c"]
+        assert await second == ["a", "b", "c"]
+
+    asyncio.run(main())
+
+
+def test_broadcast_forwards_upstream_errors_to_every_subscriber():
+    async def main():
+        broadcast = StreamBroadcast(timed_source(["a"], error=ValueError("boom")))
+        results = await asyncio.gather(collect(broadcast.subscribe()), collect(broadcast.subscribe()),
+                                       return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(main())
+
+
+def test_broadcast_last_subscriber_leaving_cancels_and_unregisters():
+    async def main():
+        inflight = {}
+        broadcast = StreamBroadcast(timed_source(["a", "b", "c"], delay=0.05),
+                                    on_done=lambda: inflight.pop("key", None))
+        inflight["key"] = broadcast
+        subscriber = broadcast.subscribe()
+        assert await subscriber.__anext__() == "a"
+        await subscriber.aclose()
+        # 取消的同时移除登记，之后的相同请求不会加入被截断的流
+        assert "key" not in inflight
+        assert broadcast.cancelled
+        with pytest.raises(BroadcastCancelled):
+            await collect(broadcast.subscribe())
+
+    asyncio.run(main())
+
+
+def test_broadcast_keeps_running_while_one_subscriber_remains():
+    async def main():
+        broadcast = StreamBroadcast(timed_source(["a", "b", "c"], delay=0.01))
+        leaving = broadcast.subscribe()
+        staying = asyncio.create_task(collect(broadcast.subscribe()))
+        await leaving.__anext__()
+        await leaving.aclose()
+        assert await staying == ["a", "b", "c"]
+        assert not broadcast.cancelled
+
+    asyncio.run(main())
+
+
+# multiplex_streams / bounded_stream
+
+def test_multiplex_ordered_outputs_streams_in_order():
+    async def main():
+        streams = [timed_source(["a1", "a2"], delay=0.03), timed_source(["b1", "b2"], delay=0.01)]
+        events = await collect(multiplex_streams(streams, ordered=True))
+        assert events == [
+            ("start", 0, None), ("chunk", 0, "a1"), ("chunk", 0, "a2"), ("end", 0, None),
+            ("start", 1, None), ("chunk", 1, "b1"), ("chunk", 1, "b2"), ("end", 1, None),
+        ]
+
+    asyncio.run(main())
+
+
+def test_multiplex_streams_run_concurrently():
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        streams = [timed_source(["x"], delay=0.1) for _ in range(5)]
+        await collect(multiplex_streams(streams, ordered=True))
+        assert loop.time() - started < 0.3
+
+    asyncio.run(main())
+
+
+def test_multiplex_interleaved_outputs_in_arrival_order():
+    async def main():
+        streams = [timed_source(["slow"], delay=0.05), timed_source(["fast"], delay=0.0)]
+        chunks = [payload for event, _, payload in await collect(multiplex_streams(streams, ordered=False))
+                  if event == "chunk"]
+        assert chunks == ["fast", "slow"]
+
+    asyncio.run(main())
+
+
+def test_multiplex_reraises_stream_errors_when_reached():
+    async def main():
+        streams = [timed_source(["ok"]), timed_source([], error=ValueError("boom"))]
+        events = []
+        with pytest.raises(ValueError):
+            async for event in multiplex_streams(streams, ordered=True):
+                events.append(event)
+        assert ("end", 0, None) in events
+
+    asyncio.run(main())
+
+
+def test_bounded_stream_limits_concurrency_and_releases():
+    async def main():
+        semaphore = asyncio.Semaphore(2)
+        running = 0
+        peak = 0
+
+        async def source():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            yield "x"
+            running -= 1
+
+        streams = [bounded_stream(source(), semaphore) for _ in range(5)]
+        await collect(multiplex_streams(streams, ordered=False))
+        assert peak == 2
+        assert semaphore._value == 2
+
+    asyncio.run(main())
+
+
+def test_bounded_stream_releases_when_closed_early():
+    async def main():
+        semaphore = asyncio.Semaphore(1)
+        stream = bounded_stream(timed_source(["a", "b"]), semaphore)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert not semaphore.locked()
+
+    asyncio.run(main())
+
+
+# coalesce_chunks
+
+def test_coalesce_sends_first_chunk_immediately_and_merges_the_rest():
+    async def main():
+        frames = await collect(coalesce_chunks(timed_source(["a", "b", "c", "d"]), window=0.05, max_bytes=0))
+        assert frames == ["a", "bcd"]
+
+    asyncio.run(main())
+
+
+def test_coalesce_flushes_at_byte_limit():
+    async def main():
+        frames = await collect(coalesce_chunks(timed_source(["a", "bb", "cc", "dd"]), window=10, max_bytes=4))
+        assert frames == ["a", "bbcc", "dd"]
+
+    asyncio.run(main())
+
+
+def test_coalesce_flushes_when_upstream_stalls():
+    async def main():
+        async def source():
+            yield "a"
+            yield "b"
+            await asyncio.sleep(0.3)
+            yield "c"
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        arrivals = []
+        # 只设置字节上限时也必须按时间窗口输出，不能扣留到上游结束
+        async for frame in coalesce_chunks(source(), window=0, max_bytes=1000):
+            arrivals.append((frame, loop.time() - started))
+        assert [frame for frame, _ in arrivals] == ["a", "b", "c"]
+        assert arrivals[1][1] < 0.2
+
+    asyncio.run(main())
+
+
+def test_coalesce_keeps_other_events_in_order():
+    async def main():
+        source = timed_source([("chunk", "a"), ("chunk", "b"), ("chunk", "c"), ("response_complete", "abc")])
+        frames = await collect(coalesce_chunks(source, window=10, max_bytes=0, chunk_event="chunk"))
+        assert frames == [("chunk", "a"), ("chunk", "bc"), ("response_complete", "abc")]
+
+    asyncio.run(main())
+
+
+def test_coalesce_reraises_upstream_errors_after_flushing():
+    async def main():
+        frames = []
+        with pytest.raises(ValueError):
+            async for frame in coalesce_chunks(timed_source(["a", "b"], error=ValueError("boom")), 10, 0):
+                frames.append(frame)
+        assert frames == ["a", "b"]
+
+    asyncio.run(main())
+
+
+# TrailerSplitter
+
+def test_trailer_splitter_hides_trailer_split_across_chunks():
+    splitter = TrailerSplitter("<<<揭露：")
+    visible = "".join(splitter.feed(chunk) for chunk in ["我当晚在书房", "<<", "<揭露：", "血迹", ">>>"])
+    visible += splitter.finish()
+    assert visible == "我当晚在书房"
+    assert splitter.trailer == "血迹"
+
+
+def test_trailer_splitter_releases_held_prefix_without_trailer():
+    splitter = TrailerSplitter("<<<揭露：")
+    assert splitter.feed("比较 <<") == "比较 "
+    assert splitter.feed(" 符号") == "<< 符号"
+    assert splitter.finish() == ""
+    assert splitter.trailer is None
+
+
+# StreamPacer
+
+def test_pacer_off_mode_passes_text_through():
+    async def main():
+        pacer = StreamPacer("off", rates={"chunk": 1})
+        assert await collect(pacer.pace("chunk", "很长的一段文字")) == ["很长的一段文字"]
+
+    asyncio.run(main())
+
+
+def test_pacer_streams_do_not_queue_behind_each_other():
+    async def main():
+        pacer = StreamPacer("server", rates={"testimony_chunk": 100}, max_piece_bytes=512)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(3):
+            for stream in range(3):
+                await collect(pacer.pace("testimony_chunk", "x" * 10, stream))
+        # 每个流30个字符约0.3秒；共用一个打字机时需要约0.9秒
+        assert loop.time() - started < 0.6
+
+    asyncio.run(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+提示词构建和回应解析热点的微基准测试
+不访问网络（AI服务替换为直接返回固定回应的离线实现），覆盖每轮问答和审判中的CPU开销：
+角色回答提示词构建、参考问题的三种分支、矛盾分析、投票者对话上下文、投票解析、
+证据取舍回应的逐行解析，以及SSE帧的JSON编码。
+所有案件（case_data.CASES）都会使用很长的合成对话历史各跑一遍。
+
+运行并保存结果：
+    python tools/benchmark_hot_paths.py --json bench.json
+
+与基准结果比较，任一项变慢超过阈值时以非零状态退出（可用于CI）：
+    python tools/benchmark_hot_paths.py --baseline bench.json --threshold 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+# 离线运行不需要真实的API密钥
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from backend.case_data import CASES
+from backend.evidence_system import _shared_evidence_context_cache
+from backend.game_engine import DetectiveGameEngine
+from backend.models import Case, Character
+
+# 合成对话素材
+SYNTHETIC_QUESTIONS = [
+    "案发当晚你在做什么？几点回的房间？",
+    "你什么时候最后一次见到死者？当时他在做什么？",
+    "你听到了什么声音吗？那时你在哪里？",
+    "你和死者之间有什么矛盾？",
+    "有人说看到你去了书房，你怎么解释？",
+]
+SYNTHETIC_RESPONSE = (
+    "那天晚上大概十点左右，我一直在自己的房间里看书，中间只出来倒过一次水。"
+    "当时走廊里很安静，我没有看到其他人，也没有听到什么特别的声音。"
+    "后来快到十一点的时候，我好像听到楼下有人走动，但我以为是管家在巡查，就没有在意。"
+    "说实话，我和死者平时来往不多，谈不上有什么恩怨，更不可能去害他。"
+)
+SAMPLE_VOTES = [
+    "投票：支持\n理由：被告的时间线存在明显矛盾，证词前后不一致，而且有充分的动机。",
+    "投票：反对\n理由：现有证据不足以证明被告就是凶手。",
+    "我选择支持指控，因为他的不在场证明站不住脚。",
+    "投票：[反对]",
+    "",
+]
+
+class OfflineAIService:
+    """离线AI服务：按调用点返回预先设置的回应，不发起任何网络请求"""
+
+    def __init__(self):
+        self.responses: Dict[str, str] = {}
+
+    async def get_fast_response(self, prompt: str, call_site: str = "default") -> str:
+        return self.responses.get(call_site, "")
+
+    async def get_simple_response(self, prompt: str, call_site: str = "default") -> str:
+        return self.responses.get(call_site, "")
+
+    async def get_suggestion_response(self, prompt: str, call_site: str = "suggestion") -> str:
+        return self.responses.get(call_site, "")
+
+    async def get_stream_response(self, prompt: str, call_site: str = "default"):
+        yield self.responses.get(call_site, "")
+
+def synthetic_history(case: Case, rounds: int) -> Dict[str, List[Dict]]:
+    """为案件中的每个角色生成rounds轮对话历史"""
+    history = {}
+    for char_index, character in enumerate(case.characters):
+        history[character.name] = [
+            {
+                "question": SYNTHETIC_QUESTIONS[(char_index + i) % len(SYNTHETIC_QUESTIONS)],
+                "response": f"我是{character.name}。" + SYNTHETIC_RESPONSE[(i * 7) % 40:] + SYNTHETIC_RESPONSE[:(i * 7) % 40]
+            }
+            for i in range(rounds)
+        ]
+    return history
+
+def evidence_decision_response(engine: DetectiveGameEngine, character: Character) -> str:
+    """模拟证据取舍调用的回应：每个证据一行"""
+    known = engine.evidence_system.get_character_known_evidence(character, engine.current_case)
+    return "\n".join(
+        f"{e.name}：{'会隐瞒' if i % 2 else '会提及'} - 这条证据{'对我不利' if i % 2 else '与我无关'}"
+        for i, e in enumerate(known)
+    )
+
+def sse_events(response: str) -> List[Dict]:
+    """一轮问答中路由层发送的事件"""
+    events = [{"type": "start", "character_name": "角色"}]
+    events += [{"type": "chunk", "content": response[i:i + 8]} for i in range(0, len(response), 8)]
+    events.append({"type": "response_complete"})
+    events.append({"type": "evidence_revealed", "evidence": {"name": "证据", "description": response[:60],
+                                                             "significance": response[60:100]}})
+    events.append({"type": "complete", "round_number": 12, "max_rounds": 30, "response": response,
+                   "game_state": {"current_round": 12, "hints_used": 1, "revealed_evidence": ["证据"] * 5}})
+    return events
+
+class CaseFixture:
+    """单个案件的基准测试环境"""
+
+    def __init__(self, case_index: int, rounds: int):
+        self.ai_service = OfflineAIService()
+        self.engine = DetectiveGameEngine(ai_service=self.ai_service)
+        self.engine.initialize_case(case_index)
+        self.case = self.engine.current_case
+        self.characters = self.case.characters
+        self.history = synthetic_history(self.case, rounds)
+        self.engine.conversation_history = self.history
+        self.ai_service.responses = {
+            "suggestion": "\n".join(SYNTHETIC_QUESTIONS[:3]),
+            "evidence_context": "",
+            "character_answer": SYNTHETIC_RESPONSE,
+        }
+
+    def with_history(self, history: Dict[str, List[Dict]]):
+        self.engine.conversation_history = history
+
+def build_benchmarks(fixture: CaseFixture) -> Dict[str, Callable]:
+    """返回 基准名称 -> 单次操作（同步函数或协程函数）"""
+    engine = fixture.engine
+    accusation_system = engine.accusation_system
+    evidence_system = engine.evidence_system
+    characters = fixture.characters
+    full_history = fixture.history
+    evidence_context = "【我知道的证据信息】\n" + "\n".join(f"- {e.name}：{e.description}" for e in fixture.case.evidence)
+    decisions = {c.name: evidence_decision_response(engine, c) for c in characters}
+
+    def character_prompt():
+        for character in characters:
+            engine._build_character_prompt(character, SYNTHETIC_QUESTIONS[0], evidence_context)
+
+    async def character_response_stream():
+        # 证据取舍命中缓存后的路径：读取缓存 + 构建提示词
+        engine.conversation_history = full_history
+        for character in characters:
+            stream = await engine._get_character_response_stream(character, SYNTHETIC_QUESTIONS[0])
+            await stream.aclose()
+
+    def suggested_questions(history: Dict[str, List[Dict]]):
+        async def run():
+            engine.conversation_history = history
+            for character in characters:
+                await engine._generate_suggested_questions(character)
+        return run
+
+    # 三种分支：初次询问、只有与该角色的对话、有其他人的证词
+    first_history = {c.name: [] for c in characters}
+
+    async def suggestions_followup():
+        for character in characters:
+            engine.conversation_history = {c.name: (full_history[c.name] if c is character else []) for c in characters}
+            await engine._generate_suggested_questions(character)
+
+    def contradictions():
+        for character in characters:
+            accusation_system._analyze_contradictions(character, full_history)
+
+    def conversation_context():
+        for character in characters:
+            accusation_system._build_conversation_context(character, full_history)
+
+    def parse_votes():
+        for vote_text in SAMPLE_VOTES:
+            accusation_system._parse_vote_result(vote_text)
+
+    async def evidence_context_parsing():
+        for character in characters:
+            # 清空缓存，保证每次都走AI回应的逐行解析
+            evidence_system.evidence_context_cache.clear()
+            _shared_evidence_context_cache.clear()
+            fixture.ai_service.responses["evidence_context"] = decisions[character.name]
+            await evidence_system.get_character_evidence_context(character, fixture.case)
+
+    events = sse_events(SYNTHETIC_RESPONSE * 2)
+
+    def sse_encode():
+        for event in events:
+            f"data: {json.dumps(event)}\n\n".encode("utf-8")
+
+    return {
+        "character_prompt": character_prompt,
+        "character_response_stream": character_response_stream,
+        "suggested_questions_first": suggested_questions(first_history),
+        "suggested_questions_followup": suggestions_followup,
+        "suggested_questions_contradiction": suggested_questions(full_history),
+        "analyze_contradictions": contradictions,
+        "build_conversation_context": conversation_context,
+        "parse_vote_result": parse_votes,
+        "evidence_context_parsing": evidence_context_parsing,
+        "sse_frame_encoding": sse_encode,
+    }
+
+def measure(op: Callable, loop: asyncio.AbstractEventLoop, repeat: int, min_time: float) -> List[float]:
+    """测量单次操作的耗时（秒），自动选择每轮的执行次数，返回每轮的平均耗时"""
+    is_async = asyncio.iscoroutinefunction(op)
+
+    def run(number: int) -> float:
+        if is_async:
+            async def many():
+                for _ in range(number):
+                    await op()
+            started = time.perf_counter()
+            loop.run_until_complete(many())
+        else:
+            started = time.perf_counter()
+            for _ in range(number):
+                op()
+        return time.perf_counter() - started
+
+    run(1)  # 预热（同时填充证据取舍缓存等）
+    number = 1
+    while True:
+        elapsed = run(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    return [run(number) / number for _ in range(repeat)]
+
+def run_suite(args) -> Dict:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    per_case: Dict[str, Dict[str, float]] = {}
+    try:
+        for case_index, case in enumerate(CASES):
+            fixture = CaseFixture(case_index, args.history_rounds)
+            for name, op in build_benchmarks(fixture).items():
+                if args.filter and args.filter not in name:
+                    continue
+                samples = measure(op, loop, args.repeat, args.min_time)
+                per_case.setdefault(name, {})[case.title] = statistics.median(samples)
+    finally:
+        loop.close()
+
+    # 每项基准的结果：所有案件单次操作耗时（中位数）之和
+    return {
+        name: {
+            "total_us": round(sum(times.values()) * 1e6, 2),
+            "cases": {title: round(t * 1e6, 2) for title, t in times.items()}
+        } for name, times in per_case.items()
+    }
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """返回超过阈值的回归项"""
+    regressions = []
+    print(f"\n📊 与基准对比（阈值 {threshold:.0%}）")
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or not base["total_us"]:
+            print(f"   {name:<36}{'(新增)':>12}")
+            continue
+        change = (result["total_us"] - base["total_us"]) / base["total_us"]
+        mark = "❌" if change > threshold else "✅"
+        print(f"   {mark} {name:<34}{base['total_us']:>12.1f}{result['total_us']:>12.1f}{change:>+9.1%}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词构建和回应解析热点的微基准测试")
+    parser.add_argument("--history-rounds", type=int, default=30, help="每个角色的合成对话轮数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项基准的重复轮数（取中位数）")
+    parser.add_argument("--min-time", type=float, default=0.05, help="每轮的最短测量时间（秒）")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的基准")
+    parser.add_argument("--json", default="", help="把结果写入JSON文件")
+    parser.add_argument("--baseline", default="", help="与之前保存的JSON结果对比")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的最大变慢比例，超过时以非零状态退出")
+    args = parser.parse_args()
+
+    # 保留INFO级别（日志记录本身也是热点的一部分），但不输出到终端
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.NullHandler())
+
+    print(f"⏱️  {len(CASES)} 个案件，每个角色 {args.history_rounds} 轮合成对话")
+    results = run_suite(args)
+    print(f"\n   {'基准':<34}{'总耗时(μs)':>14}")
+    for name, result in results.items():
+        print(f"   {name:<36}{result['total_us']:>14.1f}")
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "history_rounds": args.history_rounds,
+        "benchmarks": results
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 结果已写入 {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n❌ 性能回归: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ 未发现性能回归")
+
+if __name__ == "__main__":
+    main()
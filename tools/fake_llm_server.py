@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+本地模拟大模型服务（OpenAI兼容接口）
+用于离线压测和延迟测试，不消耗真实token。能识别游戏中各类提示词的格式
+（证据揭露判断、证据提及/隐瞒、投票、批量投票、单次调用的揭露尾注、建议问题、提示），
+返回可被游戏正常解析的中文回应，整个游戏流程可以完全离线跑通。
+
+同一提示词（在相同的随机种子下）总是得到相同的回应，延迟抖动和错误注入也是确定的。
+
+用法:
+    python tools/fake_llm_server.py --port 9000 --ttft 0.8 --tps 40 --error-rate 0.01
+然后让游戏指向它:
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=fake python start_game.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 单次调用模式下角色回答末尾的揭露尾注标记（与 backend/game_engine.py 保持一致）
+EVIDENCE_TRAILER_MARKER = "<<<揭露："
+
+class FakeLLMSettings:
+    """模拟服务的延迟和错误注入配置"""
+
+    def __init__(self, ttft: float = 0.5, tps: float = 40.0, jitter: float = 0.2,
+                 error_rate: float = 0.0, reveal_rate: float = 0.3, seed: int = 0):
+        self.ttft = ttft
+        self.tps = tps
+        # 抖动比例：实际延迟在 [1-jitter, 1+jitter] 倍之间
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # 证据揭露判断中回答"揭露"的比例
+        self.reveal_rate = reveal_rate
+        self.seed = seed
+
+def _rng(settings: FakeLLMSettings, prompt: str, salt: str = "") -> random.Random:
+    """按提示词生成确定的随机数序列"""
+    return random.Random(f"{settings.seed}:{salt}:{prompt}")
+
+def _section(prompt: str, title: str) -> str:
+    """提取提示词中【标题】之后到下一个【之前的内容"""
+    match = re.search(rf"【{title}】\n(.*?)(?:\n【|\Z)", prompt, re.S)
+    return match.group(1) if match else ""
+
+def _listed_evidence(section: str) -> List[str]:
+    """提取"- 证据名称：描述"格式的证据名称"""
+    names = []
+    for line in section.splitlines():
+        match = re.match(r"\s*-\s*([^：]+?)(?:（已公开）)?：", line)
+        if match:
+            names.append(match.group(1).strip())
+    return names
+
+def _character_name(prompt: str) -> str:
+    match = re.search(r"你正在扮演([^，,。\n]+)", prompt) or re.search(r"我是([^，,。\n]+)，", prompt)
+    return match.group(1).strip() if match else "我"
+
+def _answer_text(prompt: str, rng: random.Random) -> str:
+    """角色回答、辩护、证词等自由文本"""
+    name = _character_name(prompt)
+    openings = ["这件事我记得很清楚。", "您这么问，我也只能照实说。", "说实话，那天晚上的事我到现在还心有余悸。"]
+    middles = [
+        "案发前后我一直在自己的房间里，中间只出来倒过一次水。",
+        "我听到过一些动静，但当时并没有太在意，以为是风吹的。",
+        "我和死者平时来往不多，谈不上有什么恩怨。",
+        "那段时间走廊里好像有人走动，具体是谁我没有看清。"
+    ]
+    closings = ["希望这些能帮到您。", "其他的我真的不清楚了。", "您要是还有疑问，可以去问问其他人。"]
+    return f"我是{name}。{rng.choice(openings)}{rng.choice(middles)}{rng.choice(middles)}{rng.choice(closings)}"
+
+def _evidence_reveal(prompt: str, settings: FakeLLMSettings, rng: random.Random) -> str:
+    """证据揭露判断：揭露：证据名称 / 不揭露"""
+    names = _listed_evidence(_section(prompt, "我知道但尚未公开的证据"))
+    if names and rng.random() < settings.reveal_rate:
+        return f"揭露：{rng.choice(names)}"
+    return "不揭露"
+
+def _evidence_context(prompt: str, rng: random.Random) -> str:
+    """证据取舍：证据名称：会提及/会隐瞒 - 理由"""
+    guilty = "我是真凶" in prompt
+    lines = []
+    for name in _listed_evidence(_section(prompt, "我知道的证据")):
+        if guilty and rng.random() < 0.5:
+            lines.append(f"{name}：会隐瞒 - 这条证据对我不利")
+        else:
+            lines.append(f"{name}：会提及 - 这条信息与我无关，可以如实说")
+    return "\n".join(lines)
+
+def _vote(prompt: str, rng: random.Random) -> str:
+    """单个投票：投票：支持/反对 + 理由"""
+    vote = "支持" if rng.random() < 0.5 else "反对"
+    reason = "被告的时间线存在明显矛盾，证词前后不一致。" if vote == "支持" else "现有证据不足以证明被告就是凶手。"
+    return f"投票：{vote}\n理由：{reason}"
+
+def _batched_votes(prompt: str, rng: random.Random) -> str:
+    """批量投票：JSON数组"""
+    votes = []
+    for name in re.findall(r"【陪审员：([^】]+)】", prompt):
+        vote = "支持" if rng.random() < 0.5 else "反对"
+        reason = "时间线存在矛盾" if vote == "支持" else "证据不足"
+        votes.append({"voter": name, "vote": vote, "reason": reason})
+    return json.dumps(votes, ensure_ascii=False)
+
+def _single_call_answer(prompt: str, settings: FakeLLMSettings, rng: random.Random) -> str:
+    """单次调用模式：角色回答 + 揭露尾注"""
+    revealed = "无"
+    match = re.search(r"我尚未公开的证据有：(.+)", prompt)
+    if match and rng.random() < settings.reveal_rate:
+        revealed = rng.choice(match.group(1).strip().split("、"))
+    return f"{_answer_text(prompt, rng)}\n{EVIDENCE_TRAILER_MARKER}{revealed}>>>"
+
+def _suggestions(prompt: str, rng: random.Random) -> str:
+    questions = [
+        "案发当晚你具体在什么时间离开了房间？",
+        "你最后一次见到死者是什么时候？",
+        "有谁能证明你当时的行踪？",
+        "你和死者之间最近有没有发生过争执？",
+        "🔍矛盾：你之前说一直在房间，为什么有人看到你在走廊？"
+    ]
+    return "\n".join(rng.sample(questions, 3))
+
+def generate_text(prompt: str, settings: FakeLLMSettings) -> str:
+    """根据提示词格式生成回应文本"""
+    rng = _rng(settings, prompt)
+    if "揭露：证据名称" in prompt and "不揭露" in prompt:
+        return _evidence_reveal(prompt, settings, rng)
+    if "会提及/会隐瞒" in prompt:
+        return _evidence_context(prompt, rng)
+    if '[{"voter"' in prompt:
+        return _batched_votes(prompt, rng)
+    if "投票：[支持/反对]" in prompt:
+        return _vote(prompt, rng)
+    if EVIDENCE_TRAILER_MARKER in prompt:
+        return _single_call_answer(prompt, settings, rng)
+    if "请直接输出3个问题" in prompt:
+        return _suggestions(prompt, rng)
+    if "不超过50字" in prompt:
+        return "不妨再仔细比对一下各人证词中的时间线。"
+    if prompt.rstrip().endswith("分析结果："):
+        return "现有证据中，时间线和证词的矛盾最值得关注，物证还不足以直接锁定凶手。"
+    return _answer_text(prompt, rng)
+
+def tokenize(text: str) -> List[str]:
+    """把回应切分为token（中文每个字符约为一个token，连续的ASCII字符合为一个token）"""
+    return re.findall(r"[A-Za-z0-9_]+|\s+|.", text, re.S)
+
+def apply_limits(tokens: List[str], max_tokens: Optional[int], stop) -> Tuple[List[str], str]:
+    """按停止序列和最大token数截断，返回截断后的token和结束原因"""
+    finish_reason = "stop"
+    if stop:
+        text = "".join(tokens)
+        stops = [stop] if isinstance(stop, str) else list(stop)
+        cut = min((text.find(s) for s in stops if s and s in text), default=-1)
+        if cut >= 0:
+            tokens = tokenize(text[:cut])
+    if max_tokens is not None and len(tokens) > max_tokens:
+        tokens = tokens[:max_tokens]
+        finish_reason = "length"
+    return tokens, finish_reason
+
+def create_app(settings: FakeLLMSettings) -> FastAPI:
+    app = FastAPI(title="Fake LLM Server")
+    # 按提示词记录请求次数，使重复请求的错误注入和抖动各不相同但仍然可复现
+    request_counts: Dict[str, int] = {}
+
+    def delay(base: float, rng: random.Random) -> float:
+        return max(0.0, base * rng.uniform(1 - settings.jitter, 1 + settings.jitter))
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "fake-llm", "object": "model", "owned_by": "local"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        model = body.get("model", "fake-llm")
+
+        prompt_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        attempt = request_counts.get(prompt_key, 0)
+        request_counts[prompt_key] = attempt + 1
+        rng = _rng(settings, prompt, salt=str(attempt))
+
+        if rng.random() < settings.error_rate:
+            await asyncio.sleep(delay(settings.ttft, rng))
+            return JSONResponse(status_code=500, content={
+                "error": {"message": "模拟的上游错误", "type": "server_error", "code": "fake_error"}
+            })
+
+        tokens, finish_reason = apply_limits(
+            tokenize(generate_text(prompt, settings)), body.get("max_tokens"), body.get("stop")
+        )
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        ttft = delay(settings.ttft, rng)
+        token_interval = 1.0 / settings.tps if settings.tps > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + delay(token_interval * len(tokens), rng))
+            content = "".join(tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": len(tokenize(prompt)), "completion_tokens": len(tokens),
+                          "total_tokens": len(tokenize(prompt)) + len(tokens)}
+            }
+
+        def frame(delta: Dict, reason: Optional[str] = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            yield frame({"role": "assistant", "content": ""})
+            await asyncio.sleep(ttft)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(delay(token_interval, rng))
+                yield frame({"content": token})
+            yield frame({}, finish_reason)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟大模型服务（OpenAI兼容接口）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft", type=float, default=0.5, help="首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=40.0, help="生成速度（token/秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟抖动比例（0~1）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500错误的比例（0~1）")
+    parser.add_argument("--reveal-rate", type=float, default=0.3, help="证据揭露判断中回答揭露的比例（0~1）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    settings = FakeLLMSettings(
+        ttft=args.ttft, tps=args.tps, jitter=args.jitter,
+        error_rate=args.error_rate, reveal_rate=args.reveal_rate, seed=args.seed
+    )
+    print(f"🤖 模拟大模型服务: http://{args.host}:{args.port}/v1")
+    print(f"   首字延迟: {args.ttft}s, 生成速度: {args.tps} token/s, 抖动: {args.jitter}, 错误率: {args.error_rate}")
+
+    import uvicorn
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
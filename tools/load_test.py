@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+端到端压测工具
+模拟N个并发玩家，通过真实的HTTP/SSE/WebSocket接口完成整局游戏：
+开始游戏 → 多轮流式提问（期间通过WebSocket获取参考问题、请求提示）→ 流式指控。
+统计首帧延迟、首个内容帧延迟、整轮耗时的p50/p95/p99、错误率以及服务端内存（RSS）。
+
+配合本地模拟大模型和SQLite可以完全离线运行：
+    python tools/load_test.py --spawn --players 20 --questions 6
+
+按并发逐级加压，找到单个worker的饱和点：
+    python tools/load_test.py --spawn --ramp 5,10,20,40,80 --json results.json
+
+对已经启动的服务压测（指定服务进程PID以统计内存）：
+    python tools/load_test.py --base-url http://127.0.0.1:8000 --server-pid 12345 --players 50
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+project_root = Path(__file__).parent.parent
+
+# 提问素材（按角色随机组合）
+QUESTIONS = [
+    "案发当晚你在哪里？",
+    "你最后一次见到死者是什么时候？",
+    "有谁能证明你当时的行踪？",
+    "你和死者之间有什么矛盾吗？",
+    "案发前后你有没有听到什么奇怪的声音？",
+    "你觉得谁最有可能是凶手？为什么？",
+    "你为什么要隐瞒这件事？",
+    "现场发现的东西你以前见过吗？",
+    "你之前的说法和其他人的证词对不上，能解释一下吗？",
+    "死者最近有没有和谁发生过争执？",
+]
+
+# 流式接口中表示内容开始的事件类型
+CONTENT_EVENTS = ("chunk", "defense_chunk", "testimony_chunk", "vote_chunk")
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+class LoadStats:
+    """按操作类型汇总的延迟和错误统计"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+
+    def observe(self, metric: str, seconds: float):
+        self.latencies.setdefault(metric, []).append(seconds)
+
+    def count(self, operation: str, error: Optional[str] = None):
+        self.requests[operation] = self.requests.get(operation, 0) + 1
+        if error is not None:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            if len(self.error_samples) < 20:
+                self.error_samples.append(f"{operation}: {error}")
+
+    def summary(self) -> Dict:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 4) if value is not None else None
+
+        return {
+            "latency": {
+                metric: {
+                    "count": len(values),
+                    "p50": rounded(percentile(values, 0.50)),
+                    "p95": rounded(percentile(values, 0.95)),
+                    "p99": rounded(percentile(values, 0.99)),
+                    "max": rounded(max(values))
+                } for metric, values in sorted(self.latencies.items())
+            },
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": {
+                op: round(self.errors.get(op, 0) / total, 4) for op, total in self.requests.items() if total
+            },
+            "error_samples": self.error_samples
+        }
+
+async def stream_turn(client: httpx.AsyncClient, stats: LoadStats, operation: str, path: str, payload: Dict) -> bool:
+    """发起一次流式请求，记录首帧、首个内容帧和整轮耗时，返回是否成功"""
+    started = time.perf_counter()
+    first_frame = first_content = None
+    error = None
+    try:
+        async with client.stream("POST", path, json=payload) as response:
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}: {(await response.aread()).decode('utf-8', 'replace')[:200]}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    now = time.perf_counter()
+                    if first_frame is None:
+                        first_frame = now - started
+                    try:
+                        event = json.loads(line[6:])
+                    except ValueError:
+                        continue
+                    if first_content is None and event.get("type") in CONTENT_EVENTS:
+                        first_content = now - started
+                    if event.get("type") == "error":
+                        error = f"error事件: {event.get('message', '')[:200]}"
+    except (httpx.HTTPError, OSError) as e:
+        error = f"{type(e).__name__}: {e}"
+
+    stats.count(operation, error)
+    if error is None:
+        if first_frame is not None:
+            stats.observe(f"{operation}.first_frame", first_frame)
+        if first_content is not None:
+            stats.observe(f"{operation}.first_content", first_content)
+        stats.observe(f"{operation}.turn", time.perf_counter() - started)
+    return error is None
+
+async def timed_request(stats: LoadStats, operation: str, request) -> Optional[httpx.Response]:
+    """发起一次普通请求并记录耗时"""
+    started = time.perf_counter()
+    try:
+        response = await request
+    except (httpx.HTTPError, OSError) as e:
+        stats.count(operation, f"{type(e).__name__}: {e}")
+        return None
+    if response.status_code != 200:
+        stats.count(operation, f"HTTP {response.status_code}: {response.text[:200]}")
+        return None
+    stats.count(operation)
+    stats.observe(operation, time.perf_counter() - started)
+    return response
+
+async def request_suggestions(ws, stats: LoadStats, character_name: str, timeout: float):
+    """通过WebSocket请求参考问题并等待回应"""
+    started = time.perf_counter()
+    try:
+        await ws.send(json.dumps({"type": "get_suggested_questions", "character_name": character_name}))
+        deadline = started + timeout
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), timeout=max(0.01, deadline - time.perf_counter())))
+            if message.get("type") == "suggested_questions":
+                stats.count("suggestion")
+                stats.observe("suggestion", time.perf_counter() - started)
+                return
+            if message.get("type") == "error":
+                stats.count("suggestion", message.get("message", "")[:200])
+                return
+    except asyncio.TimeoutError:
+        stats.count("suggestion", "等待参考问题超时")
+    except (websockets.WebSocketException, OSError) as e:
+        stats.count("suggestion", f"{type(e).__name__}: {e}")
+
+async def simulate_player(player_id: int, args, client: httpx.AsyncClient, stats: LoadStats):
+    """模拟一个玩家完成整局游戏"""
+    rng = random.Random(f"{args.seed}:{player_id}")
+    case_index = args.case_index if args.case_index is not None else rng.randrange(args.case_count)
+
+    response = await timed_request(stats, "start", client.post(
+        "/api/game/start", json={"case_index": case_index, "client_id": f"loadtest-{uuid.uuid4().hex[:8]}"}
+    ))
+    if response is None:
+        return
+    data = response.json()
+    session_id = data["session_id"]
+    characters = [c["name"] for c in data["case"]["characters"]]
+
+    ws_url = args.base_url.replace("http", "ws", 1) + f"/ws/{session_id}"
+    try:
+        async with websockets.connect(ws_url) as ws:
+            hint_rounds = set(rng.sample(range(args.questions), min(args.hints, args.questions)))
+            suggestion_rounds = set(rng.sample(range(args.questions), min(args.suggestions, args.questions)))
+            for round_index in range(args.questions):
+                character = rng.choice(characters)
+                if round_index in suggestion_rounds:
+                    await request_suggestions(ws, stats, character, args.timeout)
+                await stream_turn(client, stats, "question", "/api/game/question/stream", {
+                    "session_id": session_id, "character_name": character, "question": rng.choice(QUESTIONS)
+                })
+                if round_index in hint_rounds:
+                    await timed_request(stats, "hint", client.post("/api/game/hint", json={"session_id": session_id}))
+                if args.think_time > 0:
+                    await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_time)
+    except (websockets.WebSocketException, OSError) as e:
+        stats.count("websocket", f"{type(e).__name__}: {e}")
+
+    await stream_turn(client, stats, "accusation", "/api/game/accusation/stream", {
+        "session_id": session_id,
+        "accused_name": rng.choice(characters),
+        "reasoning": "此人的证词前后矛盾，而且案发时间没有人能证明其行踪。"
+    })
+
+    if not args.keep_sessions:
+        try:
+            await client.delete(f"/api/game/{session_id}")
+        except httpx.HTTPError:
+            pass
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """读取进程及其子进程（多worker时）的常驻内存总量（字节），仅支持Linux"""
+    children: Dict[int, List[int]] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    total, found, pending = 0, False, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            for line in Path(f"/proc/{current}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+                    found = True
+                    break
+        except OSError:
+            continue
+        pending.extend(children.get(current, []))
+    return total if found else None
+
+class RSSSampler:
+    """后台定期采样服务端内存"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.pid is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    async def stop(self) -> Optional[Dict]:
+        if self._task is None:
+            return None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if not self.samples:
+            return None
+        mb = 1024 * 1024
+        return {
+            "start_mb": round(self.samples[0] / mb, 1),
+            "peak_mb": round(max(self.samples) / mb, 1),
+            "end_mb": round(self.samples[-1] / mb, 1)
+        }
+
+async def run_level(args, players: int) -> Dict:
+    """以指定并发运行一轮压测"""
+    stats = LoadStats()
+    sampler = RSSSampler(args.server_pid)
+    limits = httpx.Limits(max_connections=players * 2 + 10, max_keepalive_connections=players * 2 + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_player(i, args, client, stats) for i in range(players)))
+        elapsed = time.perf_counter() - started
+    result = {"players": players, "elapsed_seconds": round(elapsed, 2), **stats.summary()}
+    result["turns_per_second"] = round(stats.requests.get("question", 0) / elapsed, 2) if elapsed else 0.0
+    result["server_rss"] = await sampler.stop()
+    return result
+
+def print_level(result: Dict):
+    print(f"\n👥 并发玩家: {result['players']}  耗时: {result['elapsed_seconds']}s  提问吞吐: {result['turns_per_second']} 轮/秒")
+    print(f"   {'指标':<28}{'次数':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for metric, values in result["latency"].items():
+        print(f"   {metric:<30}{values['count']:>6}{values['p50']:>9.3f}{values['p95']:>9.3f}"
+              f"{values['p99']:>9.3f}{values['max']:>9.3f}")
+    for operation, total in sorted(result["requests"].items()):
+        errors = result["errors"].get(operation, 0)
+        if errors:
+            print(f"   ❌ {operation}: {errors}/{total} 失败 ({result['error_rate'][operation]:.1%})")
+    for sample in result["error_samples"][:5]:
+        print(f"      {sample}")
+    if result["server_rss"]:
+        rss = result["server_rss"]
+        print(f"   💾 服务端RSS: 开始 {rss['start_mb']}MB, 峰值 {rss['peak_mb']}MB, 结束 {rss['end_mb']}MB")
+
+async def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.3)
+    raise RuntimeError(f"服务在{timeout}秒内未就绪: {base_url}")
+
+def spawn_servers(args) -> List[subprocess.Popen]:
+    """启动本地模拟大模型和游戏服务（SQLite数据库）"""
+    fake_port, game_port = args.spawn_port + 1, args.spawn_port
+    db_path = Path(tempfile.gettempdir()) / f"ai_detective_loadtest_{os.getpid()}.db"
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        "OPENAI_API_KEY": "fake",
+        "DATABASE_URL": f"sqlite:///{db_path}",
+    })
+    log_file = open(db_path.with_suffix(".log"), "w", encoding="utf-8")
+    fake_llm = subprocess.Popen([
+        sys.executable, str(project_root / "tools" / "fake_llm_server.py"), "--port", str(fake_port),
+        "--ttft", str(args.fake_ttft), "--tps", str(args.fake_tps), "--error-rate", str(args.fake_error_rate)
+    ], cwd=project_root, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "backend.app:app", "--host", "127.0.0.1", "--port", str(game_port),
+        "--log-level", "warning", "--no-access-log"
+    ], cwd=project_root, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    args.base_url = f"http://127.0.0.1:{game_port}"
+    args.server_pid = server.pid
+    args.init_db = True
+    print(f"🚀 已启动模拟大模型(:{fake_port})和游戏服务(:{game_port})")
+    print(f"   数据库: {db_path}, 服务日志: {log_file.name}")
+    return [server, fake_llm]
+
+async def main_async(args) -> List[Dict]:
+    await wait_until_ready(args.base_url)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30.0) as client:
+        if args.init_db:
+            response = await client.post("/api/database/init")
+            if response.status_code != 200:
+                print(f"⚠️  数据库初始化失败: {response.text[:200]}")
+        if args.case_index is None:
+            args.case_count = len((await client.get("/api/cases")).json())
+
+    levels = [int(x) for x in args.ramp.split(",")] if args.ramp else [args.players]
+    results = []
+    for players in levels:
+        result = await run_level(args, players)
+        print_level(result)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测：模拟并发玩家完成整局游戏")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="游戏服务地址")
+    parser.add_argument("--players", type=int, default=10, help="并发玩家数")
+    parser.add_argument("--ramp", default="", help="逐级加压的并发玩家数，逗号分隔，如 5,10,20,40")
+    parser.add_argument("--questions", type=int, default=6, help="每个玩家的提问轮数")
+    parser.add_argument("--hints", type=int, default=1, help="每个玩家请求提示的次数")
+    parser.add_argument("--suggestions", type=int, default=2, help="每个玩家通过WebSocket获取参考问题的次数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="两轮提问之间的平均思考时间（秒）")
+    parser.add_argument("--case-index", type=int, default=None, help="固定使用的案件索引，默认随机")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时时间（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--keep-sessions", action="store_true", help="结束后不删除游戏会话")
+    parser.add_argument("--server-pid", type=int, default=None, help="服务进程PID，用于统计内存")
+    parser.add_argument("--init-db", action="store_true", help="压测前调用数据库初始化接口建表")
+    parser.add_argument("--json", default="", help="把结果写入JSON文件")
+    parser.add_argument("--spawn", action="store_true", help="自动启动模拟大模型和使用SQLite的游戏服务")
+    parser.add_argument("--spawn-port", type=int, default=8800, help="自动启动时游戏服务的端口（模拟大模型使用下一个端口）")
+    parser.add_argument("--fake-ttft", type=float, default=0.5, help="自动启动的模拟大模型首字延迟（秒）")
+    parser.add_argument("--fake-tps", type=float, default=40.0, help="自动启动的模拟大模型生成速度（token/秒）")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="自动启动的模拟大模型错误率")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+    args.case_count = 1
+
+    processes = spawn_servers(args) if args.spawn else []
+    try:
+        results = asyncio.run(main_async(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"base_url": args.base_url, "levels": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 结果已写入 {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+基于真实对话记录的流量回放工具
+从 conversations 表读取已记录的游戏会话（与 get_game_replay 使用相同的查询），
+按原始的提问顺序和时间间隔（可加速）向目标服务回放，得到贴近真实的问题长度和思考时间分布，
+可用于基准测试和不同版本之间的回归对比。
+
+导出最近100局有提问记录的会话（读取 DATABASE_URL 或 DB_* 配置的数据库）：
+    python tools/replay_traffic.py --export sessions.jsonl --limit 100
+
+以10倍速回放到本地服务，并与上一版本的结果对比：
+    python tools/replay_traffic.py --input sessions.jsonl --base-url http://127.0.0.1:8000 \\
+        --speedup 10 --label v1.8.0 --json v1.8.0.json --compare v1.7.0.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from load_test import LoadStats, RSSSampler, print_level, stream_turn, timed_request, wait_until_ready
+
+def load_recorded_sessions(limit: int, min_rounds: int, session_ids: List[str]) -> List[Dict]:
+    """从数据库读取会话回放数据，转换为回放脚本"""
+    from backend.database import SessionLocal, GameSession
+    from backend.game_recorder import GameRecorder
+
+    recorder = GameRecorder()
+    db = SessionLocal()
+    try:
+        if session_ids:
+            ids = session_ids
+        else:
+            ids = [row.session_id for row in db.query(GameSession.session_id).filter(
+                GameSession.total_rounds >= min_rounds
+            ).order_by(GameSession.start_time.desc()).limit(limit).all()]
+
+        scripts = []
+        for session_id in ids:
+            try:
+                script = build_script(recorder.get_game_replay(db, session_id))
+            except ValueError as e:
+                print(f"⚠️  跳过会话: {e}")
+                continue
+            if script["turns"]:
+                scripts.append(script)
+        return scripts
+    finally:
+        db.close()
+
+def build_script(replay: Dict) -> Dict:
+    """把回放数据转换为回放脚本：提问和指控按顺序排列，offset为相对会话开始的秒数
+
+    对话记录在每轮回答结束后写入，因此offset是每轮结束的时刻；相邻两轮的间隔包含了玩家的思考时间和上一轮的回答耗时。
+    """
+    info = replay["session_info"]
+    started = datetime.fromisoformat(info["start_time"])
+    turns = []
+    for conv in replay["conversations"]:
+        if conv["speaker_type"] != "player":
+            continue
+        extra = conv.get("extra_data") or {}
+        offset = max(0.0, (datetime.fromisoformat(conv["timestamp"]) - started).total_seconds())
+        if conv["message_type"] == "question" and extra.get("character_target"):
+            turns.append({"type": "question", "offset": offset,
+                          "character_name": extra["character_target"], "question": conv["content"]})
+        elif conv["message_type"] == "accusation" and extra.get("accused_name"):
+            reasoning = conv["content"].split("：", 1)[1] if "：" in conv["content"] else conv["content"]
+            turns.append({"type": "accusation", "offset": offset,
+                          "accused_name": extra["accused_name"], "reasoning": reasoning})
+    return {
+        "session_id": info["session_id"],
+        "case_title": info["case_title"],
+        "start_time": info["start_time"],
+        "turns": turns
+    }
+
+async def replay_session(script: Dict, case_index: int, start_delay: float, args,
+                         client: httpx.AsyncClient, stats: LoadStats):
+    """回放一局游戏
+
+    每个请求在 原始时间偏移/加速倍数 时发出；上一轮尚未结束时顺延，保持同一会话内请求串行。
+    """
+    await asyncio.sleep(start_delay)
+    response = await timed_request(stats, "start", client.post(
+        "/api/game/start", json={"case_index": case_index, "client_id": f"replay-{script['session_id'][:8]}"}
+    ))
+    if response is None:
+        return
+    session_id = response.json()["session_id"]
+
+    replay_started = time.perf_counter()
+    for turn in script["turns"]:
+        wait = turn["offset"] / args.speedup - (time.perf_counter() - replay_started)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if turn["type"] == "question":
+            await stream_turn(client, stats, "question", "/api/game/question/stream", {
+                "session_id": session_id, "character_name": turn["character_name"], "question": turn["question"]
+            })
+        else:
+            await stream_turn(client, stats, "accusation", "/api/game/accusation/stream", {
+                "session_id": session_id, "accused_name": turn["accused_name"], "reasoning": turn["reasoning"]
+            })
+
+    try:
+        await client.delete(f"/api/game/{session_id}")
+    except httpx.HTTPError:
+        pass
+
+async def run_replay(args, scripts: List[Dict]) -> Dict:
+    await wait_until_ready(args.base_url)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30.0) as client:
+        cases = (await client.get("/api/cases")).json()
+    case_indexes = {case["title"]: i for i, case in enumerate(cases)}
+
+    playable = [s for s in scripts if s["case_title"] in case_indexes]
+    if len(playable) < len(scripts):
+        print(f"⚠️  {len(scripts) - len(playable)} 局会话的案件在目标服务中不存在，已跳过")
+    if not playable:
+        raise SystemExit("没有可回放的会话")
+
+    # 会话到达时间：recorded 保持原始的相对开始时间（同样加速），immediate 全部同时开始
+    if args.arrival == "recorded":
+        first_start = min(datetime.fromisoformat(s["start_time"]) for s in playable)
+        delays = [(datetime.fromisoformat(s["start_time"]) - first_start).total_seconds() / args.speedup
+                  for s in playable]
+    else:
+        delays = [0.0] * len(playable)
+
+    stats = LoadStats()
+    sampler = RSSSampler(args.server_pid)
+    semaphore = asyncio.Semaphore(args.concurrency) if args.concurrency > 0 else None
+    limits = httpx.Limits(max_connections=len(playable) * 2 + 10, max_keepalive_connections=len(playable) * 2 + 10)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        async def run_one(script: Dict, delay: float):
+            if semaphore is None:
+                await replay_session(script, case_indexes[script["case_title"]], delay, args, client, stats)
+                return
+            await asyncio.sleep(delay)
+            async with semaphore:
+                await replay_session(script, case_indexes[script["case_title"]], 0.0, args, client, stats)
+
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(run_one(s, d) for s, d in zip(playable, delays)))
+        elapsed = time.perf_counter() - started
+
+    result = {"players": len(playable), "elapsed_seconds": round(elapsed, 2), **stats.summary()}
+    result["turns_per_second"] = round(stats.requests.get("question", 0) / elapsed, 2) if elapsed else 0.0
+    result["server_rss"] = await sampler.stop()
+    return result
+
+def compare_results(current: Dict, baseline: Dict):
+    """与基准结果对比各延迟指标的p50/p95"""
+    print(f"\n📊 与基准对比（{baseline.get('label') or '基准'} → {current.get('label') or '当前'}）")
+    print(f"   {'指标':<28}{'p50 基准':>10}{'p50 当前':>10}{'变化':>9}{'p95 基准':>10}{'p95 当前':>10}{'变化':>9}")
+    for metric, values in current["result"]["latency"].items():
+        base = baseline["result"]["latency"].get(metric)
+        if not base:
+            continue
+
+        def change(key: str) -> str:
+            if not base[key]:
+                return "-"
+            return f"{(values[key] - base[key]) / base[key]:+.1%}"
+
+        print(f"   {metric:<30}{base['p50']:>10.3f}{values['p50']:>10.3f}{change('p50'):>9}"
+              f"{base['p95']:>10.3f}{values['p95']:>10.3f}{change('p95'):>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="基于真实对话记录回放流量")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="目标游戏服务地址")
+    parser.add_argument("--input", default="", help="从导出的JSONL文件读取会话（不指定则直接读取数据库）")
+    parser.add_argument("--export", default="", help="只把数据库中的会话导出为JSONL文件，不回放")
+    parser.add_argument("--session-id", action="append", default=[], help="只回放指定的会话，可重复")
+    parser.add_argument("--limit", type=int, default=50, help="从数据库读取的最近会话数")
+    parser.add_argument("--min-rounds", type=int, default=1, help="只读取提问轮数不少于该值的会话")
+    parser.add_argument("--sample", type=int, default=0, help="从读取的会话中随机抽取的局数，0表示全部")
+    parser.add_argument("--speedup", type=float, default=1.0, help="时间加速倍数")
+    parser.add_argument("--arrival", choices=["recorded", "immediate"], default="recorded",
+                        help="会话开始时间：recorded 保持原始间隔，immediate 同时开始")
+    parser.add_argument("--concurrency", type=int, default=0, help="同时进行的会话数上限，0表示不限制")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单个请求的超时时间（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="抽样使用的随机种子")
+    parser.add_argument("--server-pid", type=int, default=None, help="服务进程PID，用于统计内存")
+    parser.add_argument("--label", default="", help="本次结果的标签（如版本号）")
+    parser.add_argument("--json", default="", help="把结果写入JSON文件")
+    parser.add_argument("--compare", default="", help="与之前保存的JSON结果对比")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+    args.speedup = max(args.speedup, 0.001)
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            scripts = [json.loads(line) for line in f if line.strip()]
+    else:
+        scripts = load_recorded_sessions(args.limit, args.min_rounds, args.session_id)
+    if args.sample and args.sample < len(scripts):
+        scripts = random.Random(args.seed).sample(scripts, args.sample)
+
+    question_count = sum(1 for s in scripts for t in s["turns"] if t["type"] == "question")
+    print(f"📼 读取到 {len(scripts)} 局会话，共 {question_count} 次提问")
+
+    if args.export:
+        with open(args.export, "w", encoding="utf-8") as f:
+            for script in scripts:
+                f.write(json.dumps(script, ensure_ascii=False) + "\n")
+        print(f"📄 已导出到 {args.export}")
+        return
+
+    result = asyncio.run(run_replay(args, scripts))
+    print_level(result)
+    output = {"label": args.label, "base_url": args.base_url, "speedup": args.speedup, "result": result}
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare_results(output, json.load(f))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 结果已写入 {args.json}")
+
+if __name__ == "__main__":
+    main()
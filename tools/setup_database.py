@@ -142,6 +142,7 @@ def main():
     print("   - game_sessions: 游戏会话表")
     print("   - conversations: 对话记录表")
     print("   - game_evaluations: 游戏评价表")
+    print("   - game_session_states: 游戏会话状态表（多worker部署使用）")
     print("\n现在可以启动游戏服务器了！")
     print("运行命令: python start_game.py")
 